@@ -1,9 +1,16 @@
+import logging
 import os
 from typing import TYPE_CHECKING, Dict, List, Optional, Any
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
 
+from resources.api.clients import get_aws_client
+
+logger = logging.getLogger(__name__)
+
+# Route53 accepts at most 1000 changes per ChangeResourceRecordSets call.
+ROUTE53_MAX_CHANGES = 1000
+
 if TYPE_CHECKING:
     from mypy_boto3_route53.client import Route53Client
     from mypy_boto3_route53domains.client import Route53DomainsClient
@@ -21,11 +28,11 @@ def get_route53_client() -> "Route53Client":
             "AWS_SECRET_ACCESS_KEY environment variables."
         )
     
-    return boto3.client(
+    return get_aws_client(
         "route53",
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name=region
+        region_name=region,
+        access_key_id=access_key,
+        secret_access_key=secret_key
     )
 
 
@@ -41,11 +48,11 @@ def get_route53domains_client() -> "Route53DomainsClient":
             "AWS_SECRET_ACCESS_KEY environment variables."
         )
     
-    return boto3.client(
+    return get_aws_client(
         "route53domains",
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name=region
+        region_name=region,
+        access_key_id=access_key,
+        secret_access_key=secret_key
     )
 
 
@@ -58,10 +65,10 @@ def create_hosted_zone(domain_name: str) -> Optional[str]:
             CallerReference=f"{domain_name}-{int(__import__('time').time())}"
         )
         hosted_zone_id = response["HostedZone"]["Id"].split("/")[-1]
-        print(f"Created hosted zone for {domain_name}: {hosted_zone_id}")
+        logger.info("Created hosted zone", extra={"domain": domain_name, "hosted_zone_id": hosted_zone_id})
         return hosted_zone_id
     except (BotoCoreError, ClientError) as e:
-        print(f"Error creating hosted zone: {e}")
+        logger.error("Error creating hosted zone", extra={"domain": domain_name, "error": str(e)})
         return None
 
 
@@ -96,14 +103,93 @@ def update_dns_record(
         )
         
         change_id = response["ChangeInfo"]["Id"]
-        print(f"DNS record updated: {record_name} -> {record_value} (Change ID: {change_id})")
+        logger.info("DNS record updated", extra={"record_name": record_name, "record_value": record_value, "change_id": change_id})
         return True
         
     except (BotoCoreError, ClientError) as e:
-        print(f"Error updating DNS record: {e}")
+        logger.error("Error updating DNS record", extra={"record_name": record_name, "error": str(e)})
         return False
 
 
+def upsert_dns_records(
+    hosted_zone_id: str,
+    records: List[Dict[str, str]],
+    ttl: int = 300,
+    batch_size: int = ROUTE53_MAX_CHANGES
+) -> bool:
+    """
+    Upsert many DNS records with as few Route53 calls as possible.
+
+    ``records`` are dicts with ``name``, ``type`` and ``value`` keys; they are
+    sent in change batches of up to ``batch_size`` (at most 1000) records.
+    """
+    try:
+        route53 = get_route53_client()
+        batch_size = min(batch_size, ROUTE53_MAX_CHANGES)
+        for start in range(0, len(records), batch_size):
+            batch = records[start:start + batch_size]
+            response = route53.change_resource_record_sets(
+                HostedZoneId=hosted_zone_id,
+                ChangeBatch={
+                    "Changes": [
+                        {
+                            "Action": "UPSERT",
+                            "ResourceRecordSet": {
+                                "Name": record["name"],
+                                "Type": record["type"],
+                                "TTL": ttl,
+                                "ResourceRecords": [{"Value": record["value"]}]
+                            }
+                        }
+                        for record in batch
+                    ]
+                }
+            )
+            logger.info("DNS records updated", extra={
+                "hosted_zone_id": hosted_zone_id,
+                "count": len(batch),
+                "change_id": response["ChangeInfo"]["Id"]
+            })
+        return True
+
+    except (BotoCoreError, ClientError) as e:
+        logger.error("Error updating DNS records", extra={"hosted_zone_id": hosted_zone_id, "error": str(e)})
+        return False
+
+
+def list_all_dns_records(hosted_zone_id: str) -> List[Dict[str, Any]]:
+    """Every record set of a hosted zone, as returned by Route53, following pagination."""
+    route53 = get_route53_client()
+    paginator = route53.get_paginator("list_resource_record_sets")
+    return [
+        record_set
+        for page in paginator.paginate(HostedZoneId=hosted_zone_id)
+        for record_set in page["ResourceRecordSets"]
+    ]
+
+
+def change_dns_records(hosted_zone_id: str, changes: List[Dict[str, Any]], batch_size: int = ROUTE53_MAX_CHANGES) -> int:
+    """
+    Send ``Changes`` entries (UPSERT/DELETE/CREATE) in batches of up to
+    ``batch_size`` (at most 1000); return the number of calls made.
+
+    Errors are raised: a caller applying a plan needs to know which batch failed.
+    """
+    route53 = get_route53_client()
+    batch_size = min(batch_size, ROUTE53_MAX_CHANGES)
+    calls = 0
+    for start in range(0, len(changes), batch_size):
+        batch = changes[start:start + batch_size]
+        response = route53.change_resource_record_sets(HostedZoneId=hosted_zone_id, ChangeBatch={"Changes": batch})
+        calls += 1
+        logger.info("DNS records changed", extra={
+            "hosted_zone_id": hosted_zone_id,
+            "count": len(batch),
+            "change_id": response["ChangeInfo"]["Id"]
+        })
+    return calls
+
+
 def route_domain_to_ip(domain_name: str, ip_address: str, hosted_zone_id: Optional[str] = None) -> bool:
     """Route a domain to an IP address using A record."""
     try:
@@ -111,7 +197,7 @@ def route_domain_to_ip(domain_name: str, ip_address: str, hosted_zone_id: Option
             # Try to find existing hosted zone
             hosted_zone_id = get_hosted_zone_id(domain_name)
             if not hosted_zone_id:
-                print(f"No hosted zone found for {domain_name}. Creating one...")
+                logger.info("No hosted zone found, creating one", extra={"domain": domain_name})
                 hosted_zone_id = create_hosted_zone(domain_name)
                 if not hosted_zone_id:
                     return False
@@ -119,7 +205,7 @@ def route_domain_to_ip(domain_name: str, ip_address: str, hosted_zone_id: Option
         return update_dns_record(hosted_zone_id, domain_name, "A", ip_address)
         
     except Exception as e:
-        print(f"Error routing domain to IP: {e}")
+        logger.error("Error routing domain to IP", extra={"domain": domain_name, "error": str(e)})
         return False
 
 
@@ -133,7 +219,7 @@ def route_domain_to_load_balancer(
         if not hosted_zone_id:
             hosted_zone_id = get_hosted_zone_id(domain_name)
             if not hosted_zone_id:
-                print(f"No hosted zone found for {domain_name}. Creating one...")
+                logger.info("No hosted zone found, creating one", extra={"domain": domain_name})
                 hosted_zone_id = create_hosted_zone(domain_name)
                 if not hosted_zone_id:
                     return False
@@ -141,7 +227,7 @@ def route_domain_to_load_balancer(
         return update_dns_record(hosted_zone_id, domain_name, "CNAME", load_balancer_dns)
         
     except Exception as e:
-        print(f"Error routing domain to load balancer: {e}")
+        logger.error("Error routing domain to load balancer", extra={"domain": domain_name, "error": str(e)})
         return False
 
 
@@ -158,7 +244,7 @@ def get_hosted_zone_id(domain_name: str) -> Optional[str]:
         return None
         
     except (BotoCoreError, ClientError) as e:
-        print(f"Error getting hosted zone ID: {e}")
+        logger.error("Error getting hosted zone ID", extra={"domain": domain_name, "error": str(e)})
         return None
 
 
@@ -180,7 +266,7 @@ def list_dns_records(hosted_zone_id: str) -> Optional[List[Dict[str, Any]]]:
         return records
         
     except (BotoCoreError, ClientError) as e:
-        print(f"Error listing DNS records: {e}")
+        logger.error("Error listing DNS records", extra={"hosted_zone_id": hosted_zone_id, "error": str(e)})
         return None
 
 
@@ -198,7 +284,7 @@ def delete_dns_record(hosted_zone_id: str, record_name: str, record_type: str) -
         )
         
         if not response["ResourceRecordSets"]:
-            print(f"Record {record_name} ({record_type}) not found")
+            logger.warning("DNS record not found", extra={"record_name": record_name, "record_type": record_type})
             return False
         
         record_set = response["ResourceRecordSets"][0]
@@ -217,11 +303,11 @@ def delete_dns_record(hosted_zone_id: str, record_name: str, record_type: str) -
             ChangeBatch=change_batch
         )
         
-        print(f"Deleted DNS record: {record_name} ({record_type})")
+        logger.info("Deleted DNS record", extra={"record_name": record_name, "record_type": record_type})
         return True
         
     except (BotoCoreError, ClientError) as e:
-        print(f"Error deleting DNS record: {e}")
+        logger.error("Error deleting DNS record", extra={"record_name": record_name, "error": str(e)})
         return False
 
 
@@ -0,0 +1,104 @@
+"""
+Reads from a replica, writes to the primary.
+
+When ``DATABASES`` has a ``replica`` alias (``DB_REPLICA_HOST``),
+``ReplicaRoutingMiddleware`` lets safe requests (GET, HEAD, OPTIONS), i.e.
+the dashboard, status and row polls, metrics pages and admin listings,
+read from it, so they don't compete with sync's write bursts on the
+primary. Everything else reads from the primary: unsafe requests,
+management commands, background threads, and any query inside a
+transaction.
+
+The first write of a request pins the rest of it to the primary. The
+response then sets a cookie that keeps the user's reads on the primary for
+``DB_REPLICA_STICKY_SECONDS``, so someone who just started an instance
+doesn't see the replica's older row on the next poll. Code outside a
+request can opt into replica reads for reporting with ``replica_reads()``.
+"""
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import HttpRequest, HttpResponse
+
+REPLICA = 'replica'
+STICKY_COOKIE = 'db_primary'
+SAFE_METHODS: tuple[str, ...] = ('GET', 'HEAD', 'OPTIONS')
+
+
+@dataclass
+class RoutingState:
+    use_replica: bool = False
+    wrote: bool = False
+
+
+current_routing: ContextVar[RoutingState | None] = ContextVar('current_routing', default=None)
+
+
+def replica_configured() -> bool:
+    return REPLICA in settings.DATABASES
+
+
+@contextmanager
+def replica_reads() -> Iterator[RoutingState]:
+    """Send the reads in the block to the replica, until the block writes."""
+    state = RoutingState(use_replica=True)
+    token = current_routing.set(state)
+    try:
+        yield state
+    finally:
+        current_routing.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints) -> str | None:
+        state = current_routing.get()
+        if state is None or not state.use_replica or state.wrote or not replica_configured():
+            return None
+        # Reads inside a transaction must see its writes (and take its locks)
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return REPLICA
+
+    def db_for_write(self, model, **hints) -> str:
+        state = current_routing.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints) -> bool:
+        # Both aliases hold the same data
+        return True
+
+    def allow_migrate(self, db: str, app_label: str, model_name: str | None = None, **hints) -> bool:
+        return db != REPLICA
+
+
+class ReplicaRoutingMiddleware:
+    """Route a safe request's reads to the replica unless its user wrote something moments ago."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        state = RoutingState(use_replica=request.method in SAFE_METHODS and STICKY_COOKIE not in request.COOKIES)
+        token = current_routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_routing.reset(token)
+        if state.wrote:
+            response.set_cookie(
+                STICKY_COOKIE,
+                '1',
+                max_age=getattr(settings, 'DB_REPLICA_STICKY_SECONDS', 10),
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
@@ -0,0 +1,42 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+# Attributes every LogRecord has; anything else was passed through ``extra``.
+RESERVED_ATTRS: frozenset[str] = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def extra_fields(record: logging.LogRecord) -> dict[str, object]:
+    """Return the fields passed to the logging call through ``extra``."""
+    return {
+        key: value
+        for key, value in record.__dict__.items()
+        if key not in RESERVED_ATTRS and not key.startswith('_')
+    }
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Standard text format with ``extra`` fields appended as key=value pairs."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        fields = extra_fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    """Format log records as one JSON object per line, including ``extra`` fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload: dict[str, object] = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        payload.update(extra_fields(record))
+        if record.exc_info:
+            payload['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(payload, default=str)
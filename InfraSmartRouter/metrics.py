@@ -0,0 +1,237 @@
+"""
+In-process metrics with a Prometheus text exposition at ``/metrics``.
+
+Counters and histograms are kept per worker process; scrape every worker (or
+run a single one) if you need the full picture. When ``settings.METRICS_ENABLED``
+is off, ``timed`` and the AWS/view hooks do nothing beyond a settings lookup.
+"""
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+DEFAULT_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def metrics_enabled() -> bool:
+    return getattr(settings, 'METRICS_ENABLED', True)
+
+
+def _escape(value: object) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(tuple(str(labels.get(name, '')) for name in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labelnames: tuple[str, ...] = labelnames
+        self.buckets: tuple[float, ...] = buckets
+        # label values -> [per-bucket counts..., count, sum]
+        self._values: dict[tuple[str, ...], list[float]] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0.0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[index] += 1
+                    break
+            series[-2] += 1
+            series[-1] += value
+
+    def count(self, **labels: str) -> int:
+        series = self._values.get(tuple(str(labels.get(name, '')) for name in self.labelnames))
+        return int(series[-2]) if series else 0
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._values.items())
+        for key, series in items:
+            cumulative = 0.0
+            for bound, bucket_count in zip(self.buckets, series):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            le = 'le="+Inf"'
+            lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {series[-2]}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {series[-2]}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {series[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Counter | Histogram] = {}
+        self._collectors: list[Callable[[], list[str]]] = []
+        self._lock: threading.Lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        with self._lock:
+            metric = self._metrics.setdefault(name, Counter(name, documentation, labelnames))
+        assert isinstance(metric, Counter)
+        return metric
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        with self._lock:
+            metric = self._metrics.setdefault(name, Histogram(name, documentation, labelnames, buckets))
+        assert isinstance(metric, Histogram)
+        return metric
+
+    def register_collector(self, collector: Callable[[], list[str]]) -> None:
+        """Add a callable producing extra exposition lines at scrape time."""
+        with self._lock:
+            if collector not in self._collectors:
+                self._collectors.append(collector)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        for collector in list(self._collectors):
+            lines.extend(collector())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+AWS_CALL_DURATION = REGISTRY.histogram(
+    'aws_call_duration_seconds',
+    'Wall time of AWS API calls, including botocore retries.',
+    ('service', 'operation', 'region', 'outcome'),
+)
+DB_WRITE_DURATION = REGISTRY.histogram(
+    'db_write_batch_duration_seconds',
+    'Wall time of ORM write batches.',
+    ('operation', 'outcome'),
+)
+DB_WRITE_ROWS = REGISTRY.counter(
+    'db_write_rows_total',
+    'Rows written by ORM write batches.',
+    ('operation',),
+)
+SYNC_PHASE_DURATION = REGISTRY.histogram(
+    'sync_phase_duration_seconds',
+    'Time spent per phase of an inventory sync.',
+    ('phase', 'region', 'outcome'),
+)
+VIEW_DURATION = REGISTRY.histogram(
+    'http_request_duration_seconds',
+    'Wall time of Django views.',
+    ('view', 'method', 'outcome'),
+)
+
+
+@contextmanager
+def timed(histogram: Histogram, **labels: str) -> Iterator[None]:
+    """Observe the duration of the block, labelled ``outcome=ok|error``."""
+    if not metrics_enabled():
+        yield
+        return
+    started = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        histogram.observe(time.perf_counter() - started, outcome=outcome, **labels)
+
+
+def timed_function(histogram: Histogram, **labels: str) -> Callable:
+    """Decorator form of ``timed``."""
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(histogram, **labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_client(client, region: str) -> None:
+    """Record every API call made through a boto3 client in AWS_CALL_DURATION."""
+    service_name = client.meta.service_model.service_name
+
+    def before_call(context, **kwargs):
+        context['metrics_started_at'] = time.perf_counter()
+
+    def after_call(parsed, model, context, **kwargs):
+        started = context.pop('metrics_started_at', None)
+        if started is None:
+            return
+        error_code = parsed.get('Error', {}).get('Code')
+        if error_code is None:
+            outcome = 'ok'
+        elif 'Throttl' in error_code or error_code == 'RequestLimitExceeded':
+            outcome = 'throttled'
+        else:
+            outcome = 'error'
+        AWS_CALL_DURATION.observe(
+            time.perf_counter() - started,
+            service=service_name, operation=model.name, region=region, outcome=outcome,
+        )
+
+    def after_call_error(context, event_name, **kwargs):
+        started = context.pop('metrics_started_at', None)
+        if started is not None:
+            AWS_CALL_DURATION.observe(
+                time.perf_counter() - started,
+                service=service_name, operation=event_name.rsplit('.', 1)[-1], region=region, outcome='error',
+            )
+
+    events = client.meta.events
+    events.register('before-call.*.*', before_call)
+    events.register('after-call.*.*', after_call)
+    events.register('after-call-error.*.*', after_call_error)
@@ -0,0 +1,94 @@
+import logging
+import time
+from collections.abc import Callable
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import HttpRequest, HttpResponse
+
+from InfraSmartRouter.metrics import VIEW_DURATION, metrics_enabled
+from InfraSmartRouter.profiling import BudgetExceeded, RequestProfile, current_profile, query_counter
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsMiddleware:
+    """Record the wall time of every view in ``http_request_duration_seconds``."""
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        if not metrics_enabled():
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        match = request.resolver_match
+        VIEW_DURATION.observe(
+            time.perf_counter() - started,
+            view=match.view_name if match else 'unresolved',
+            method=request.method or '',
+            outcome=f'{response.status_code // 100}xx',
+        )
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in (``settings.PROFILING_ENABLED``) per-request cost accounting.
+
+    Adds ``X-Query-Count``, ``X-Query-Time-Ms``, ``X-AWS-Call-Count``,
+    ``X-AWS-Time-Ms`` and ``X-Wall-Time-Ms`` headers plus a ``Server-Timing``
+    header, which browser devtools show in the network panel. Views over
+    their ``@request_budget`` are logged, or fail with ``BudgetExceeded``
+    when ``settings.PROFILING_RAISE_ON_BUDGET`` is set.
+    """
+
+    def __init__(self, get_response: Callable[[HttpRequest], HttpResponse]):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request: HttpRequest) -> HttpResponse:
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(query_counter))
+                response = self.get_response(request)
+        finally:
+            current_profile.reset(token)
+
+        wall_ms = profile.wall_seconds * 1000
+        query_ms = profile.query_seconds * 1000
+        aws_ms = profile.aws_seconds * 1000
+        response['X-Query-Count'] = str(profile.queries)
+        response['X-Query-Time-Ms'] = f'{query_ms:.1f}'
+        response['X-AWS-Call-Count'] = str(profile.aws_calls)
+        response['X-AWS-Time-Ms'] = f'{aws_ms:.1f}'
+        response['X-Wall-Time-Ms'] = f'{wall_ms:.1f}'
+        response['Server-Timing'] = (
+            f'db;desc="{profile.queries} queries";dur={query_ms:.1f}, '
+            f'aws;desc="{profile.aws_calls} calls";dur={aws_ms:.1f}, '
+            f'total;dur={wall_ms:.1f}'
+        )
+
+        budget = getattr(request, 'request_budget', None)
+        if budget is not None:
+            problems = profile.over_budget(budget)
+            if problems:
+                view_name = request.resolver_match.view_name if request.resolver_match else request.path
+                message = f"{view_name} went over its request budget: {', '.join(problems)}"
+                response['X-Budget-Exceeded'] = '; '.join(problems)
+                if getattr(settings, 'PROFILING_RAISE_ON_BUDGET', False):
+                    raise BudgetExceeded(message)
+                logger.warning(message)
+        return response
+
+    def process_view(self, request: HttpRequest, view_func: Callable, view_args, view_kwargs) -> None:
+        budget = getattr(view_func, 'request_budget', None)
+        if budget is not None:
+            request.request_budget = budget
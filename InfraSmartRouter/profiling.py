@@ -0,0 +1,89 @@
+"""
+Per-request cost accounting: SQL queries, AWS API calls and wall time.
+
+``ProfilingMiddleware`` opens a ``RequestProfile`` for every request; the
+database execute wrapper and the botocore hooks attached in
+``resources.api.clients`` add to whichever profile is current. Views can
+declare what they are allowed to spend with ``@request_budget``; going over
+it logs a warning, or raises ``BudgetExceeded`` when
+``settings.PROFILING_RAISE_ON_BUDGET`` is set so the test run fails.
+"""
+import time
+from collections.abc import Callable
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+
+@dataclass
+class RequestBudget:
+    queries: int | None = None
+    aws_calls: int | None = None
+
+
+@dataclass
+class RequestProfile:
+    started_at: float = field(default_factory=time.perf_counter)
+    queries: int = 0
+    query_seconds: float = 0.0
+    aws_calls: int = 0
+    aws_seconds: float = 0.0
+
+    @property
+    def wall_seconds(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def over_budget(self, budget: RequestBudget) -> list[str]:
+        """Describe every limit of ``budget`` this request exceeded."""
+        problems = []
+        if budget.queries is not None and self.queries > budget.queries:
+            problems.append(f"{self.queries} SQL queries (budget {budget.queries})")
+        if budget.aws_calls is not None and self.aws_calls > budget.aws_calls:
+            problems.append(f"{self.aws_calls} AWS calls (budget {budget.aws_calls})")
+        return problems
+
+
+class BudgetExceeded(AssertionError):
+    """Raised when a view goes over its declared request budget."""
+
+
+current_profile: ContextVar[RequestProfile | None] = ContextVar('current_profile', default=None)
+
+
+def request_budget(queries: int | None = None, aws_calls: int | None = None) -> Callable:
+    """Declare the SQL query and AWS call budget of a view."""
+    def decorator(view_func: Callable) -> Callable:
+        view_func.request_budget = RequestBudget(queries=queries, aws_calls=aws_calls)
+        return view_func
+    return decorator
+
+
+def query_counter(execute, sql, params, many, context):
+    """``connection.execute_wrapper`` hook adding each query to the current profile."""
+    profile = current_profile.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        profile.queries += 1
+        profile.query_seconds += time.perf_counter() - started
+
+
+def profile_client(client) -> None:
+    """Count every API call made through a boto3 client against the current profile."""
+    def before_call(context, **kwargs):
+        if current_profile.get() is not None:
+            context['profile_started_at'] = time.perf_counter()
+
+    def after_call(context, **kwargs):
+        started = context.pop('profile_started_at', None)
+        profile = current_profile.get()
+        if started is not None and profile is not None:
+            profile.aws_calls += 1
+            profile.aws_seconds += time.perf_counter() - started
+
+    events = client.meta.events
+    events.register('before-call.*.*', before_call)
+    events.register('after-call.*.*', after_call)
+    events.register('after-call-error.*.*', after_call)
@@ -70,7 +70,12 @@ SOCIALACCOUNT_PROVIDERS = {
 }
 
 MIDDLEWARE = [
+    'InfraSmartRouter.middleware.ProfilingMiddleware',
+    # Outside everything that reads the database (sessions, auth)
+    'InfraSmartRouter.db_router.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before anything that reads or writes the response body
+    'django.middleware.gzip.GZipMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -78,7 +83,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
-
+    'InfraSmartRouter.middleware.MetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'InfraSmartRouter.urls'
@@ -115,6 +120,18 @@ DATABASES = {
     }
 }
 
+# Optional read replica (see InfraSmartRouter/db_router.py): safe requests read from it, writes go to default
+if os.getenv('DB_REPLICA_HOST'):
+    DATABASES['replica'] = {
+        **DATABASES['default'],
+        'HOST': os.getenv('DB_REPLICA_HOST'),
+        'PORT': os.getenv('DB_REPLICA_PORT', DATABASES['default']['PORT']),
+        'TEST': {'MIRROR': 'default'},
+    }
+DATABASE_ROUTERS = ['InfraSmartRouter.db_router.ReplicaRouter']
+# After a request that writes, that user's reads stay on the primary this long, to outlast replica lag
+DB_REPLICA_STICKY_SECONDS = int(os.getenv('DB_REPLICA_STICKY_SECONDS', '10'))
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -158,6 +175,118 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 AUTH_USER_MODEL = 'accounts.User'
 
+# AWS client behaviour (see resources/api/clients.py and resources/api/rate_limit.py)
+AWS_RETRY_MODE = os.getenv('AWS_RETRY_MODE', 'adaptive')
+AWS_RETRY_MAX_ATTEMPTS = int(os.getenv('AWS_RETRY_MAX_ATTEMPTS', '8'))
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv('AWS_MAX_POOL_CONNECTIONS', '20'))
+# Max concurrent calls per (account, region, API family); 0 means unbounded
+AWS_MAX_IN_FLIGHT = int(os.getenv('AWS_MAX_IN_FLIGHT', '10'))
+# Per-family overrides for accounts with raised limits, e.g. {'ec2:describe': (40.0, 200)}
+AWS_RATE_LIMITS = {}
+# Cached boto3 clients per (service, region, credentials)
+AWS_CLIENT_CACHE_SIZE = int(os.getenv('AWS_CLIENT_CACHE_SIZE', '256'))
+# Users with a role_arn act through STS AssumeRole (see resources/api/credentials.py)
+AWS_STS_REGION = os.getenv('AWS_STS_REGION', 'us-east-1')
+AWS_ROLE_SESSION_NAME = os.getenv('AWS_ROLE_SESSION_NAME', 'infrasmartrouter')
+AWS_ROLE_SESSION_SECONDS = int(os.getenv('AWS_ROLE_SESSION_SECONDS', '3600'))
+# Refresh assumed-role credentials this many seconds before they expire (botocore itself waits until 900)
+AWS_CREDENTIAL_REFRESH_MARGIN = int(os.getenv('AWS_CREDENTIAL_REFRESH_MARGIN', '1200'))
+
+# Inventory sync (see resources/sync.py): region reads in flight overall and per AWS account
+SYNC_MAX_WORKERS = int(os.getenv('SYNC_MAX_WORKERS', '8'))
+SYNC_ACCOUNT_CONCURRENCY = int(os.getenv('SYNC_ACCOUNT_CONCURRENCY', '4'))
+# Lease each region while syncing it, so concurrent syncs (processes, nodes) split the regions
+SYNC_SHARDING = os.getenv('SYNC_SHARDING', 'True') == 'True'
+SYNC_SHARD_LEASE_SECONDS = int(os.getenv('SYNC_SHARD_LEASE_SECONDS', '300'))
+# Seconds between passes of manage.py sync_worker
+SYNC_WORKER_INTERVAL = int(os.getenv('SYNC_WORKER_INTERVAL', '60'))
+# Identical concurrent AWS reads share one call (see resources/api/coalesce.py); 'database'
+# also coalesces across workers through advisory locks and the cache, keeping results this many seconds
+AWS_COALESCE_BACKEND = os.getenv('AWS_COALESCE_BACKEND', 'local')
+AWS_COALESCE_TTL = int(os.getenv('AWS_COALESCE_TTL', '2'))
+# Enabled regions per account are cached this long (see resources/api/regions.py)
+AWS_REGION_CACHE_SECONDS = int(os.getenv('AWS_REGION_CACHE_SECONDS', '86400'))
+# Regions where sync has never found instances are only rescanned this often
+SYNC_IDLE_REGION_INTERVAL = int(os.getenv('SYNC_IDLE_REGION_INTERVAL', '21600'))
+# Rendered dashboard rows are fragment-cached per (id, updated_at) this long (see templates/instance_partial.html)
+DASHBOARD_ROW_CACHE_SECONDS = int(os.getenv('DASHBOARD_ROW_CACHE_SECONDS', '86400'))
+# Admin changelists use the planner's row estimate instead of COUNT(*) above this many rows (Postgres only)
+ADMIN_ESTIMATED_COUNT_THRESHOLD = int(os.getenv('ADMIN_ESTIMATED_COUNT_THRESHOLD', '100000'))
+# Background threads running batched admin actions (see resources/bulk.py)
+INSTANCE_ACTION_WORKERS = int(os.getenv('INSTANCE_ACTION_WORKERS', '2'))
+# Terminated instances move to the archive table this many days later (manage.py archive_instances)
+INSTANCE_ARCHIVE_AFTER_DAYS = int(os.getenv('INSTANCE_ARCHIVE_AFTER_DAYS', '7'))
+# State-change events are kept at full resolution this long, then rolled up per day (manage.py rollup_state_history)
+STATE_HISTORY_RAW_DAYS = int(os.getenv('STATE_HISTORY_RAW_DAYS', '35'))
+# CloudWatch collection (manage.py collect_metrics): datapoint period, how far back each run asks, retention
+CLOUDWATCH_PERIOD_SECONDS = int(os.getenv('CLOUDWATCH_PERIOD_SECONDS', '300'))
+CLOUDWATCH_LOOKBACK_SECONDS = int(os.getenv('CLOUDWATCH_LOOKBACK_SECONDS', '900'))
+CLOUDWATCH_RETENTION_DAYS = int(os.getenv('CLOUDWATCH_RETENTION_DAYS', '14'))
+# EC2 state-change events from EventBridge via SQS (manage.py consume_instance_events, see resources/events.py)
+INSTANCE_EVENTS_QUEUE_URL = os.getenv('INSTANCE_EVENTS_QUEUE_URL', '')
+INSTANCE_EVENTS_BATCH_SIZE = int(os.getenv('INSTANCE_EVENTS_BATCH_SIZE', '100'))
+INSTANCE_EVENTS_MAX_WAIT = float(os.getenv('INSTANCE_EVENTS_MAX_WAIT', '1.0'))
+# Regions whose state-change rules feed the queue, comma-separated (default: the queue's own region)
+INSTANCE_EVENTS_REGIONS = [region for region in os.getenv('INSTANCE_EVENTS_REGIONS', '').split(',') if region]
+# Without a consumer heartbeat this recent, sync and status checks poll AWS as before
+INSTANCE_EVENTS_HEARTBEAT_SECONDS = int(os.getenv('INSTANCE_EVENTS_HEARTBEAT_SECONDS', '60'))
+# While events flow, regions with instances are still fully reconciled this often
+SYNC_RECONCILE_INTERVAL = int(os.getenv('SYNC_RECONCILE_INTERVAL', '3600'))
+# Parallel AWS calls per phase of manage.py apply_fleet (see resources/plan.py)
+FLEET_APPLY_WORKERS = int(os.getenv('FLEET_APPLY_WORKERS', '4'))
+# Auto-stop/terminate worker (manage.py run_scheduler, see resources/scheduler.py)
+SCHEDULER_BATCH_SIZE = int(os.getenv('SCHEDULER_BATCH_SIZE', '1000'))
+SCHEDULER_POLL_SECONDS = int(os.getenv('SCHEDULER_POLL_SECONDS', '30'))
+SCHEDULER_IDLE_CHECK_SECONDS = int(os.getenv('SCHEDULER_IDLE_CHECK_SECONDS', '300'))
+SCHEDULER_RETRY_SECONDS = int(os.getenv('SCHEDULER_RETRY_SECONDS', '300'))
+# SSH command fan-out (manage.py ssh_run, see resources/ssh.py)
+SSH_CONCURRENCY = int(os.getenv('SSH_CONCURRENCY', '50'))
+SSH_CONNECT_TIMEOUT = float(os.getenv('SSH_CONNECT_TIMEOUT', '10'))
+SSH_COMMAND_TIMEOUT = float(os.getenv('SSH_COMMAND_TIMEOUT', '300'))
+# known_hosts file to check host keys against; required unless host key checks are explicitly turned off
+SSH_KNOWN_HOSTS = os.getenv('SSH_KNOWN_HOSTS', '')
+SSH_INSECURE_SKIP_HOST_KEY_CHECK = os.getenv('SSH_INSECURE_SKIP_HOST_KEY_CHECK', 'False') == 'True'
+# Load balancer target health is cached this long per target group (see resources/api/elb.py)
+ELB_TARGET_HEALTH_CACHE_SECONDS = int(os.getenv('ELB_TARGET_HEALTH_CACHE_SECONDS', '15'))
+
+# Metrics exposed at /metrics (see InfraSmartRouter/metrics.py)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True') == 'True'
+# When set, /metrics requires an "Authorization: Bearer <token>" header
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# Per-request SQL/AWS cost headers (see InfraSmartRouter/profiling.py). Opt-in;
+# set PROFILING_RAISE_ON_BUDGET in CI so views over their @request_budget fail tests.
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_RAISE_ON_BUDGET = os.getenv('PROFILING_RAISE_ON_BUDGET', 'False') == 'True'
+
+# Logging: LOG_FORMAT=json emits one JSON object per line with any ``extra`` fields
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'InfraSmartRouter.log_format.JsonFormatter'},
+        'plain': {
+            '()': 'InfraSmartRouter.log_format.KeyValueFormatter',
+            'format': '%(asctime)s %(levelname)s %(name)s %(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': os.getenv('LOG_FORMAT', 'plain'),
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.getenv('LOG_LEVEL', 'INFO'),
+    },
+    'loggers': {
+        'botocore': {'level': 'WARNING'},
+        'boto3': {'level': 'WARNING'},
+        'urllib3': {'level': 'WARNING'},
+    },
+}
+
 # Email configuration for development (console backend)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
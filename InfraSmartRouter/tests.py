@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase
+
+from InfraSmartRouter.db_router import REPLICA, STICKY_COOKIE, ReplicaRouter, ReplicaRoutingMiddleware, replica_reads
+from resources.models import EC2Instance
+
+
+@mock.patch('InfraSmartRouter.db_router.replica_configured', return_value=True)
+class ReplicaRoutingTests(TransactionTestCase):
+    """Which alias reads go to; no second database is needed for that. Not a TestCase: its transaction would pin every read."""
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        self.factory = RequestFactory()
+
+    def request(self, method: str, write: bool = False, **cookies) -> tuple[HttpResponse, list[str | None]]:
+        """Run a request through the middleware; return the response and where its reads went before and after writing."""
+        reads = []
+
+        def view(request):
+            reads.append(self.router.db_for_read(EC2Instance))
+            if write:
+                self.router.db_for_write(EC2Instance)
+                reads.append(self.router.db_for_read(EC2Instance))
+            return HttpResponse()
+
+        request = getattr(self.factory, method)('/')
+        request.COOKIES.update(cookies)
+        return ReplicaRoutingMiddleware(view)(request), reads
+
+    def test_safe_request_reads_from_replica(self, _):
+        response, reads = self.request('get')
+        self.assertEqual(reads, [REPLICA])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_unsafe_request_reads_from_primary(self, _):
+        _, reads = self.request('post')
+        self.assertEqual(reads, [None])
+
+    def test_first_write_pins_request_and_sets_sticky_cookie(self, _):
+        response, reads = self.request('get', write=True)
+        self.assertEqual(reads, [REPLICA, None])
+        self.assertIn(STICKY_COOKIE, response.cookies)
+
+        # The user's next poll stays on the primary
+        _, reads = self.request('get', **{STICKY_COOKIE: '1'})
+        self.assertEqual(reads, [None])
+
+    def test_outside_requests_read_from_primary_unless_opted_in(self, _):
+        self.assertIsNone(self.router.db_for_read(EC2Instance))
+        with replica_reads():
+            self.assertEqual(self.router.db_for_read(EC2Instance), REPLICA)
+            with transaction.atomic():
+                self.assertIsNone(self.router.db_for_read(EC2Instance))
+        self.assertEqual(self.router.db_for_write(EC2Instance), 'default')
+
+    def test_middleware_unused_without_replica(self, replica_configured):
+        replica_configured.return_value = False
+        with self.assertRaises(MiddlewareNotUsed):
+            ReplicaRoutingMiddleware(lambda request: HttpResponse())
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(EC2Instance))
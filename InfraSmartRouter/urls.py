@@ -29,5 +29,9 @@ urlpatterns = [
     path('instances/<int:instance_id>/stop/', views.stop_instance, name='stop-instance'),
     path('instances/<int:instance_id>/terminate/', views.terminate_instance, name='terminate-instance'),
     path('instances/<int:instance_id>/status/', views.check_instance_status, name='check-instance-status'),
+    path('instances/rows/', views.instance_rows, name='instance-rows'),
+    path('instances/<int:instance_id>/metrics/', views.instance_metrics, name='instance-metrics'),
     path('sync-instances/', views.get_instances, name='sync-instances'),
+    path('aws/rate-limits/', views.aws_rate_limits, name='aws-rate-limits'),
+    path('metrics', views.metrics, name='metrics'),
 ]
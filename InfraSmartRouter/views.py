@@ -1,19 +1,36 @@
 
+from collections.abc import Iterator
 from typing import Callable
-import boto3
 import json
 import logging
+import math
+from datetime import datetime, timedelta, timezone
 from functools import wraps
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import get_user_model
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpRequest, HttpResponse, JsonResponse
-from django.views.decorators.http import require_http_methods
-from resources.models import EC2Instance
+from django.conf import settings
+from django.http import HttpRequest, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseNotFound, JsonResponse, StreamingHttpResponse
+from django.db.models import Count, Max
+from django.template.loader import render_to_string
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_http_methods
+from InfraSmartRouter.metrics import REGISTRY, metrics_enabled
+from InfraSmartRouter.profiling import request_budget
+from resources.api.clients import get_rate_limiter
+from resources.events import STARTED_STATES, events_active
+from resources.models import EC2Instance, InstanceMetricSample
+from resources.sync import iter_all_regions, sync_all_regions
+from resources.tags import parse_tag_filter, tagged
 
 logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+NDJSON_CONTENT_TYPE = 'application/x-ndjson'
+
 def get_default_user():
     """Get the default superuser for operations"""
     return User.objects.filter(is_superuser=True).first()
@@ -39,14 +56,54 @@ def ensure_user_available(view_func: Callable):
     return wrapper
 
 
+def fleet_state(request: HttpRequest) -> dict:
+    """Newest updated_at and row count of the instance table, from one aggregate query per request."""
+    if not hasattr(request, 'fleet_state'):
+        request.fleet_state = EC2Instance.objects.aggregate(last_modified=Max('updated_at'), count=Count('id'))
+    return request.fleet_state
+
+def fleet_etag(request: HttpRequest) -> str:
+    # The count catches deletions, which don't move max(updated_at)
+    state = fleet_state(request)
+    last_modified = state['last_modified'].timestamp() if state['last_modified'] else 0
+    return f"fleet-{state['count']}-{last_modified:.6f}"
+
+def fleet_last_modified(request: HttpRequest):
+    return fleet_state(request)['last_modified']
+
+def filter_by_tags(request: HttpRequest, instances):
+    """Apply every ``?tag=key`` / ``?tag=key=value`` of the request, each an indexed tag lookup."""
+    for tag in request.GET.getlist('tag'):
+        instances = tagged(instances, *parse_tag_filter(tag))
+    return instances
+
+def row_cache_seconds() -> int:
+    return getattr(settings, 'DASHBOARD_ROW_CACHE_SECONDS', 86400)
+
+def render_instance_row(request: HttpRequest, instance: EC2Instance) -> str:
+    """One dashboard row, served from the fragment cache while ``updated_at`` is unchanged."""
+    return render_to_string("instance_partial.html", {
+        'instance': instance,
+        'row_cache_seconds': row_cache_seconds(),
+    }, request=request)
+
+
+@request_budget(queries=4, aws_calls=0)
 @require_http_methods(["GET"])
+@cache_control(no_cache=True)
+@condition(etag_func=fleet_etag, last_modified_func=fleet_last_modified)
 def index(request: HttpRequest)-> HttpResponse:
-    instances = EC2Instance.objects.all()
+    instances = filter_by_tags(request, EC2Instance.objects.all())
+    last_modified = fleet_state(request)['last_modified']
     context = {
         'instances': instances,
+        'row_cache_seconds': row_cache_seconds(),
+        # Where the page's rows/?since= refreshes start from
+        'fleet_updated': f"{last_modified.timestamp():.6f}" if last_modified else 0,
     }
     return render(request, "index.html", context)    
 
+@request_budget(queries=6, aws_calls=1)
 @require_http_methods(["POST"])
 def start_instance(request: HttpRequest, instance_id: str)-> HttpResponse:
     instance = get_object_or_404(EC2Instance, id=instance_id)
@@ -54,9 +111,11 @@ def start_instance(request: HttpRequest, instance_id: str)-> HttpResponse:
     return JsonResponse({
         'success': success,
         'status': instance.status,
-        'message': f"Instance {'started' if success else 'failed to start'}"
+        'message': f"Instance {'started' if success else 'failed to start'}",
+        'row': render_instance_row(request, instance),
     })
 
+@request_budget(queries=6, aws_calls=1)
 @require_http_methods(["POST"])
 def stop_instance(request: HttpRequest, instance_id: str)-> HttpResponse:
     instance = get_object_or_404(EC2Instance, id=instance_id)
@@ -64,9 +123,11 @@ def stop_instance(request: HttpRequest, instance_id: str)-> HttpResponse:
     return JsonResponse({
         'success': success,
         'status': instance.status,
-        'message': f"Instance {'stopped' if success else 'failed to stop'}"
+        'message': f"Instance {'stopped' if success else 'failed to stop'}",
+        'row': render_instance_row(request, instance),
     })
 
+@request_budget(queries=6, aws_calls=1)
 @require_http_methods(["POST"])
 def terminate_instance(request: HttpRequest, instance_id: str)-> HttpResponse:
     instance = get_object_or_404(EC2Instance, id=instance_id)
@@ -74,23 +135,42 @@ def terminate_instance(request: HttpRequest, instance_id: str)-> HttpResponse:
     return JsonResponse({
         'success': success,
         'status': instance.status,
-        'message': f"Instance {'terminated' if success else 'failed to terminate'}"
+        'message': f"Instance {'terminated' if success else 'failed to terminate'}",
+        'row': render_instance_row(request, instance),
     })
 
+@request_budget(queries=6, aws_calls=1)
 @require_http_methods(["GET"])
+@cache_control(no_cache=True)
 def check_instance_status(request: HttpRequest, instance_id: str)-> HttpResponse:
     instance = get_object_or_404(EC2Instance, id=instance_id)
-    current_status = instance.get_instance_status()
-    current_ip = instance.get_instance_ip_address()
+    # With state-change events flowing the row is already current, except for the IP of an instance
+    # that just started; otherwise status and IP come from one describe call, shared with concurrent
+    # polls of the same instance
+    current = {}
+    if not events_active(instance.region) or (instance.status in STARTED_STATES and not instance.ip_address):
+        current = instance.refresh_from_aws() or {}
     
-    return JsonResponse({
-        'status': current_status or instance.status,
-        'ip_address': current_ip or instance.ip_address,
+    # Checked after the refresh: a poll that changed nothing gets a 304 and no JSON
+    etag = quote_etag(f"instance-{instance.pk}-{instance.updated_at.timestamp():.6f}")
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(instance.updated_at.timestamp()))
+    if not_modified is not None:
+        return not_modified
+    
+    response = JsonResponse({
+        'status': current.get('status') or instance.status,
+        'ip_address': current.get('ip_address') or instance.ip_address,
         'name': instance.name,
         'instance_type': instance.instance_type,
-        'region': instance.region
+        'region': instance.region,
+        'row': render_instance_row(request, instance),
     })
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(instance.updated_at.timestamp())
+    return response
 
+# The launch, plus the region's AMI lookup outside us-east-1 (cached for a day)
+@request_budget(queries=8, aws_calls=2)
 @ensure_user_available
 @require_http_methods(["POST"])
 def create_instance(request: HttpRequest)-> HttpResponse:
@@ -103,7 +183,7 @@ def create_instance(request: HttpRequest)-> HttpResponse:
         
         # Create new EC2Instance with defaults and user input
         instance = EC2Instance.objects.create(
-            name=data.get('name', f'instance-{user.username}-{len(EC2Instance.objects.filter(creating_user=user)) + 1}'),
+            name=data.get('name', f'instance-{user.username}-{EC2Instance.objects.filter(creating_user=user).count() + 1}'),
             creating_user=user,
             username=data.get('username', 'ubuntu'),  # Default Ubuntu username
             password=data.get('password', ''),  # Usually empty for key-based auth
@@ -120,7 +200,8 @@ def create_instance(request: HttpRequest)-> HttpResponse:
                 'success': True,
                 'message': f'Instance {instance.name} created successfully',
                 'instance_id': instance.id,
-                'aws_instance_id': aws_instance_id
+                'aws_instance_id': aws_instance_id,
+                'row': render_instance_row(request, instance),
             })
         else:
             # If AWS creation failed, delete the database record
@@ -141,6 +222,114 @@ def create_instance(request: HttpRequest)-> HttpResponse:
             'message': f'Error creating instance: {str(e)}'
         })
 
+@request_budget(queries=1, aws_calls=0)
+@require_http_methods(["GET"])
+@cache_control(no_cache=True)
+def instance_rows(request: HttpRequest) -> HttpResponse:
+    """
+    Rendered dashboard rows for the instances named by ``id``, or for every
+    instance updated at or after ``since`` (epoch seconds), narrowed by the
+    dashboard's ``tag`` filters.
+
+    The dashboard swaps these into the page after an action or a sync instead
+    of reloading it. ``X-Fleet-Updated`` is the ``since`` to ask for next.
+    """
+    instances = filter_by_tags(request, EC2Instance.objects.all())
+    ids = request.GET.getlist('id')
+    since = request.GET.get('since')
+    try:
+        if ids:
+            instances = instances.filter(id__in=[int(pk) for pk in ids])
+        elif since is not None:
+            since = float(since)
+            instances = instances.filter(updated_at__gte=datetime.fromtimestamp(since, tz=timezone.utc))
+        else:
+            return HttpResponseBadRequest("id or since is required")
+    except (ValueError, OverflowError, OSError):
+        # OverflowError/OSError: a float datetime can't represent, e.g. since=1e20
+        return HttpResponseBadRequest("id must be an integer and since a timestamp")
+
+    rows = []
+    updated = since or 0
+    for instance in instances:
+        rows.append(render_instance_row(request, instance))
+        updated = max(updated, instance.updated_at.timestamp())
+    response = HttpResponse(''.join(rows))
+    response['X-Fleet-Updated'] = f"{updated:.6f}"
+    return response
+
+@request_budget(queries=2, aws_calls=0)
+@require_http_methods(["GET"])
+def instance_metrics(request: HttpRequest, instance_id: str) -> HttpResponse:
+    """CloudWatch series of one instance over the last ``hours`` (default 24) from the sample table."""
+    instance = get_object_or_404(EC2Instance, id=instance_id)
+    try:
+        hours = float(request.GET.get('hours', 24))
+    except ValueError:
+        return HttpResponseBadRequest("hours must be a number")
+    if not math.isfinite(hours) or hours <= 0:
+        return HttpResponseBadRequest("hours must be a positive number")
+    hours = min(hours, 24 * getattr(settings, 'CLOUDWATCH_RETENTION_DAYS', 14))
+    start = datetime.now(timezone.utc) - timedelta(hours=hours)
+    series: dict[str, list] = {metric: [] for metric in InstanceMetricSample.METRICS}
+    samples = (
+        InstanceMetricSample.objects
+        .filter(instance_id=instance.pk, at__gte=start)
+        .order_by('metric', 'at')
+        .values_list('metric', 'at', 'value')
+    )
+    for metric, at, value in samples:
+        series[InstanceMetricSample.METRICS[metric]].append([at.timestamp(), value])
+    return JsonResponse({'instance_id': instance.pk, 'series': series})
+
+@staff_member_required
+@require_http_methods(["GET"])
+def aws_rate_limits(request: HttpRequest) -> HttpResponse:
+    """Throttle, retry and queue-wait counters for every AWS rate-limit bucket."""
+    return JsonResponse({'buckets': get_rate_limiter().snapshot()})
+
+@require_http_methods(["GET"])
+def metrics(request: HttpRequest) -> HttpResponse:
+    """Prometheus text exposition of this worker's metrics."""
+    if not metrics_enabled():
+        return HttpResponseNotFound()
+    token = getattr(settings, 'METRICS_TOKEN', '')
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+def ndjson_line(payload: dict) -> bytes:
+    return (json.dumps(payload) + '\n').encode()
+
+def stream_sync(user, full: bool = False) -> Iterator[bytes]:
+    """NDJSON body of a streamed sync; only one region's records are held at a time."""
+    synced_count = 0
+    regions = 0
+    accounts = set()
+    try:
+        for account, region_code, records in iter_all_regions(user, full=full):
+            synced_count += len(records)
+            regions += 1
+            accounts.add(account.label)
+            yield ndjson_line({
+                'type': 'region',
+                'account': account.label,
+                'region': region_code,
+                'count': len(records),
+                'instances': [record.as_dict() for record in records],
+            })
+    except Exception as e:
+        logger.error("Error streaming sync", extra={'error': str(e)})
+        yield ndjson_line({'type': 'summary', 'success': False, 'error': str(e), 'synced_count': synced_count})
+        return
+    yield ndjson_line({
+        'type': 'summary',
+        'success': True,
+        'synced_count': synced_count,
+        'regions': regions,
+        'accounts': len(accounts),
+    })
+
 @ensure_user_available
 def sync_aws_instances(request: HttpRequest):
     """Sync AWS instances with database (internal function)"""
@@ -148,127 +337,43 @@ def sync_aws_instances(request: HttpRequest):
     try:
         # Get user from decorator
         user = request.operation_user
-            
-        # Iterate through all regions
-        for region_code, region_name in EC2Instance.REGION_CHOICES:
-            try:
-                # Get AWS instances for this region
-                ec2_client = boto3.client('ec2', region_name=region_code)
-                boto3_instances = ec2_client.describe_instances()
-                
-                if len(boto3_instances['Reservations']) == 0:
-                    logger.info(f"No instances found in region {region_code}")
-                    continue
-
-                for reservation in boto3_instances['Reservations']:
-                    for instance in reservation['Instances']:
-                        # Extract AWS data
-                        aws_instance_id = instance['InstanceId']
-                        state = instance['State']['Name']
-                        instance_type = instance['InstanceType']
-                        public_ip = instance.get('PublicIpAddress')
-                        region = instance['Placement']['AvailabilityZone'][:-1]
-                        
-                        logger.info(f"Found instance {aws_instance_id} in region {region}")
-                        # Get instance name from tags
-                        name = aws_instance_id
-                        for tag in instance.get('Tags', []):
-                            if tag['Key'] == 'Name':
-                                name = tag['Value']
-                                break
-                        
-                        # Update or create database record
-                        EC2Instance.objects.update_or_create(
-                            aws_instance_id=aws_instance_id,
-                            defaults={
-                                'name': name,
-                                'status': state,
-                                'instance_type': instance_type,
-                                'ip_address': public_ip,
-                                'region': region,
-                                'creating_user': user,
-                                'username': 'ubuntu',
-                            }
-                        )
-            except Exception as e:
-                print(f"Error syncing instances from region {region_code}: {e}")
-                continue
-        print(f"Synced {len(EC2Instance.objects.all())} instances")
+        sync_all_regions(user)
+        logger.info("Synced instances", extra={'count': EC2Instance.objects.count()})
     except Exception as e:
-        print(f"Error syncing AWS instances: {e}")
+        logger.error("Error syncing AWS instances", extra={'error': str(e)})
 
+# One describe per region plus the (daily) describe_regions discovery call
+@request_budget(aws_calls=len(EC2Instance.REGION_CHOICES) + 1)
 @ensure_user_available
 @require_http_methods(["POST"])
 def get_instances(request: HttpRequest) -> HttpResponse:
-    """API endpoint to sync and return instances"""
+    """
+    API endpoint to sync and return instances.
+
+    With ``Accept: application/x-ndjson`` (or ``stream=1``) the response is
+    streamed: one JSON line per region as soon as it is reconciled, then a
+    summary line, instead of one document once every region is done.
+    """
     
     try:
         # Get user from decorator
         user = request.operation_user
-            
-        synced_instances = []
+        # full=1 also scans regions that have been idle, instead of waiting for their next periodic scan
+        full = request.POST.get('full') == '1'
         
-        # Iterate through all regions
-        for region_code, region_name in EC2Instance.REGION_CHOICES:
-            try:
-                # Get AWS instances for this region
-                ec2_client = boto3.client('ec2', region_name=region_code)
-                boto3_instances = ec2_client.describe_instances()
-                
-                if len(boto3_instances['Reservations']) == 0:
-                    logger.info(f"No instances found in region {region_code}")
-                    continue
-                
-                for reservation in boto3_instances['Reservations']:
-                    for instance in reservation['Instances']:
-                        # Extract AWS data
-                        aws_instance_id = instance['InstanceId']
-                        state = instance['State']['Name']
-                        instance_type = instance['InstanceType']
-                        public_ip = instance.get('PublicIpAddress')
-                        region = instance['Placement']['AvailabilityZone'][:-1]
-                        
-                        logger.info(f"Found instance {aws_instance_id} in region {region}")
-                        
-                        # Get instance name from tags
-                        name = aws_instance_id
-                        for tag in instance.get('Tags', []):
-                            if tag['Key'] == 'Name':
-                                name = tag['Value']
-                                break
-                        
-                        # Update or create database record
-                        db_instance, created = EC2Instance.objects.update_or_create(
-                            aws_instance_id=aws_instance_id,
-                            defaults={
-                                'name': name,
-                                'status': state,
-                                'instance_type': instance_type,
-                                'ip_address': public_ip,
-                                'region': region,
-                                'creating_user': user,
-                                'username': 'ubuntu',
-                            }
-                        )
-                        
-                        synced_instances.append({
-                            'id': db_instance.id,
-                            'aws_instance_id': aws_instance_id,
-                            'name': name,
-                            'state': state,
-                            'type': instance_type,
-                            'ip_address': public_ip,
-                            'region': region,
-                            'created': created
-                        })
-            except Exception as e:
-                print(f"Error syncing instances from region {region_code}: {e}")
-                continue
+        if NDJSON_CONTENT_TYPE in request.headers.get('Accept', '') or request.POST.get('stream') == '1':
+            response = StreamingHttpResponse(stream_sync(user, full), content_type=NDJSON_CONTENT_TYPE)
+            # GZipMiddleware would hold lines back until its buffer fills; it skips encoded responses
+            response['Content-Encoding'] = 'identity'
+            response['X-Accel-Buffering'] = 'no'
+            return response
+            
+        synced_instances = sync_all_regions(user, full=full)
         
         return JsonResponse({
             'success': True,
             'synced_count': len(synced_instances),
-            'instances': synced_instances
+            'instances': [record.as_dict() for record in synced_instances]
         })
         
     except Exception as e:
@@ -11,7 +11,7 @@ class UserAdmin(BaseUserAdmin):
     
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Additional Info', {
-            'fields': ('phone', 'organization', 'role', 'access_key_id', 'secret_access_key')
+            'fields': ('phone', 'organization', 'role', 'access_key_id', 'secret_access_key', 'role_arn')
         }),
         ('Timestamps', {
             'fields': ('created_at', 'updated_at'),
@@ -23,6 +23,6 @@ class UserAdmin(BaseUserAdmin):
     
     add_fieldsets = BaseUserAdmin.add_fieldsets + (
         ('Additional Info', {
-            'fields': ('email', 'first_name', 'last_name', 'phone', 'organization', 'role', 'access_key_id', 'secret_access_key')
+            'fields': ('email', 'first_name', 'last_name', 'phone', 'organization', 'role', 'access_key_id', 'secret_access_key', 'role_arn')
         }),
     )
\ No newline at end of file
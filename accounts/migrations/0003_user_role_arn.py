@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_access_key_id_user_secret_access_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='role_arn',
+            field=models.CharField(blank=True, max_length=2048),
+        ),
+    ]
@@ -30,6 +30,8 @@ class User(AbstractUser):
     id: uuid.UUID= models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     access_key_id: str= models.CharField(max_length=255, blank=True)
     secret_access_key: str= models.CharField(max_length=255, blank=True)
+    # IAM role to assume with the keys above (or the default credential chain)
+    role_arn: str= models.CharField(max_length=2048, blank=True)
 
     USERNAME_FIELD: str = 'email'
     REQUIRED_FIELDS: list[str] = [ 'username', 'first_name', 'last_name']
@@ -1,8 +1,11 @@
+import logging
 import os
 from django.db.models.signals import post_migrate
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 
+logger = logging.getLogger(__name__)
+
 
 @receiver(post_migrate)
 def create_superuser(sender, **kwargs):
@@ -13,12 +16,12 @@ def create_superuser(sender, **kwargs):
     if sender.name == 'accounts':
         User = get_user_model()
         if not User.objects.filter(is_superuser=True).exists():
-            # Debug: Print all environment variables
-            print("DEBUG: Environment variables:")
-            print(f"ROOT_EMAIL: {os.getenv('ROOT_EMAIL')}")
-            print(f"ROOT_USERNAME: {os.getenv('ROOT_USERNAME')}")
-            print(f"AWS_ACCESS_KEY_ID: {os.getenv('AWS_ACCESS_KEY_ID')}")
-            print(f"DJANGO_SUPERUSER_PASSWORD: {os.getenv('DJANGO_SUPERUSER_PASSWORD')}")
+            logger.debug("Creating superuser from environment", extra={
+                'root_email': os.getenv('ROOT_EMAIL'),
+                'root_username': os.getenv('ROOT_USERNAME'),
+                'aws_access_key_id_set': bool(os.getenv('AWS_ACCESS_KEY_ID')),
+                'superuser_password_set': bool(os.getenv('DJANGO_SUPERUSER_PASSWORD')),
+            })
             
             email = os.getenv('ROOT_EMAIL', 'admin@example.com')
             username = os.getenv('ROOT_USERNAME', 'admin')
@@ -40,4 +43,4 @@ def create_superuser(sender, **kwargs):
                 access_key_id=access_key_id,
                 secret_access_key=secret_access_key
             )
-            print(f"Superuser created: {email}")
\ No newline at end of file
+            logger.info("Superuser created", extra={'email': email})
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Memory per instance and diff speed of the compact fleet model.
+
+Builds realistic ``describe_instances`` instance dicts (block devices,
+network interfaces, security groups, tags, ...) and measures with
+``tracemalloc``:
+
+* bytes per instance held as boto3 dicts and as ``InstanceRecord`` objects,
+  plus the extra bytes for the per-instance dicts of the JSON response,
+* time to read the inventory into records and to diff it against database
+  row tuples (90% unchanged, 5% changed, 5% new).
+
+Usage::
+
+    python -m benchmarks.bench_fleet --sizes 1000,100000 [--output results.json]
+"""
+import argparse
+import gc
+import json
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from benchmarks import harness
+
+DEFAULT_SIZES: tuple[int, ...] = (1000, 10_000, 100_000)
+REGIONS: tuple[str, ...] = ('us-east-1', 'us-west-2', 'eu-west-1', 'ap-southeast-2')
+TYPES: tuple[str, ...] = ('t2.micro', 't2.small', 't3.micro', 't3.medium')
+STATES: tuple[str, ...] = ('running', 'running', 'running', 'stopped')
+
+
+def boto_instance(index: int) -> dict:
+    """A ``describe_instances`` instance dict shaped like a real response."""
+    region = REGIONS[index % len(REGIONS)]
+    instance_id = f'i-{index:017x}'
+    private_ip = f'172.31.{index // 256 % 256}.{index % 256}'
+    return {
+        'AmiLaunchIndex': 0,
+        'ImageId': 'ami-08a6efd148b1f7504',
+        'InstanceId': instance_id,
+        'InstanceType': TYPES[index % len(TYPES)],
+        'KeyName': 'deploy',
+        'LaunchTime': datetime(2025, 1, 1, tzinfo=timezone.utc),
+        'Monitoring': {'State': 'disabled'},
+        'Placement': {'AvailabilityZone': f'{region}a', 'GroupName': '', 'Tenancy': 'default'},
+        'PrivateDnsName': f'ip-{private_ip.replace(".", "-")}.ec2.internal',
+        'PrivateIpAddress': private_ip,
+        'PublicDnsName': f'ec2-10-0-{index // 256 % 256}-{index % 256}.compute-1.amazonaws.com',
+        'PublicIpAddress': f'10.0.{index // 256 % 256}.{index % 256}',
+        'State': {'Code': 16, 'Name': STATES[index % len(STATES)]},
+        'SubnetId': 'subnet-0123456789abcdef0',
+        'VpcId': 'vpc-0123456789abcdef0',
+        'Architecture': 'x86_64',
+        'BlockDeviceMappings': [{
+            'DeviceName': '/dev/sda1',
+            'Ebs': {'AttachTime': datetime(2025, 1, 1, tzinfo=timezone.utc), 'DeleteOnTermination': True,
+                    'Status': 'attached', 'VolumeId': f'vol-{index:017x}'},
+        }],
+        'EbsOptimized': False,
+        'EnaSupport': True,
+        'Hypervisor': 'xen',
+        'NetworkInterfaces': [{
+            'Attachment': {'AttachmentId': f'eni-attach-{index:017x}', 'DeleteOnTermination': True,
+                           'DeviceIndex': 0, 'Status': 'attached'},
+            'Groups': [{'GroupName': 'default', 'GroupId': 'sg-0123456789abcdef0'}],
+            'MacAddress': '0a:00:00:00:00:00',
+            'NetworkInterfaceId': f'eni-{index:017x}',
+            'PrivateIpAddress': private_ip,
+            'SourceDestCheck': True,
+            'Status': 'in-use',
+        }],
+        'RootDeviceName': '/dev/sda1',
+        'RootDeviceType': 'ebs',
+        'SecurityGroups': [{'GroupName': 'default', 'GroupId': 'sg-0123456789abcdef0'}],
+        'Tags': [{'Key': 'Name', 'Value': f'fleet-{region}-{index}'}, {'Key': 'team', 'Value': 'platform'}],
+        'VirtualizationType': 'hvm',
+        'CpuOptions': {'CoreCount': 1, 'ThreadsPerCore': 1},
+        'MetadataOptions': {'State': 'applied', 'HttpTokens': 'required', 'HttpEndpoint': 'enabled'},
+    }
+
+
+def traced_bytes(build):
+    """Return (object, bytes still allocated for it once ``build`` returns)."""
+    gc.collect()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    gc.collect()
+    return value, tracemalloc.get_traced_memory()[0] - before
+
+
+def run_single(size: int) -> dict:
+    harness.setup_django()
+    from resources.fleet import diff_fleet, read_inventory
+
+    tracemalloc.start()
+    instances, dict_bytes = traced_bytes(lambda: [boto_instance(i) for i in range(size)])
+
+    started = time.perf_counter()
+    records, _ = traced_bytes(lambda: read_inventory(instances, owner_id=1))
+    read_seconds = time.perf_counter() - started
+
+    response_rows, response_bytes = traced_bytes(lambda: [record.as_dict() for record in records])
+    del response_rows
+
+    # Measure the records on their own: once the boto dicts are gone they own their strings.
+    del instances
+    gc.collect()
+    record_bytes = tracemalloc.get_traced_memory()[0]
+    del records
+    gc.collect()
+    record_bytes -= tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    # Database rows as ``values_list`` tuples: 90% unchanged, 5% changed state, 5% missing.
+    records = read_inventory((boto_instance(i) for i in range(size)), owner_id=1)
+    rows = {}
+    for pk, record in enumerate(records):
+        if pk % 20 == 0:
+            continue
+        state = 'stopped' if pk % 20 == 1 else record.state
+        rows[record.aws_instance_id] = (
+            pk, record.aws_instance_id, record.name, state, record.instance_type, record.ip_address, record.region, 1,
+        )
+    started = time.perf_counter()
+    diff = diff_fleet(records, rows)
+    diff_seconds = time.perf_counter() - started
+
+    return {
+        'size': size,
+        'bytes_per_instance': {
+            'boto_dict': round(dict_bytes / size, 1),
+            'response_dict_overhead': round(response_bytes / size, 1),
+            'instance_record': round(record_bytes / size, 1),
+        },
+        'read_inventory': {'wall_seconds': round(read_seconds, 6), 'instances_per_second': round(size / read_seconds, 1)},
+        'diff': {
+            'wall_seconds': round(diff_seconds, 6),
+            'instances_per_second': round(size / diff_seconds, 1),
+            'created': len(diff.created),
+            'updated': len(diff.updated),
+            'unchanged': len(diff.unchanged),
+            'ignored': len(diff.ignored),
+        },
+        'peak_rss_mb': harness.peak_rss_mb(),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma separated fleet sizes')
+    parser.add_argument('--output', help='results file (default benchmarks/results/fleet-<commit>.json)')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        print(json.dumps(run_single(args.single)))
+        return
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = harness.run_isolated('benchmarks.bench_fleet', ['--single', str(size)])
+        per_instance = result['bytes_per_instance']
+        print(
+            f"{size:>7} instances: {per_instance['boto_dict']:.0f} B/instance as boto3 dicts, "
+            f"+{per_instance['response_dict_overhead']:.0f} B for response dicts, "
+            f"{per_instance['instance_record']:.0f} B as records; "
+            f"diff {result['diff']['wall_seconds'] * 1000:.1f} ms "
+            f"({result['diff']['instances_per_second']:,.0f} instances/s)",
+            file=sys.stderr,
+        )
+        results.append(result)
+    path = harness.write_results('fleet', results, args.output)
+    print(f'Wrote {path}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
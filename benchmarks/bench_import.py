@@ -0,0 +1,121 @@
+"""
+Startup cost of management commands and worker boot.
+
+Each scenario runs in a fresh ``python -X importtime`` interpreter and
+records its wall time, total import time, peak RSS and the import time
+spent in each heavy package (the AWS SDK and its type stubs should not show
+up at all until an AWS call is made):
+
+* ``manage_check``: ``manage.py check``,
+* ``worker_boot``: importing the WSGI application and resolving the URLconf,
+  which is what a gunicorn worker does before its first request.
+
+Usage::
+
+    python -m benchmarks.bench_import [--repeat 5] [--output results.json]
+    python -m benchmarks.compare benchmarks/results/import-<old>.json benchmarks/results/import-<new>.json
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import harness
+
+SCENARIOS: dict[str, list[str]] = {
+    'manage_check': ['manage.py', 'check'],
+    'worker_boot': [
+        '-c',
+        'from InfraSmartRouter.wsgi import application\n'
+        'from django.urls import get_resolver\n'
+        'get_resolver().url_patterns',
+    ],
+}
+TRACKED_PACKAGES: tuple[str, ...] = ('django', 'boto3', 'botocore', 'mypy_boto3_ec2', 'resources', 'InfraSmartRouter')
+
+
+def parse_importtime(stderr: str) -> tuple[float, dict[str, float]]:
+    """Total import time and the share of it spent in each tracked top-level package, in seconds."""
+    total_us = 0
+    packages: dict[str, float] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = (part.strip() for part in line[len('import time:'):].split('|'))
+        total_us += int(self_us)
+        # Self times add up without double counting, unlike the cumulative column.
+        package = name.split('.')[0]
+        if package in TRACKED_PACKAGES:
+            packages[package] = packages.get(package, 0) + int(self_us) / 1e6
+    return total_us / 1e6, packages
+
+
+def run_scenario(args: list[str]) -> dict:
+    env = {
+        **os.environ,
+        'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'benchmarks.settings'),
+        'AWS_ACCESS_KEY_ID': os.environ.get('AWS_ACCESS_KEY_ID', 'local'),
+        'AWS_SECRET_ACCESS_KEY': os.environ.get('AWS_SECRET_ACCESS_KEY', 'local'),
+    }
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-X', 'importtime', *args],
+        cwd=harness.REPO_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True,
+    )
+    stderr = process.stderr.read()
+    # wait4 gives this child's own rusage, not the max over every child so far.
+    _, status, usage = os.wait4(process.pid, 0)
+    wall = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f'{" ".join(args)} failed:\n{stderr}')
+    import_seconds, packages = parse_importtime(stderr)
+    return {
+        'wall_seconds': wall,
+        'import_seconds': import_seconds,
+        'packages': packages,
+        'peak_rss_mb': usage.ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+    }
+
+
+def run(name: str, repeat: int) -> dict:
+    runs = [run_scenario(SCENARIOS[name]) for _ in range(repeat)]
+    packages = sorted({package for r in runs for package in r['packages']})
+    return {
+        'name': name,
+        'repeat': repeat,
+        'wall_seconds': round(statistics.median(r['wall_seconds'] for r in runs), 6),
+        'import_seconds': round(statistics.median(r['import_seconds'] for r in runs), 6),
+        'peak_rss_mb': round(statistics.median(r['peak_rss_mb'] for r in runs), 2),
+        'package_import_seconds': {
+            package: round(statistics.median(r['packages'].get(package, 0.0) for r in runs), 6)
+            for package in packages
+        },
+        'aws_sdk_loaded': any('boto3' in r['packages'] or 'botocore' in r['packages'] for r in runs),
+    }
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per scenario; the median is reported')
+    parser.add_argument('--output', help='results file (default benchmarks/results/import-<commit>.json)')
+    args = parser.parse_args(argv)
+
+    results = []
+    for name in SCENARIOS:
+        result = run(name, args.repeat)
+        print(
+            f"{name:>12}: {result['wall_seconds'] * 1000:.0f} ms wall, "
+            f"{result['import_seconds'] * 1000:.0f} ms importing, peak RSS {result['peak_rss_mb']:.0f} MB, "
+            f"AWS SDK {'loaded' if result['aws_sdk_loaded'] else 'not loaded'}",
+            file=sys.stderr,
+        )
+        results.append(result)
+    path = harness.write_results('import', results, args.output)
+    print(f'Wrote {path}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+End-to-end sync, DNS and lifecycle benchmarks against ``LocalAWS``.
+
+For every fleet size a fresh interpreter builds a synthetic fleet spread over
+all ``EC2Instance.REGION_CHOICES``, creates a throwaway database and measures:
+
+* ``sync_cold`` / ``sync_warm``: POST /sync-instances/ into an empty and into
+  an already-synced table (wall time, DB round trips, AWS calls),
+* ``lifecycle``: stop + start of up to 100 instances through the model methods,
+* ``dns_batched`` / ``dns_single``: Route53 upserts through
+  ``upsert_dns_records`` versus one ``update_dns_record`` call per record,
+* peak RSS of the whole run.
+
+Usage::
+
+    python -m benchmarks.bench_sync --sizes 10,1000,50000 [--output results.json]
+    BENCH_DATABASE=postgres python -m benchmarks.bench_sync
+    python -m benchmarks.compare benchmarks/results/sync-<old>.json benchmarks/results/sync-<new>.json
+"""
+import argparse
+import json
+import sys
+
+from benchmarks import harness
+
+DEFAULT_SIZES: tuple[int, ...] = (10, 100, 1000, 10_000, 50_000)
+MAX_DNS_RECORDS: int = 5000
+MAX_SINGLE_DNS_RECORDS: int = 200
+MAX_LIFECYCLE_INSTANCES: int = 100
+
+
+def run_single(size: int) -> dict:
+    harness.setup_django()
+    from django.test import Client
+
+    from ABL_routing import create_hosted_zone, update_dns_record, upsert_dns_records
+    from resources.api.local_aws import LocalAWS
+    from resources.models import EC2Instance
+
+    result: dict[str, object] = {'size': size}
+    with harness.test_database() as connection:
+        result['database'] = connection.vendor
+        aws = LocalAWS(regions=[code for code, _ in EC2Instance.REGION_CHOICES])
+        aws.add_fleet(size)
+        result['rss_after_fleet_mb'] = harness.peak_rss_mb()
+
+        with aws:
+            client = Client()
+            for scenario in ('sync_cold', 'sync_warm'):
+                response, stats = harness.measure(lambda: client.post('/sync-instances/'))
+                payload = json.loads(response.content)
+                if not payload.get('success') or payload['synced_count'] != size:
+                    raise RuntimeError(f'{scenario} synced {payload.get("synced_count")} of {size} instances: {payload}')
+                result[scenario] = {**stats, 'instances_per_second': round(size / stats['wall_seconds'], 1)}
+
+            sample = list(EC2Instance.objects.order_by('id')[:MAX_LIFECYCLE_INSTANCES])
+
+            def stop_and_start():
+                for instance in sample:
+                    instance.stop_instance()
+                    instance.start_instance()
+
+            if all(instance.creating_user.access_key_id for instance in sample):
+                _, stats = harness.measure(stop_and_start)
+                result['lifecycle'] = {**stats, 'instances': len(sample)}
+
+            zone_id = create_hosted_zone('bench.example.com')
+            records = [
+                {'name': f'host-{index}.bench.example.com', 'type': 'A', 'value': f'10.0.{index // 256 % 256}.{index % 256}'}
+                for index in range(min(size, MAX_DNS_RECORDS))
+            ]
+            ok, stats = harness.measure(lambda: upsert_dns_records(zone_id, records))
+            if not ok:
+                raise RuntimeError('upsert_dns_records failed')
+            result['dns_batched'] = {**stats, 'records': len(records), 'records_per_second': round(len(records) / stats['wall_seconds'], 1)}
+
+            single = records[:MAX_SINGLE_DNS_RECORDS]
+            _, stats = harness.measure(lambda: [update_dns_record(zone_id, r['name'], r['type'], r['value']) for r in single])
+            result['dns_single'] = {**stats, 'records': len(single), 'records_per_second': round(len(single) / stats['wall_seconds'], 1)}
+
+    result['peak_rss_mb'] = harness.peak_rss_mb()
+    return result
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)), help='comma separated fleet sizes')
+    parser.add_argument('--output', help='results file (default benchmarks/results/sync-<commit>.json)')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        print(json.dumps(run_single(args.single)))
+        return
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        result = harness.run_isolated('benchmarks.bench_sync', ['--single', str(size)])
+        print(
+            f"{size:>7} instances: cold sync {result['sync_cold']['wall_seconds']:.2f}s "
+            f"({result['sync_cold']['db_queries']} queries, {result['sync_cold']['aws_calls']} AWS calls), "
+            f"warm sync {result['sync_warm']['wall_seconds']:.2f}s, "
+            f"DNS {result['dns_batched']['records_per_second']:.0f} rec/s batched vs "
+            f"{result['dns_single']['records_per_second']:.0f} rec/s single, "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB",
+            file=sys.stderr,
+        )
+        results.append(result)
+    path = harness.write_results('sync', results, args.output)
+    print(f'Wrote {path}', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+Compare two benchmark result files.
+
+    python -m benchmarks.compare OLD.json NEW.json [--threshold 10]
+
+Results are matched on their ``size`` (or ``name``) key and every numeric
+metric is printed with its relative change; changes beyond the threshold
+are flagged. Exits non-zero when any timing metric regressed past it.
+"""
+import argparse
+import json
+import sys
+
+
+def flatten(result: dict, prefix: str = '') -> dict[str, float]:
+    flat: dict[str, float] = {}
+    for key, value in result.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def result_key(result: dict) -> object:
+    return result.get('size', result.get('name'))
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=10.0, help='percent change to flag (default 10)')
+    args = parser.parse_args(argv)
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print(f"{old['benchmark']}: {old['commit']} -> {new['commit']}")
+
+    old_results = {result_key(r): flatten(r) for r in old['results']}
+    regressed = False
+    for result in new['results']:
+        key = result_key(result)
+        before = old_results.get(key)
+        if before is None:
+            continue
+        print(f'\n[{key}]')
+        for metric, value in flatten(result).items():
+            if metric not in before or metric in ('size', 'name'):
+                continue
+            previous = before[metric]
+            change = (value - previous) / previous * 100 if previous else 0.0
+            flag = ''
+            if abs(change) >= args.threshold:
+                # Throughput metrics improve upwards, everything else downwards.
+                worse = change < 0 if metric.endswith('per_second') else change > 0
+                flag = '  REGRESSED' if worse else '  improved'
+                if worse and metric.endswith(('seconds', 'per_second')):
+                    regressed = True
+            print(f'  {metric:<40} {previous:>14,.3f} -> {value:>14,.3f}  ({change:+.1f}%){flag}')
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
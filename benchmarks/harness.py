@@ -0,0 +1,114 @@
+"""
+Shared plumbing for the benchmark scripts.
+
+Each measurement runs in a fresh interpreter (``run_isolated``) so peak RSS
+is a real per-scenario high-water mark, and results are written as JSON
+tagged with the git commit so ``benchmarks.compare`` can diff two runs.
+"""
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent
+REPO_DIR = BENCH_DIR.parent
+RESULTS_DIR = BENCH_DIR / 'results'
+
+
+def setup_django() -> None:
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+    # LocalAWS answers every call, but boto3 still wants credentials to exist.
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'local')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'local')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    """Create (and afterwards destroy) a throwaway migrated database."""
+    from django.db import connection
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def measure(func: Callable[[], object]) -> tuple[object, dict[str, float]]:
+    """Run ``func`` once; return its result with wall time, DB round trips and AWS calls."""
+    from django.db import connections
+    from InfraSmartRouter.profiling import RequestProfile, current_profile, query_counter
+
+    profile = RequestProfile()
+    token = current_profile.set(profile)
+    try:
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(query_counter))
+            started = time.perf_counter()
+            result = func()
+            wall = time.perf_counter() - started
+    finally:
+        current_profile.reset(token)
+    return result, {
+        'wall_seconds': round(wall, 6),
+        'db_queries': profile.queries,
+        'db_seconds': round(profile.query_seconds, 6),
+        'aws_calls': profile.aws_calls,
+        'aws_seconds': round(profile.aws_seconds, 6),
+    }
+
+
+def peak_rss_mb() -> float:
+    """High-water mark of this process's resident set size."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes everywhere else.
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 2)
+
+
+def run_isolated(module: str, args: list[str]) -> dict:
+    """Run ``python -m module *args`` and parse the JSON object on its last stdout line."""
+    env = {**os.environ, 'DJANGO_SETTINGS_MODULE': os.environ.get('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')}
+    completed = subprocess.run(
+        [sys.executable, '-m', module, *args],
+        cwd=REPO_DIR, env=env, capture_output=True, text=True, check=False,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f'{module} {" ".join(args)} failed:\n{completed.stderr}')
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def write_results(benchmark: str, results: list[dict], output: str | None, **metadata: object) -> Path:
+    commit = git_commit()
+    path = Path(output) if output else RESULTS_DIR / f'{benchmark}-{commit}.json'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        'benchmark': benchmark,
+        'commit': commit,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        **metadata,
+        'results': results,
+    }
+    path.write_text(json.dumps(payload, indent=2) + '\n')
+    return path
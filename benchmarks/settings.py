@@ -0,0 +1,32 @@
+"""
+Settings for the offline benchmark suite.
+
+Benchmarks run against Django's test database (an in-memory SQLite database
+by default, or ``test_<DB_NAME>`` on the Postgres server from the usual DB_*
+variables when BENCH_DATABASE=postgres) and against ``LocalAWS``, so they
+never touch real data or a real AWS account.
+"""
+import os
+
+from InfraSmartRouter.settings import *  # noqa: F401,F403
+from InfraSmartRouter.settings import LOGGING
+
+if os.getenv('BENCH_DATABASE', 'sqlite') == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('BENCH_SQLITE_PATH', ':memory:'),
+            'TEST': {'NAME': os.getenv('BENCH_SQLITE_PATH')},
+        }
+    }
+
+ALLOWED_HOSTS = ['testserver']
+
+# LocalAWS answers in-process, so AWS's own request limits don't apply.
+AWS_RATE_LIMITS = {
+    family: (1_000_000.0, 1_000_000)
+    for family in ('ec2:describe', 'ec2:mutate', 'route53', 'route53domains', 'sts', 'default')
+}
+AWS_MAX_IN_FLIGHT = 0
+
+LOGGING['root']['level'] = os.getenv('LOG_LEVEL', 'WARNING')
@@ -1,19 +1,44 @@
+import ipaddress
+import re
+
 from django.contrib import admin
-from .models import EC2Instance
+from django.utils.html import format_html_join
+from django.utils.safestring import mark_safe
+
+from InfraSmartRouter.pagination import EstimatedCountPaginator
+from resources.bulk import submit_instance_action
+from resources.tags import load_tags, parse_tag_filter, tagged
+from .models import ArchivedEC2Instance, EC2Instance, InstanceSchedule, TargetGroup
+
+AWS_INSTANCE_ID_RE = re.compile(r'i-[0-9a-f]{8,17}')
+
+
+class InstanceTagsMixin:
+    """Tags as last seen in AWS; change them in AWS or with ``resources.tags``."""
+
+    def tag_list(self, obj):
+        tags = sorted(load_tags([obj.pk]).get(obj.pk, {}).items())
+        return format_html_join(mark_safe('<br>'), '{}={}', tags) or '-'
+    tag_list.short_description = "Tags"
+
 
 @admin.register(EC2Instance)
-class EC2InstanceAdmin(admin.ModelAdmin):
+class EC2InstanceAdmin(InstanceTagsMixin, admin.ModelAdmin):
     list_display = ('name', 'aws_instance_id', 'status', 'instance_type', 'region', 'ip_address', 'creating_user', 'created_at')
+    list_select_related = ('creating_user',)
     list_filter = ('status', 'instance_type', 'region', 'created_at')
     search_fields = ('name', 'aws_instance_id', 'ip_address', 'creating_user__email')
     ordering = ('-created_at',)
+    # No exact COUNT(*) per page or for the unfiltered total on big tables
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     fieldsets = (
         ('Basic Info', {
             'fields': ('name', 'creating_user', 'instance_type', 'region')
         }),
         ('AWS Details', {
-            'fields': ('aws_instance_id', 'status', 'ip_address')
+            'fields': ('aws_instance_id', 'status', 'ip_address', 'tag_list')
         }),
         ('Connection', {
             'fields': ('port', 'username', 'password', 'ssh_key'),
@@ -25,25 +50,91 @@ class EC2InstanceAdmin(admin.ModelAdmin):
         }),
     )
     
-    readonly_fields = ('aws_instance_id', 'created_at', 'updated_at')
+    readonly_fields = ('aws_instance_id', 'tag_list', 'created_at', 'updated_at')
     
     actions = ['start_instances', 'stop_instances', 'refresh_status']
     
+    def get_search_results(self, request, queryset, search_term):
+        # An instance id or IP is an exact, indexed lookup instead of an icontains scan of every column
+        term = search_term.strip()
+        if term.startswith('tag:'):
+            # tag:key or tag:key=value, through the tag index
+            return tagged(queryset, *parse_tag_filter(term[4:])), False
+        if AWS_INSTANCE_ID_RE.fullmatch(term):
+            return queryset.filter(aws_instance_id=term), False
+        try:
+            ipaddress.ip_address(term)
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(ip_address=term), False
+    
+    def queue_action(self, request, queryset, action: str, verb: str):
+        """Hand the selection to a background job so large selections don't time out the request."""
+        instance_ids = list(queryset.order_by().values_list('pk', flat=True))
+        submit_instance_action(action, instance_ids)
+        self.message_user(request, f"{verb} {len(instance_ids)} instances in the background; statuses update as batches finish")
+    
     def start_instances(self, request, queryset):
-        for instance in queryset:
-            instance.start_instance()
-        self.message_user(request, f"Started {queryset.count()} instances")
+        self.queue_action(request, queryset, 'start', "Starting")
     start_instances.short_description = "Start selected instances"
     
     def stop_instances(self, request, queryset):
-        for instance in queryset:
-            instance.stop_instance()
-        self.message_user(request, f"Stopped {queryset.count()} instances")
+        self.queue_action(request, queryset, 'stop', "Stopping")
     stop_instances.short_description = "Stop selected instances"
     
     def refresh_status(self, request, queryset):
-        for instance in queryset:
-            instance.get_instance_status()
-            instance.get_instance_ip_address()
-        self.message_user(request, f"Refreshed status for {queryset.count()} instances")
+        self.queue_action(request, queryset, 'refresh', "Refreshing status for")
     refresh_status.short_description = "Refresh instance status and IP"
+
+
+@admin.register(ArchivedEC2Instance)
+class ArchivedEC2InstanceAdmin(InstanceTagsMixin, admin.ModelAdmin):
+    """Read-only view of instances moved out by ``manage.py archive_instances``."""
+    list_display = ('name', 'aws_instance_id', 'instance_type', 'region', 'creating_user', 'terminated_at', 'archived_at')
+    list_filter = ('region', 'instance_type', 'terminated_at')
+    list_select_related = ('creating_user',)
+    search_fields = ('=id', '=aws_instance_id', 'name')
+    ordering = ('-terminated_at',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    readonly_fields = ('tag_list',)
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(InstanceSchedule)
+class InstanceScheduleAdmin(admin.ModelAdmin):
+    """Deadlines and idle rules run by ``manage.py run_scheduler``."""
+    list_display = ('instance', 'stop_at', 'terminate_at', 'idle_action', 'next_due_at', 'last_action', 'last_action_at')
+    list_filter = ('idle_action', 'last_action')
+    list_select_related = ('instance',)
+    raw_id_fields = ('instance',)
+    search_fields = ('=instance__aws_instance_id', 'instance__name')
+    readonly_fields = ('idle_checked_at', 'next_due_at', 'last_action', 'last_action_at')
+    ordering = ('next_due_at',)
+
+
+@admin.register(TargetGroup)
+class TargetGroupAdmin(admin.ModelAdmin):
+    """Load balancer target groups kept in line with their instances by ``manage.py sync_target_groups``."""
+    list_display = ('name', 'region', 'owner', 'port', 'synced_at')
+    list_filter = ('region',)
+    list_select_related = ('owner',)
+    raw_id_fields = ('owner', 'instances')
+    search_fields = ('name', '=arn')
+    readonly_fields = ('synced_at',)
+    actions = ['sync_targets']
+
+    def sync_targets(self, request, queryset):
+        from resources.api.elb import sync_target_groups
+
+        counts = sync_target_groups(queryset.select_related('owner'))
+        self.message_user(
+            request,
+            f"Registered {counts['registered']} and deregistered {counts['deregistered']} targets in {counts['groups']} groups ({counts['failed']} failed)",
+        )
+    sync_targets.short_description = "Sync targets with instances now"
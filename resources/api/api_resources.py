@@ -1,76 +1,143 @@
+import logging
+from typing import TYPE_CHECKING
 
-import boto3
 from botocore.exceptions import BotoCoreError, ClientError
-from mypy_boto3_ec2.client import EC2Client
-from mypy_boto3_ec2.type_defs import ReservationResponseTypeDef, StartInstancesResultTypeDef, StopInstancesResultTypeDef, TerminateInstancesResultTypeDef
+from django.core.cache import cache
 
 from accounts.models import User
+from resources.api.clients import get_aws_client
+from resources.api.coalesce import get_flight
 
+logger = logging.getLogger(__name__)
 
-def get_ec2_client(user: User) -> EC2Client:
+# The stub packages take longer to import than boto3 itself; only type checkers need them.
+if TYPE_CHECKING:
+    from mypy_boto3_ec2.client import EC2Client
+    from mypy_boto3_ec2.type_defs import InstanceTypeDef, ReservationResponseTypeDef, StartInstancesResultTypeDef, StopInstancesResultTypeDef, TerminateInstancesResultTypeDef
+
+
+def get_ec2_client(user: User, region: str = "us-east-1") -> "EC2Client":
     """Initialize and return EC2 client with proper error handling."""
     access_key = user.access_key_id
     secret_key = user.secret_access_key
-    region = "us-east-1"
     
-    if not access_key or not secret_key:
+    if not user.role_arn and (not access_key or not secret_key):
         raise ValueError(
             "AWS credentials not found. Set AWS_ACCESS_KEY_ID and "  # pyright: ignore[reportImplicitStringConcatenation]
             "AWS_SECRET_ACCESS_KEY environment variables."
         )
-    client: EC2Client = boto3.client(
-        service_name="ec2",
-        aws_access_key_id=access_key,
-        aws_secret_access_key=secret_key,
-        region_name=region
+    client: EC2Client = get_aws_client(
+        "ec2",
+        region_name=region,
+        access_key_id=access_key,
+        secret_access_key=secret_key,
+        role_arn=user.role_arn,
     )
     return client
+
+
+# Canonical publishes the current image of each Ubuntu release in every region under this SSM parameter
+UBUNTU_AMI_PARAMETER: str = "/aws/service/canonical/ubuntu/server/20.04/stable/current/amd64/hvm/ebs-gp2/ami-id"
+AMI_CACHE_SECONDS: int = 24 * 60 * 60
+
+
+def ubuntu_ami_id(user: User, region: str) -> str | None:
+    """The Ubuntu 20.04 image in ``region``; AMI ids differ between regions."""
+    cache_key = f"ubuntu-ami:{region}"
+    ami_id = cache.get(cache_key)
+    if ami_id is None:
+        try:
+            ssm = get_aws_client(
+                "ssm",
+                region_name=region,
+                access_key_id=user.access_key_id,
+                secret_access_key=user.secret_access_key,
+                role_arn=user.role_arn,
+            )
+            ami_id = ssm.get_parameter(Name=UBUNTU_AMI_PARAMETER)["Parameter"]["Value"]
+        except (BotoCoreError, ClientError) as e:
+            logger.error("Error looking up AMI", extra={"region": region, "error": str(e)})
+            return None
+        cache.set(cache_key, ami_id, AMI_CACHE_SECONDS)
+    return ami_id
     
 
-def start_ec2_instances(user: User, instance_ids: list[str]) -> StartInstancesResultTypeDef | None:
+def start_ec2_instances(user: User, instance_ids: list[str], region: str = "us-east-1") -> "StartInstancesResultTypeDef | None":
     """Start EC2 instances."""
     try:
-        ec2 = get_ec2_client(user)
+        ec2 = get_ec2_client(user, region)
         response = ec2.start_instances(InstanceIds=instance_ids)
-        print(f"Starting instances: {instance_ids}")
+        logger.info("Starting instances", extra={"instance_ids": instance_ids, "region": region})
         return response
     except (BotoCoreError, ClientError) as e:
-        print(f"Error starting instances: {e}")
+        logger.error("Error starting instances", extra={"instance_ids": instance_ids, "region": region, "error": str(e)})
         return None
 
-def stop_ec2_instances(user: User, instance_ids: list[str]) -> StopInstancesResultTypeDef | None:
+def stop_ec2_instances(user: User, instance_ids: list[str], region: str = "us-east-1") -> "StopInstancesResultTypeDef | None":
     """Stop EC2 instances."""
     try:
-        ec2 = get_ec2_client(user)
+        ec2 = get_ec2_client(user, region)
         response = ec2.stop_instances(InstanceIds=instance_ids)
-        print(f"Stopping instances: {instance_ids}")
+        logger.info("Stopping instances", extra={"instance_ids": instance_ids, "region": region})
         return response
     except (BotoCoreError, ClientError) as e:
-        print(f"Error stopping instances: {e}")
+        logger.error("Error stopping instances", extra={"instance_ids": instance_ids, "region": region, "error": str(e)})
         return None
 
-def terminate_ec2_instances(user: User, instance_ids: list[str]) -> TerminateInstancesResultTypeDef | None:
+def terminate_ec2_instances(user: User, instance_ids: list[str], region: str = "us-east-1") -> "TerminateInstancesResultTypeDef | None":
     """Terminate (delete) EC2 instances."""
     try:
-        ec2 = get_ec2_client(user)
+        ec2 = get_ec2_client(user, region)
         response = ec2.terminate_instances(InstanceIds=instance_ids)
-        print(f"Terminating instances: {instance_ids}")
+        logger.info("Terminating instances", extra={"instance_ids": instance_ids, "region": region})
         return response
     except (BotoCoreError, ClientError) as e:
-        print(f"Error terminating instances: {e}")
+        logger.error("Error terminating instances", extra={"instance_ids": instance_ids, "region": region, "error": str(e)})
+        return None
+
+def describe_instance(user: User, instance_id: str, region: str = "us-east-1") -> "InstanceTypeDef | None":
+    """Describe one instance; concurrent callers asking for the same instance share one call."""
+    def describe() -> "InstanceTypeDef | None":
+        ec2 = get_ec2_client(user, region)
+        response = ec2.describe_instances(InstanceIds=[instance_id])
+        for reservation in response["Reservations"]:
+            for instance in reservation["Instances"]:
+                return instance
         return None
 
+    account = user.role_arn or user.access_key_id
+    instance, _ = get_flight("describe_instance").do((account, region, instance_id), describe)
+    return instance
+
+def describe_ec2_instances(user: User, instance_ids: list[str], region: str = "us-east-1") -> "list[InstanceTypeDef]":
+    """Describe many instances of one region, following pagination."""
+    ec2 = get_ec2_client(user, region)
+    paginator = ec2.get_paginator("describe_instances")
+    return [
+        instance
+        for page in paginator.paginate(InstanceIds=instance_ids)
+        for reservation in page["Reservations"]
+        for instance in reservation["Instances"]
+    ]
+
+def tag_specifications(tags: dict[str, str]) -> list[dict]:
+    """``TagSpecifications`` that tag instances at launch, so they are never untagged."""
+    return [{"ResourceType": "instance", "Tags": [{"Key": key, "Value": value} for key, value in tags.items()]}]
+
+
 def create_ec2_instance(
     user: User,
     ami_id: str,
     instance_type: str = "t2.micro", 
     key_name: str | None = None, 
     security_group_ids: list[str] | None = None, 
-    subnet_id: str | None = None
+    subnet_id: str | None = None,
+    tags: dict[str, str] | None = None,
+    region: str = "us-east-1",
 ) -> str | None:
     """Create a new EC2 instance."""
     try:
-        ec2: EC2Client = get_ec2_client(user)
+        ec2: EC2Client = get_ec2_client(user, region)
         
         # Build parameters for run_instances
         params: dict[str, object] = {
@@ -86,13 +153,64 @@ def create_ec2_instance(
             params["SecurityGroupIds"] = security_group_ids
         if subnet_id:
             params["SubnetId"] = subnet_id
+        if tags:
+            params["TagSpecifications"] = tag_specifications(tags)
 
         response: ReservationResponseTypeDef = ec2.run_instances(**params)
         instance_id = response["Instances"][0].get("InstanceId")
-        print(f"Created instance: {instance_id}")
+        logger.info("Created instance", extra={"instance_id": instance_id, "instance_type": instance_type, "region": region})
         return instance_id
     except (BotoCoreError, ClientError) as e:
-        print(f"Error creating instance: {e}")
+        logger.error("Error creating instance", extra={"instance_type": instance_type, "region": region, "error": str(e)})
+        return None
+
+
+def run_ec2_instances(
+    user: User,
+    ami_id: str,
+    instance_type: str,
+    count: int,
+    region: str = "us-east-1",
+    tags: dict[str, str] | None = None,
+) -> "list[InstanceTypeDef] | None":
+    """Launch ``count`` identical instances in one call; all of them or none."""
+    try:
+        ec2 = get_ec2_client(user, region)
+        params: dict[str, object] = {
+            "ImageId": ami_id,
+            "InstanceType": instance_type,
+            "MinCount": count,
+            "MaxCount": count,
+        }
+        if tags:
+            params["TagSpecifications"] = tag_specifications(tags)
+        response: ReservationResponseTypeDef = ec2.run_instances(**params)
+        logger.info("Launched instances", extra={"count": count, "instance_type": instance_type, "region": region})
+        return response["Instances"]
+    except (BotoCoreError, ClientError) as e:
+        logger.error("Error launching instances", extra={"count": count, "instance_type": instance_type, "region": region, "error": str(e)})
         return None
 
 
+def create_ec2_tags(user: User, instance_ids: list[str], tags: dict[str, str], region: str = "us-east-1") -> bool:
+    """Add or overwrite ``tags`` on up to 1000 instances in one call."""
+    try:
+        ec2 = get_ec2_client(user, region)
+        ec2.create_tags(Resources=instance_ids, Tags=[{"Key": key, "Value": value} for key, value in tags.items()])
+        logger.info("Tagged instances", extra={"count": len(instance_ids), "keys": sorted(tags), "region": region})
+        return True
+    except (BotoCoreError, ClientError) as e:
+        logger.error("Error tagging instances", extra={"count": len(instance_ids), "region": region, "error": str(e)})
+        return False
+
+
+def delete_ec2_tags(user: User, instance_ids: list[str], keys: list[str], region: str = "us-east-1") -> bool:
+    """Remove the tags named ``keys`` (whatever their value) from up to 1000 instances in one call."""
+    try:
+        ec2 = get_ec2_client(user, region)
+        ec2.delete_tags(Resources=instance_ids, Tags=[{"Key": key} for key in keys])
+        logger.info("Untagged instances", extra={"count": len(instance_ids), "keys": sorted(keys), "region": region})
+        return True
+    except (BotoCoreError, ClientError) as e:
+        logger.error("Error untagging instances", extra={"count": len(instance_ids), "region": region, "error": str(e)})
+        return False
@@ -0,0 +1,169 @@
+"""
+Single place where boto3 clients get built.
+
+Every client uses botocore's ``adaptive`` retry mode and is attached to the
+shared rate limiter, so callers never have to think about throttling.
+Clients are cached per (service, region, credentials) since building one
+costs far more than the API call it is usually made for.
+"""
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+
+from InfraSmartRouter.metrics import REGISTRY, instrument_client, metrics_enabled
+from InfraSmartRouter.profiling import profile_client
+from resources.api.rate_limit import AWSRateLimiter
+
+if TYPE_CHECKING:
+    from botocore.config import Config
+
+DEFAULT_ACCOUNT: str = 'default'
+
+# Callables run on every new client, e.g. to point it at a local stand-in.
+_client_hooks: list[Callable] = []
+
+_clients: OrderedDict[tuple, object] = OrderedDict()
+_clients_lock = threading.Lock()
+
+_rate_limiter: AWSRateLimiter | None = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> AWSRateLimiter:
+    """Return the process-wide rate limiter, creating it from settings on first use."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                _rate_limiter = AWSRateLimiter(
+                    limits=getattr(settings, 'AWS_RATE_LIMITS', None),
+                    max_in_flight=getattr(settings, 'AWS_MAX_IN_FLIGHT', 0),
+                )
+                REGISTRY.register_collector(_rate_limit_metrics)
+    return _rate_limiter
+
+
+RATE_LIMIT_COUNTERS: tuple[tuple[str, str, str], ...] = (
+    ('calls', 'aws_rate_limit_calls_total', 'Calls that passed through a rate-limit bucket.'),
+    ('throttles', 'aws_rate_limit_throttles_total', 'Throttling responses seen per bucket.'),
+    ('retries', 'aws_rate_limit_retries_total', 'botocore retries per bucket.'),
+    ('wait_seconds', 'aws_rate_limit_queue_wait_seconds_total', 'Time spent waiting for a token.'),
+)
+
+
+def _rate_limit_metrics() -> list[str]:
+    """Expose the rate limiter's bucket counters in Prometheus format."""
+    snapshot = get_rate_limiter().snapshot()
+    lines: list[str] = []
+    for field, name, documentation in RATE_LIMIT_COUNTERS:
+        lines += [f'# HELP {name} {documentation}', f'# TYPE {name} counter']
+        for bucket in snapshot:
+            # Only the tail of the access key id, so scrapes don't leak it.
+            account = str(bucket['account'])
+            if account != DEFAULT_ACCOUNT:
+                account = account[-4:]
+            lines.append(
+                f'{name}{{account="{account}",region="{bucket["region"]}",family="{bucket["family"]}"}} {bucket[field]}'
+            )
+    return lines
+
+
+def register_client_hook(hook: Callable) -> None:
+    if hook not in _client_hooks:
+        _client_hooks.append(hook)
+        clear_client_cache()
+
+
+def unregister_client_hook(hook: Callable) -> None:
+    if hook in _client_hooks:
+        _client_hooks.remove(hook)
+        clear_client_cache()
+
+
+def clear_client_cache() -> None:
+    """Drop cached clients, e.g. after the client hooks changed."""
+    with _clients_lock:
+        _clients.clear()
+
+
+def client_config() -> "Config":
+    """botocore config shared by every client the app creates."""
+    from botocore.config import Config
+
+    return Config(
+        retries={
+            'mode': getattr(settings, 'AWS_RETRY_MODE', 'adaptive'),
+            'max_attempts': getattr(settings, 'AWS_RETRY_MAX_ATTEMPTS', 8),
+        },
+        max_pool_connections=getattr(settings, 'AWS_MAX_POOL_CONNECTIONS', 20),
+    )
+
+
+def get_aws_client(
+    service_name: str,
+    region_name: str = 'us-east-1',
+    access_key_id: str | None = None,
+    secret_access_key: str | None = None,
+    role_arn: str | None = None,
+):
+    """
+    Return a cached, rate-limited boto3 client.
+
+    Without explicit keys boto3 falls back to its default credential chain
+    (environment variables, instance profile, ...), which is bucketed as the
+    ``default`` account. With ``role_arn`` the keys are only used to assume
+    the role and the client runs on the role's refreshable credentials.
+    """
+    key = (service_name, region_name, access_key_id or None, secret_access_key or None, role_arn or None)
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            # Least recently used goes first when the cache is full
+            _clients.move_to_end(key)
+            return client
+        client = _clients[key] = _build_client(service_name, region_name, access_key_id, secret_access_key, role_arn)
+        while len(_clients) > getattr(settings, 'AWS_CLIENT_CACHE_SIZE', 256):
+            _clients.popitem(last=False)
+    return client
+
+
+def _build_client(
+    service_name: str,
+    region_name: str,
+    access_key_id: str | None,
+    secret_access_key: str | None,
+    role_arn: str | None,
+):
+    # boto3 is imported on the first client, not at startup: management
+    # commands and worker boot never pay for it unless they call AWS.
+    import boto3
+
+    if role_arn:
+        from resources.api.credentials import get_assumed_role
+
+        role = get_assumed_role(role_arn, access_key_id, secret_access_key)
+        client = boto3.Session(botocore_session=role.session).client(
+            service_name,
+            region_name=region_name,
+            config=client_config(),
+        )
+        account = role.account_id
+    else:
+        client = boto3.client(
+            service_name,
+            region_name=region_name,
+            aws_access_key_id=access_key_id or None,
+            aws_secret_access_key=secret_access_key or None,
+            config=client_config(),
+        )
+        account = access_key_id or DEFAULT_ACCOUNT
+    get_rate_limiter().attach(client, account=account, region=region_name)
+    if metrics_enabled():
+        instrument_client(client, region_name)
+    profile_client(client)
+    for hook in _client_hooks:
+        hook(client)
+    return client
@@ -0,0 +1,173 @@
+"""
+CPU, network and status-check metrics of tracked instances from CloudWatch.
+
+``GetMetricData`` takes up to 500 metric queries per call, so instead of one
+``GetMetricStatistics`` call per instance and metric, the collector groups
+every live instance by account and region and asks for all of their
+metrics in ``ceil(instances * len(METRICS) / 500)`` calls per group. The
+datapoints are upserted into ``InstanceMetricSample``, one row per
+(instance, metric, period), and read back through ``latest_metrics`` and
+``metric_series``.
+
+Run ``python manage.py collect_metrics`` every few minutes (e.g. from cron).
+"""
+import logging
+from collections.abc import Iterable
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from resources.models import EC2Instance, InstanceMetricSample
+
+logger = logging.getLogger(__name__)
+
+MAX_QUERIES_PER_CALL: int = 500
+WRITE_BATCH_SIZE: int = 1000
+
+
+@dataclass(frozen=True)
+class MetricSpec:
+    code: int
+    metric_name: str
+    stat: str
+
+
+# Indexed by InstanceMetricSample.METRICS code.
+METRICS: tuple[MetricSpec, ...] = (
+    MetricSpec(0, 'CPUUtilization', 'Average'),
+    MetricSpec(1, 'NetworkIn', 'Sum'),
+    MetricSpec(2, 'NetworkOut', 'Sum'),
+    MetricSpec(3, 'StatusCheckFailed', 'Maximum'),
+)
+
+
+def metric_queries(instances: Iterable[tuple[int, str]], period: int) -> tuple[list[dict], dict[str, tuple[int, int]]]:
+    """``MetricDataQueries`` for every metric of ``(pk, aws_instance_id)`` pairs, and query id -> (pk, metric code)."""
+    queries = []
+    targets: dict[str, tuple[int, int]] = {}
+    for pk, aws_instance_id in instances:
+        for spec in METRICS:
+            query_id = f'm{pk}_{spec.code}'
+            targets[query_id] = (pk, spec.code)
+            queries.append({
+                'Id': query_id,
+                'MetricStat': {
+                    'Metric': {
+                        'Namespace': 'AWS/EC2',
+                        'MetricName': spec.metric_name,
+                        'Dimensions': [{'Name': 'InstanceId', 'Value': aws_instance_id}],
+                    },
+                    'Period': period,
+                    'Stat': spec.stat,
+                },
+                'ReturnData': True,
+            })
+    return queries, targets
+
+
+def fetch_samples(client, queries: list[dict], targets: dict[str, tuple[int, int]], start: datetime, end: datetime) -> list[InstanceMetricSample]:
+    """Run ``queries`` in calls of up to ``MAX_QUERIES_PER_CALL``, following pagination."""
+    samples = []
+    paginator = client.get_paginator('get_metric_data')
+    for offset in range(0, len(queries), MAX_QUERIES_PER_CALL):
+        pages = paginator.paginate(
+            MetricDataQueries=queries[offset:offset + MAX_QUERIES_PER_CALL],
+            StartTime=start,
+            EndTime=end,
+        )
+        for page in pages:
+            for result in page['MetricDataResults']:
+                pk, code = targets[result['Id']]
+                samples.extend(
+                    InstanceMetricSample(instance_id=pk, metric=code, at=at, value=value)
+                    for at, value in zip(result['Timestamps'], result['Values'])
+                )
+    return samples
+
+
+def collect_account_metrics(account, now: datetime | None = None) -> int:
+    """Collect the last ``CLOUDWATCH_LOOKBACK_SECONDS`` of metrics of one account's live instances."""
+    period = getattr(settings, 'CLOUDWATCH_PERIOD_SECONDS', 300)
+    now = now or timezone.now()
+    # Whole periods only; the current one is still filling up
+    end = datetime.fromtimestamp(now.timestamp() // period * period, tz=now.tzinfo)
+    start = end - timedelta(seconds=getattr(settings, 'CLOUDWATCH_LOOKBACK_SECONDS', 900))
+
+    by_region: dict[str, list[tuple[int, str]]] = {}
+    instances = (
+        EC2Instance.objects
+        .filter(creating_user_id__in=account.user_ids, aws_instance_id__isnull=False)
+        .exclude(status='terminated')
+        .order_by()
+        .values_list('region', 'pk', 'aws_instance_id')
+    )
+    for region, pk, aws_instance_id in instances:
+        by_region.setdefault(region, []).append((pk, aws_instance_id))
+
+    written = 0
+    for region, region_instances in by_region.items():
+        queries, targets = metric_queries(region_instances, period)
+        try:
+            samples = fetch_samples(account.client('cloudwatch', region), queries, targets, start, end)
+        except Exception as e:
+            logger.error("Error collecting metrics", extra={'account': account.label, 'region': region, 'error': str(e)})
+            continue
+        InstanceMetricSample.objects.bulk_create(
+            samples,
+            batch_size=WRITE_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['instance_id', 'metric', 'at'],
+            update_fields=['value'],
+        )
+        written += len(samples)
+        logger.info("Collected metrics", extra={
+            'account': account.label,
+            'region': region,
+            'instances': len(region_instances),
+            'samples': len(samples),
+        })
+    return written
+
+
+def collect_metrics(accounts: Iterable, now: datetime | None = None) -> int:
+    """Collect metrics for every account; return the number of samples written."""
+    return sum(collect_account_metrics(account, now) for account in accounts)
+
+
+def prune_metric_samples(now: datetime | None = None) -> int:
+    """Delete samples older than ``CLOUDWATCH_RETENTION_DAYS``."""
+    cutoff = (now or timezone.now()) - timedelta(days=getattr(settings, 'CLOUDWATCH_RETENTION_DAYS', 14))
+    deleted, _ = InstanceMetricSample.objects.filter(at__lt=cutoff).delete()
+    return deleted
+
+
+def latest_metrics(instance_ids: Iterable[int], since: datetime | None = None) -> dict[int, dict[str, float]]:
+    """Newest value of each metric per instance, from the last hour unless ``since`` is given."""
+    since = since or timezone.now() - timedelta(hours=1)
+    latest: dict[int, dict[str, float]] = {}
+    samples = (
+        InstanceMetricSample.objects
+        .filter(instance_id__in=list(instance_ids), at__gte=since)
+        .order_by('at')
+        .values_list('instance_id', 'metric', 'value')
+    )
+    for instance_id, metric, value in samples:
+        latest.setdefault(instance_id, {})[InstanceMetricSample.METRICS[metric]] = value
+    return latest
+
+
+def metric_series(instance_id: int, metric: str, start: datetime, end: datetime | None = None) -> list[tuple[datetime, float]]:
+    """``(period start, value)`` points of one metric of one instance, oldest first."""
+    return list(
+        InstanceMetricSample.objects
+        .filter(
+            instance_id=instance_id,
+            metric=InstanceMetricSample.METRICS.index(metric),
+            at__gte=start,
+            at__lt=end or timezone.now(),
+        )
+        .order_by('at')
+        .values_list('at', 'value')
+    )
@@ -0,0 +1,202 @@
+"""
+Single-flight coalescing of identical concurrent AWS reads.
+
+When several requests ask for the same thing at once (dashboard tabs polling
+one instance's status, users pressing Sync together), only the first caller
+runs the AWS call and the others wait for its result::
+
+    status_flight = get_flight('describe_instance')
+    instance, shared = status_flight.do((account, region, instance_id), lambda: ...)
+
+``SingleFlight`` coalesces callers of one process, whether they are threads
+or asyncio tasks (``await flight.do_async(key, fn)``). With
+``AWS_COALESCE_BACKEND = 'database'`` the flights also take a Postgres
+advisory lock per key and publish results through the Django cache, so
+workers sharing a cache (Redis, database cache, ...) coalesce with each
+other too. Results are shared between callers and must be treated as
+read-only; ``shared`` tells a caller it got someone else's result.
+"""
+import asyncio
+import hashlib
+import logging
+import pickle
+import threading
+from collections.abc import Callable, Hashable, Iterator
+from contextlib import contextmanager
+from typing import Any
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from InfraSmartRouter.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+COALESCED_CALLS = REGISTRY.counter(
+    'aws_coalesced_calls_total',
+    'Coalesced AWS reads; role="leader" made the call, role="follower" reused its result, '
+    'role="remote_follower" reused a result another worker published.',
+    ('flight', 'role'),
+)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: BaseException | None = None
+        # (loop, future) pairs of asyncio followers
+        self.waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+
+class SingleFlight:
+    """In-process coalescing across threads and asyncio tasks."""
+
+    def __init__(self, name: str):
+        self.name: str = name
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key: Hashable) -> tuple[_Call, bool]:
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                COALESCED_CALLS.inc(flight=self.name, role='follower')
+                return call, False
+            call = self._calls[key] = _Call()
+        COALESCED_CALLS.inc(flight=self.name, role='leader')
+        return call, True
+
+    def _lead(self, key: Hashable, call: _Call, fn: Callable[[], Any]) -> None:
+        try:
+            call.result = self._call(key, fn)
+        except BaseException as e:
+            call.error = e
+        finally:
+            # Under the lock, so an async follower either registers before this or sees ``done``.
+            with self._lock:
+                del self._calls[key]
+                call.done.set()
+                waiters, call.waiters = call.waiters, []
+            for loop, future in waiters:
+                loop.call_soon_threadsafe(_settle, future)
+
+    def _call(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        return fn()
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """Run ``fn`` unless a call for ``key`` is in flight; return ``(result, shared)``."""
+        call, leader = self._join(key)
+        if leader:
+            self._lead(key, call, fn)
+        else:
+            call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
+
+    async def do_async(self, key: Hashable, fn: Callable[[], Any]) -> tuple[Any, bool]:
+        """``do`` for coroutines: ``fn`` runs in a worker thread, followers await without one."""
+        call, leader = self._join(key)
+        if leader:
+            await asyncio.to_thread(self._lead, key, call, fn)
+        else:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            with self._lock:
+                registered = not call.done.is_set()
+                if registered:
+                    call.waiters.append((loop, future))
+            if registered:
+                await future
+        if call.error is not None:
+            raise call.error
+        return call.result, not leader
+
+
+def _settle(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+def advisory_lock_id(*parts: object) -> int:
+    """Signed 64-bit lock id for ``pg_advisory_lock`` from any key."""
+    digest = hashlib.sha256(repr(parts).encode()).digest()
+    return int.from_bytes(digest[:8], 'big', signed=True)
+
+
+@contextmanager
+def advisory_lock(*key: object, transactional: bool = False) -> Iterator[None]:
+    """
+    Hold a Postgres advisory lock on ``key`` while the block runs.
+
+    ``transactional`` locks take ``pg_advisory_xact_lock`` and must run inside
+    ``transaction.atomic()``; they are released at commit. Other databases
+    have no advisory locks and the block simply runs.
+    """
+    if connection.vendor != 'postgresql':
+        yield
+        return
+    lock_id = advisory_lock_id(*key)
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT pg_advisory{"_xact" if transactional else ""}_lock(%s)', [lock_id])
+    if transactional:
+        yield
+        return
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id])
+
+
+class DatabaseSingleFlight(SingleFlight):
+    """
+    Coalescing across worker processes as well.
+
+    The in-process leader takes an advisory lock on the key; while another
+    worker's leader holds it, it waits and then reuses that result from the
+    cache instead of calling AWS again. Results are kept for
+    ``AWS_COALESCE_TTL`` seconds.
+    """
+
+    def _cache_key(self, key: Hashable) -> str:
+        return f'coalesce:{self.name}:{hashlib.sha256(repr(key).encode()).hexdigest()}'
+
+    def _call(self, key: Hashable, fn: Callable[[], Any]) -> Any:
+        cache_key = self._cache_key(key)
+        # Sync's region reads and ``do_async`` lead from pool threads; Django never closes the
+        # connections those open, so close the one opened here for the lock and cache.
+        opened = connection.connection is None
+        try:
+            with advisory_lock('coalesce', self.name, key):
+                cached = cache.get(cache_key)
+                if cached is not None:
+                    COALESCED_CALLS.inc(flight=self.name, role='remote_follower')
+                    return pickle.loads(cached)
+                result = fn()
+                cache.set(cache_key, pickle.dumps(result), getattr(settings, 'AWS_COALESCE_TTL', 2))
+                return result
+        finally:
+            if opened:
+                connection.close()
+
+
+_flights: dict[str, SingleFlight] = {}
+_flights_lock = threading.Lock()
+
+
+def get_flight(name: str) -> SingleFlight:
+    """The process-wide flight for ``name``, of the class ``AWS_COALESCE_BACKEND`` selects."""
+    flight = _flights.get(name)
+    if flight is None:
+        with _flights_lock:
+            flight = _flights.get(name)
+            if flight is None:
+                backend = getattr(settings, 'AWS_COALESCE_BACKEND', 'local')
+                flight_class = DatabaseSingleFlight if backend == 'database' else SingleFlight
+                flight = _flights[name] = flight_class(name)
+    return flight
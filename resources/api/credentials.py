@@ -0,0 +1,206 @@
+"""
+Short-lived credentials for users that act through an IAM role.
+
+A user with a ``role_arn`` gets STS ``AssumeRole`` credentials instead of
+using their long-lived keys directly. Each (role, source keys) pair has one
+``AssumedRole`` per process that caches the temporary credentials, and a
+background thread assumes the role again ``AWS_CREDENTIAL_REFRESH_MARGIN``
+seconds before they expire. botocore's ``RefreshableCredentials`` only asks
+for new credentials inside its own 15 minute advisory window, which is later
+than the refresher runs, so it picks up the already-fetched credentials
+without waiting on STS. Clients are built once on top of these credentials
+and keep working across rotations.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from typing import TYPE_CHECKING
+
+from django.conf import settings
+
+from InfraSmartRouter.metrics import REGISTRY
+
+if TYPE_CHECKING:
+    from botocore.credentials import RefreshableCredentials
+
+logger = logging.getLogger(__name__)
+
+CREDENTIAL_REFRESHES = REGISTRY.counter(
+    'aws_credential_refreshes_total',
+    'STS AssumeRole calls, by whether a caller had to wait (inline) or not (background).',
+    ('mode', 'outcome'),
+)
+
+RETRY_DELAY_SECONDS: float = 60.0
+# botocore's RefreshableCredentials start refreshing this long before expiry.
+BOTOCORE_ADVISORY_REFRESH_SECONDS: int = 900
+
+
+def role_account_id(role_arn: str) -> str:
+    """Account id out of ``arn:aws:iam::<account>:role/<name>``."""
+    parts = role_arn.split(':')
+    return parts[4] if len(parts) > 5 and parts[4] else role_arn
+
+
+class _FixedCredentialProvider:
+    """Hands a botocore session an already-built credentials object (a duck-typed ``CredentialProvider``)."""
+    METHOD = 'assume-role-cache'
+    CANONICAL_NAME = 'assume-role-cache'
+
+    def __init__(self, credentials):
+        self._credentials = credentials
+
+    def load(self):
+        return self._credentials
+
+
+class AssumedRole:
+    """Cached STS credentials for one role, refreshed ahead of expiry."""
+
+    def __init__(self, role_arn: str, access_key_id: str | None, secret_access_key: str | None):
+        import botocore.session
+        from botocore.credentials import DeferredRefreshableCredentials
+
+        self.role_arn: str = role_arn
+        self.access_key_id: str | None = access_key_id
+        self.secret_access_key: str | None = secret_access_key
+        self._metadata: dict[str, str] | None = None
+        self._expires_at: datetime | None = None
+        self._lock = threading.Lock()
+        self.credentials: "RefreshableCredentials" = DeferredRefreshableCredentials(
+            refresh_using=self.fetch,
+            method=_FixedCredentialProvider.METHOD,
+        )
+        self.session = botocore.session.Session()
+        self.session.get_component('credential_provider').insert_before('env', _FixedCredentialProvider(self.credentials))
+
+    @property
+    def account_id(self) -> str:
+        return role_account_id(self.role_arn)
+
+    @property
+    def expires_at(self) -> datetime | None:
+        return self._expires_at
+
+    def fetch(self) -> dict[str, str]:
+        """
+        ``refresh_using`` callback for botocore.
+
+        Returns the cached credentials unless they are about to enter
+        botocore's mandatory refresh window, in which case the caller has to
+        wait for an inline ``AssumeRole``.
+        """
+        with self._lock:
+            minimum = timedelta(seconds=BOTOCORE_ADVISORY_REFRESH_SECONDS)
+            if self._metadata is not None and self._expires_at - datetime.now(timezone.utc) > minimum:
+                return self._metadata
+            return self._assume(mode='inline')
+
+    def refresh(self) -> None:
+        """Assume the role again ahead of time; called by the background refresher."""
+        with self._lock:
+            self._assume(mode='background')
+
+    def _assume(self, mode: str) -> dict[str, str]:
+        from resources.api.clients import get_aws_client
+
+        sts = get_aws_client(
+            'sts',
+            region_name=getattr(settings, 'AWS_STS_REGION', 'us-east-1'),
+            access_key_id=self.access_key_id,
+            secret_access_key=self.secret_access_key,
+        )
+        try:
+            response = sts.assume_role(
+                RoleArn=self.role_arn,
+                RoleSessionName=getattr(settings, 'AWS_ROLE_SESSION_NAME', 'infrasmartrouter'),
+                DurationSeconds=getattr(settings, 'AWS_ROLE_SESSION_SECONDS', 3600),
+            )
+        except Exception:
+            CREDENTIAL_REFRESHES.inc(mode=mode, outcome='error')
+            raise
+        CREDENTIAL_REFRESHES.inc(mode=mode, outcome='ok')
+        credentials = response['Credentials']
+        self._expires_at = credentials['Expiration']
+        self._metadata = {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': self._expires_at.isoformat(),
+        }
+        # Short sessions refresh half way through rather than immediately.
+        now = time.time()
+        lifetime = self._expires_at.timestamp() - now
+        margin = getattr(settings, 'AWS_CREDENTIAL_REFRESH_MARGIN', 1200)
+        get_refresher().schedule(self, max(self._expires_at.timestamp() - margin, now + lifetime / 2))
+        logger.info("Assumed role", extra={
+            'account': self.account_id,
+            'mode': mode,
+            'expires_at': self._expires_at.isoformat(),
+        })
+        return self._metadata
+
+
+class CredentialRefresher:
+    """Daemon thread that refreshes ``AssumedRole`` credentials when they come due."""
+
+    def __init__(self):
+        self._due: list[tuple[float, int, AssumedRole]] = []
+        self._scheduled: dict[int, float] = {}
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+        self._thread: threading.Thread | None = None
+
+    def schedule(self, role: AssumedRole, at: float) -> None:
+        with self._condition:
+            # Only the latest schedule per role counts; stale heap entries are skipped.
+            self._scheduled[id(role)] = at
+            heapq.heappush(self._due, (at, next(self._order), role))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='aws-credential-refresher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._due or self._due[0][0] > time.time():
+                    self._condition.wait(self._due[0][0] - time.time() if self._due else None)
+                at, _, role = heapq.heappop(self._due)
+                if self._scheduled.get(id(role)) != at:
+                    continue
+                del self._scheduled[id(role)]
+            try:
+                role.refresh()
+            except Exception as e:
+                logger.error("Error refreshing role credentials", extra={'account': role.account_id, 'error': str(e)})
+                self.schedule(role, time.time() + RETRY_DELAY_SECONDS)
+
+
+_refresher: CredentialRefresher | None = None
+_roles: dict[tuple[str, str | None], AssumedRole] = {}
+_lock = threading.Lock()
+
+
+def get_refresher() -> CredentialRefresher:
+    global _refresher
+    with _lock:
+        if _refresher is None:
+            _refresher = CredentialRefresher()
+    return _refresher
+
+
+def get_assumed_role(role_arn: str, access_key_id: str | None = None, secret_access_key: str | None = None) -> AssumedRole:
+    """Return the process-wide ``AssumedRole`` for a role and the keys used to assume it."""
+    key = (role_arn, access_key_id or None)
+    role = _roles.get(key)
+    if role is None:
+        with _lock:
+            role = _roles.get(key)
+            if role is None:
+                role = _roles[key] = AssumedRole(role_arn, access_key_id or None, secret_access_key or None)
+    return role
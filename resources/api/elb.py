@@ -0,0 +1,209 @@
+"""
+Keep ELBv2 target groups registered with the instances that should serve.
+
+A ``TargetGroup`` row names an existing target group and the
+``EC2Instance`` rows behind it. ``sync_target_groups`` compares what each
+group should serve with what the load balancer has registered and closes
+the gap:
+
+- Members that are running and not failing their last status check
+  (``status_check_failed`` from ``collect_metrics``) should be registered.
+- Other members are deregistered, and so are instances the app launched
+  (tagged ``managed-by``) that are no longer members.
+- Anything else registered outside the app is left alone.
+
+Targets are added and removed with ``register_targets`` /
+``deregister_targets`` in calls of up to ``TARGETS_PER_CALL`` instead of
+one call per instance. Desired members and their last status check for
+every group come from two queries.
+
+``describe_target_health`` results are cached per target group for
+``ELB_TARGET_HEALTH_CACHE_SECONDS``. Dashboards and repeated syncs don't
+call AWS each time, and the cache is dropped whenever the app changes
+the registrations.
+
+Run ``python manage.py sync_target_groups`` (``sync_worker`` also runs it
+after every pass).
+"""
+import logging
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+from botocore.exceptions import BotoCoreError, ClientError
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from resources.models import EC2Instance, TargetGroup
+
+logger = logging.getLogger(__name__)
+
+TARGETS_PER_CALL: int = 500
+# Targets on their way out; registering them again is allowed, deregistering is a no-op
+LEAVING_STATES: frozenset[str] = frozenset({'draining'})
+
+
+@dataclass(frozen=True)
+class TargetState:
+    port: int | None
+    state: str
+    reason: str = ''
+
+
+@dataclass
+class TargetSyncResult:
+    registered: list[str] = field(default_factory=list)
+    deregistered: list[str] = field(default_factory=list)
+    unchanged: int = 0
+
+
+def health_cache_key(arn: str) -> str:
+    return f'elb:target-health:{arn}'
+
+
+def describe_target_health(client, arn: str, refresh: bool = False) -> dict[str, TargetState]:
+    """Registered targets of a target group by instance id, from the cache unless ``refresh``."""
+    key = health_cache_key(arn)
+    if not refresh:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+    response = client.describe_target_health(TargetGroupArn=arn)
+    targets = {
+        description['Target']['Id']: TargetState(
+            port=description['Target'].get('Port'),
+            state=description['TargetHealth']['State'],
+            reason=description['TargetHealth'].get('Reason', ''),
+        )
+        for description in response['TargetHealthDescriptions']
+    }
+    cache.set(key, targets, getattr(settings, 'ELB_TARGET_HEALTH_CACHE_SECONDS', 15))
+    return targets
+
+
+def register_targets(client, arn: str, instance_ids: list[str], port: int | None = None) -> int:
+    """Register instances in calls of up to ``TARGETS_PER_CALL``; return the number of calls."""
+    calls = 0
+    for start in range(0, len(instance_ids), TARGETS_PER_CALL):
+        chunk = instance_ids[start:start + TARGETS_PER_CALL]
+        client.register_targets(
+            TargetGroupArn=arn,
+            Targets=[{'Id': instance_id, **({'Port': port} if port else {})} for instance_id in chunk],
+        )
+        calls += 1
+    return calls
+
+
+def deregister_targets(client, arn: str, targets: list[tuple[str, int | None]]) -> int:
+    """Deregister ``(instance id, port)`` targets in calls of up to ``TARGETS_PER_CALL``; return the number of calls."""
+    calls = 0
+    for start in range(0, len(targets), TARGETS_PER_CALL):
+        chunk = targets[start:start + TARGETS_PER_CALL]
+        client.deregister_targets(
+            TargetGroupArn=arn,
+            Targets=[{'Id': instance_id, **({'Port': port} if port else {})} for instance_id, port in chunk],
+        )
+        calls += 1
+    return calls
+
+
+def desired_targets(groups: list[TargetGroup]) -> tuple[dict[int, set[str]], dict[int, set[str]]]:
+    """AWS ids of each group's members and of the members it should serve, by group pk, in two queries."""
+    from resources.api.cloudwatch import latest_metrics
+
+    rows = list(
+        TargetGroup.instances.through.objects
+        .filter(targetgroup_id__in=[group.pk for group in groups], ec2instance__aws_instance_id__isnull=False)
+        .values_list('targetgroup_id', 'ec2instance_id', 'ec2instance__aws_instance_id', 'ec2instance__status')
+    )
+    metrics = latest_metrics({instance_id for _, instance_id, _, status in rows if status == 'running'})
+    members: dict[int, set[str]] = {group.pk: set() for group in groups}
+    desired: dict[int, set[str]] = {group.pk: set() for group in groups}
+    for group_id, instance_id, aws_instance_id, status in rows:
+        members[group_id].add(aws_instance_id)
+        if status != 'running' or metrics.get(instance_id, {}).get('status_check_failed', 0) > 0:
+            continue
+        desired[group_id].add(aws_instance_id)
+    return members, desired
+
+
+def launched_by_app(aws_instance_ids: Iterable[str]) -> set[str]:
+    """Which of the instances carry the app's ``managed-by`` tag, through the tag index."""
+    from resources.tags import MANAGED_BY_TAG, MANAGED_BY_VALUE, tagged
+
+    aws_instance_ids = list(aws_instance_ids)
+    if not aws_instance_ids:
+        return set()
+    instances = EC2Instance.objects.filter(aws_instance_id__in=aws_instance_ids)
+    return set(tagged(instances, MANAGED_BY_TAG, MANAGED_BY_VALUE).values_list('aws_instance_id', flat=True))
+
+
+def sync_target_group(client, group: TargetGroup, desired: set[str], members: set[str]) -> TargetSyncResult:
+    """Register what is missing from ``group`` and deregister the app's instances that shouldn't be there."""
+    result = TargetSyncResult()
+    # A change made outside the app is picked up once the cached health expires
+    current = describe_target_health(client, group.arn)
+    serving = {instance_id for instance_id, target in current.items() if target.state not in LEAVING_STATES}
+    result.registered = sorted(desired - serving)
+    extra = {instance_id for instance_id in serving if instance_id not in desired}
+    # Only targets the app manages: members, or instances it launched that have left the group
+    managed = (extra & members) | launched_by_app(extra - members)
+    leaving = [
+        (instance_id, target.port)
+        for instance_id, target in sorted(current.items())
+        if instance_id in managed
+    ]
+    result.deregistered = [instance_id for instance_id, _ in leaving]
+    result.unchanged = len(desired & serving)
+    if result.registered:
+        register_targets(client, group.arn, result.registered, group.port)
+    if leaving:
+        deregister_targets(client, group.arn, leaving)
+    if result.registered or leaving:
+        cache.delete(health_cache_key(group.arn))
+    return result
+
+
+def sync_target_groups(groups: Iterable[TargetGroup] | None = None) -> dict[str, int]:
+    """Sync every target group (or ``groups``); return counts of registered, deregistered and failed."""
+    from resources.sync import group_accounts
+
+    groups = list(TargetGroup.objects.select_related('owner') if groups is None else groups)
+    counts = {'groups': len(groups), 'registered': 0, 'deregistered': 0, 'failed': 0}
+    if not groups:
+        return counts
+    members, desired = desired_targets(groups)
+    accounts = {}
+    for account in group_accounts({group.owner for group in groups}):
+        for user_id in account.user_ids:
+            accounts[user_id] = account
+
+    synced = []
+    for group in groups:
+        client = accounts[group.owner_id].client('elbv2', group.region)
+        try:
+            result = sync_target_group(client, group, desired[group.pk], members[group.pk])
+        except (BotoCoreError, ClientError) as e:
+            counts['failed'] += 1
+            logger.error("Error syncing target group", extra={'target_group': group.name, 'error': str(e)})
+            continue
+        counts['registered'] += len(result.registered)
+        counts['deregistered'] += len(result.deregistered)
+        synced.append(group.pk)
+        if result.registered or result.deregistered:
+            logger.info("Synced target group", extra={
+                'target_group': group.name,
+                'registered': len(result.registered),
+                'deregistered': len(result.deregistered),
+                'unchanged': result.unchanged,
+            })
+    TargetGroup.objects.filter(pk__in=synced).update(synced_at=timezone.now())
+    return counts
+
+
+def target_health(group: TargetGroup) -> dict[str, TargetState]:
+    """Cached health of a group's registered targets, for display."""
+    from resources.sync import group_accounts
+
+    account = group_accounts([group.owner])[0]
+    return describe_target_health(account.client('elbv2', group.region), group.arn)
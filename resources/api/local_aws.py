@@ -0,0 +1,518 @@
+"""
+In-memory stand-in for the AWS APIs this app calls.
+
+``LocalAWS`` answers API calls from botocore's ``before-call`` event, the same
+point ``botocore.stub.Stubber`` uses, so requests never leave the process but
+still go through the rate limiter, metrics and profiling hooks. Unlike the
+Stubber it keeps state (a fleet per region, hosted zones, ...) and answers in
+any order, which is what benchmarks and end-to-end checks need::
+
+    aws = LocalAWS()
+    aws.add_fleet(10_000)
+    with aws:
+        ...  # every client from resources.api.clients now talks to ``aws``
+"""
+import itertools
+import threading
+import uuid
+import json
+import zlib
+from collections import Counter, defaultdict, deque
+from collections.abc import Callable, Iterable
+from datetime import datetime, timedelta, timezone
+
+from botocore.awsrequest import AWSResponse
+
+from resources.api.clients import register_client_hook, unregister_client_hook
+
+STATE_CODES: dict[str, int] = {
+    'pending': 0,
+    'running': 16,
+    'shutting-down': 32,
+    'terminated': 48,
+    'stopping': 64,
+    'stopped': 80,
+}
+
+DEFAULT_REGIONS: tuple[str, ...] = (
+    'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1',
+    'eu-central-1', 'eu-west-1', 'eu-west-2', 'eu-west-3', 'eu-north-1',
+    'ap-northeast-1', 'ap-northeast-2', 'ap-southeast-1', 'ap-southeast-2',
+    'ap-south-1', 'sa-east-1',
+)
+
+
+class LocalAWSError(Exception):
+    def __init__(self, code: str, message: str = '', status: int = 400):
+        super().__init__(message or code)
+        self.code: str = code
+        self.message: str = message or code
+        self.status: int = status
+
+
+class LocalAWS:
+    """Stateful fake of the EC2, CloudWatch, SQS, Route53, ELBv2, SSM and STS calls the app makes."""
+
+    def __init__(self, regions: Iterable[str] = DEFAULT_REGIONS, page_size: int = 1000):
+        self.regions: tuple[str, ...] = tuple(regions)
+        self.page_size: int = page_size
+        # region -> instance id -> DescribeInstances-shaped instance dict
+        self.instances: dict[str, dict[str, dict]] = defaultdict(dict)
+        # hosted zone id -> {'Name': ..., 'records': {(name, type): record set}}
+        self.hosted_zones: dict[str, dict] = {}
+        self.calls: Counter[tuple[str, str]] = Counter()
+        # queue url -> messages waiting; receipt handle -> message received but not yet deleted
+        self.queues: dict[str, deque[dict]] = defaultdict(deque)
+        self.in_flight: dict[str, dict] = {}
+        # target group arn -> {'region': ..., 'port': ..., 'targets': {instance id: port}}
+        self.target_groups: dict[str, dict] = {}
+        # Where EC2 state-change events go (EventBridge rule -> SQS), if anywhere
+        self.state_change_queue: str | None = None
+        self._handlers: dict[tuple[str, str], Callable[[str, dict], dict]] = {
+            ('ec2', 'DescribeInstances'): self._describe_instances,
+            ('ec2', 'DescribeRegions'): self._describe_regions,
+            ('ec2', 'RunInstances'): self._run_instances,
+            ('ec2', 'StartInstances'): self._transition('running', 'pending'),
+            ('ec2', 'StopInstances'): self._transition('stopped', 'stopping'),
+            ('ec2', 'TerminateInstances'): self._transition('terminated', 'shutting-down'),
+            ('ec2', 'CreateTags'): self._create_tags,
+            ('ec2', 'DeleteTags'): self._delete_tags,
+            ('sts', 'AssumeRole'): self._assume_role,
+            ('ssm', 'GetParameter'): self._get_parameter,
+            ('cloudwatch', 'GetMetricData'): self._get_metric_data,
+            ('sqs', 'SendMessage'): self._send_message,
+            ('sqs', 'ReceiveMessage'): self._receive_message,
+            ('sqs', 'DeleteMessageBatch'): self._delete_message_batch,
+            ('route53', 'CreateHostedZone'): self._create_hosted_zone,
+            ('route53', 'ListHostedZones'): self._list_hosted_zones,
+            ('route53', 'ChangeResourceRecordSets'): self._change_resource_record_sets,
+            ('route53', 'ListResourceRecordSets'): self._list_resource_record_sets,
+            ('elbv2', 'RegisterTargets'): self._register_targets,
+            ('elbv2', 'DeregisterTargets'): self._deregister_targets,
+            ('elbv2', 'DescribeTargetHealth'): self._describe_target_health,
+        }
+        self._ids = itertools.count(1)
+        self._lock = threading.RLock()
+
+    # -- wiring ---------------------------------------------------------------
+
+    def register_handler(self, service_name: str, operation_name: str, handler: Callable[[str, dict], dict]) -> None:
+        """Answer ``service_name.operation_name`` with ``handler(region, params)``."""
+        self._handlers[(service_name, operation_name)] = handler
+
+    def attach(self, client) -> None:
+        service_name = client.meta.service_model.service_name
+        region = client.meta.region_name
+
+        def capture_params(params, context, **kwargs):
+            context['local_aws_params'] = dict(params)
+
+        def respond(model, context, **kwargs):
+            return self.handle(service_name, model.name, region, context.get('local_aws_params', {}))
+
+        client.meta.events.register('before-parameter-build.*.*', capture_params)
+        client.meta.events.register('before-call.*.*', respond)
+
+    def install(self) -> None:
+        """Attach to every client built by ``resources.api.clients`` from now on."""
+        register_client_hook(self.attach)
+
+    def uninstall(self) -> None:
+        unregister_client_hook(self.attach)
+
+    def __enter__(self) -> 'LocalAWS':
+        self.install()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.uninstall()
+
+    def handle(self, service_name: str, operation_name: str, region: str, params: dict):
+        self.calls[(service_name, operation_name)] += 1
+        handler = self._handlers.get((service_name, operation_name))
+        try:
+            if handler is None:
+                raise LocalAWSError('NotImplemented', f'LocalAWS does not implement {service_name}.{operation_name}')
+            with self._lock:
+                parsed = handler(region, params)
+            status = 200
+        except LocalAWSError as e:
+            parsed = {'Error': {'Code': e.code, 'Message': e.message}}
+            status = e.status
+        parsed.setdefault('ResponseMetadata', {'HTTPStatusCode': status, 'RetryAttempts': 0})
+        return AWSResponse(None, status, {}, None), parsed
+
+    # -- fleet helpers --------------------------------------------------------
+
+    def new_instance_id(self) -> str:
+        return f'i-{next(self._ids):017x}'
+
+    def add_instance(
+        self,
+        region: str,
+        name: str | None = None,
+        instance_type: str = 't2.micro',
+        state: str = 'running',
+        tags: dict[str, str] | None = None,
+    ) -> str:
+        instance_id = self.new_instance_id()
+        serial = int(instance_id[2:], 16)
+        tag_list = [{'Key': key, 'Value': value} for key, value in (tags or {}).items()]
+        if name:
+            tag_list.append({'Key': 'Name', 'Value': name})
+        with self._lock:
+            self.instances[region][instance_id] = {
+                'InstanceId': instance_id,
+                'ImageId': 'ami-08a6efd148b1f7504',
+                'InstanceType': instance_type,
+                'State': {'Code': STATE_CODES[state], 'Name': state},
+                'Placement': {'AvailabilityZone': f'{region}a'},
+                'PublicIpAddress': f'10.{(serial >> 16) & 255}.{(serial >> 8) & 255}.{serial & 255}',
+                'LaunchTime': datetime.now(timezone.utc),
+                'Tags': tag_list,
+            }
+        return instance_id
+
+    def add_fleet(
+        self,
+        count: int,
+        regions: Iterable[str] | None = None,
+        instance_types: Iterable[str] = ('t2.micro', 't2.small', 't3.micro', 't3.medium'),
+        states: Iterable[str] = ('running', 'running', 'running', 'stopped'),
+    ) -> list[str]:
+        """Spread ``count`` named instances round-robin over ``regions``."""
+        regions = itertools.cycle(tuple(regions or self.regions))
+        instance_types = itertools.cycle(tuple(instance_types))
+        states = itertools.cycle(tuple(states))
+        return [
+            self.add_instance(region, name=f'fleet-{region}-{index}', instance_type=next(instance_types), state=next(states))
+            for index, region in zip(range(count), regions)
+        ]
+
+    def find_instance(self, instance_id: str) -> dict | None:
+        for fleet in self.instances.values():
+            if instance_id in fleet:
+                return fleet[instance_id]
+        return None
+
+    # -- EC2 ------------------------------------------------------------------
+
+    def _describe_instances(self, region: str, params: dict) -> dict:
+        fleet = self.instances[region]
+        if params.get('InstanceIds'):
+            missing = [i for i in params['InstanceIds'] if i not in fleet]
+            if missing:
+                raise LocalAWSError('InvalidInstanceID.NotFound', f'The instance IDs {missing} do not exist')
+            matches = [fleet[i] for i in params['InstanceIds']]
+        else:
+            matches = list(fleet.values())
+        for filter_ in params.get('Filters', []):
+            name, values = filter_['Name'], set(filter_['Values'])
+            if name == 'instance-state-name':
+                matches = [i for i in matches if i['State']['Name'] in values]
+            elif name.startswith('tag:'):
+                key = name[4:]
+                matches = [i for i in matches if any(t['Key'] == key and t['Value'] in values for t in i['Tags'])]
+            elif name == 'tag-key':
+                matches = [i for i in matches if any(t['Key'] in values for t in i['Tags'])]
+        page_size = min(params.get('MaxResults') or self.page_size, self.page_size)
+        start = int(params.get('NextToken') or 0)
+        page = matches[start:start + page_size]
+        response: dict = {
+            'Reservations': [
+                {'ReservationId': f'r-{i["InstanceId"][2:]}', 'OwnerId': '000000000000', 'Instances': [dict(i)]}
+                for i in page
+            ],
+        }
+        if start + page_size < len(matches):
+            response['NextToken'] = str(start + page_size)
+        return response
+
+    def _describe_regions(self, region: str, params: dict) -> dict:
+        return {'Regions': [
+            {'RegionName': name, 'Endpoint': f'ec2.{name}.amazonaws.com', 'OptInStatus': 'opt-in-not-required'}
+            for name in self.regions
+        ]}
+
+    def _run_instances(self, region: str, params: dict) -> dict:
+        tags: dict[str, str] = {}
+        for spec in params.get('TagSpecifications', []):
+            if spec.get('ResourceType') == 'instance':
+                tags.update({t['Key']: t['Value'] for t in spec.get('Tags', [])})
+        name = tags.pop('Name', None)
+        ids = [
+            self.add_instance(region, name=name, instance_type=params.get('InstanceType', 't2.micro'), state='pending', tags=tags)
+            for _ in range(params.get('MaxCount', 1))
+        ]
+        for instance_id in ids:
+            self.instances[region][instance_id]['ImageId'] = params['ImageId']
+            self.publish_state_change(region, instance_id, 'pending')
+        return {'Instances': [dict(self.instances[region][i]) for i in ids], 'ReservationId': f'r-{uuid.uuid4().hex[:17]}'}
+
+    def _transition(self, target: str, reported: str) -> Callable[[str, dict], dict]:
+        def handler(region: str, params: dict) -> dict:
+            fleet = self.instances[region]
+            changes = []
+            for instance_id in params.get('InstanceIds', []):
+                if instance_id not in fleet:
+                    raise LocalAWSError('InvalidInstanceID.NotFound', f'The instance ID {instance_id} does not exist')
+                instance = fleet[instance_id]
+                previous = instance['State']
+                instance['State'] = {'Code': STATE_CODES[target], 'Name': target}
+                self.publish_state_change(region, instance_id, target)
+                changes.append({
+                    'InstanceId': instance_id,
+                    'PreviousState': previous,
+                    'CurrentState': {'Code': STATE_CODES[reported], 'Name': reported},
+                })
+            key = {'running': 'StartingInstances', 'stopped': 'StoppingInstances'}.get(target, 'TerminatingInstances')
+            return {key: changes}
+        return handler
+
+    def _tagged_instances(self, region: str, params: dict) -> list[dict]:
+        if len(params['Resources']) > 1000:
+            raise LocalAWSError('InvalidParameterValue', 'Tagging is limited to 1000 resources per request.')
+        fleet = self.instances[region]
+        missing = [i for i in params['Resources'] if i not in fleet]
+        if missing:
+            raise LocalAWSError('InvalidInstanceID.NotFound', f'The instance IDs {missing} do not exist')
+        return [fleet[i] for i in params['Resources']]
+
+    def _create_tags(self, region: str, params: dict) -> dict:
+        new = {tag['Key']: tag['Value'] for tag in params['Tags']}
+        for instance in self._tagged_instances(region, params):
+            instance['Tags'] = [t for t in instance['Tags'] if t['Key'] not in new] + [{'Key': k, 'Value': v} for k, v in new.items()]
+        return {}
+
+    def _delete_tags(self, region: str, params: dict) -> dict:
+        # A tag given with a value is only deleted if the value matches
+        for instance in self._tagged_instances(region, params):
+            instance['Tags'] = [
+                t for t in instance['Tags']
+                if not any(t['Key'] == d['Key'] and d.get('Value', t['Value']) == t['Value'] for d in params['Tags'])
+            ]
+        return {}
+
+    # -- STS ------------------------------------------------------------------
+
+    def _assume_role(self, region: str, params: dict) -> dict:
+        serial = next(self._ids)
+        return {
+            'Credentials': {
+                'AccessKeyId': f'ASIALOCAL{serial:011d}',
+                'SecretAccessKey': uuid.uuid4().hex,
+                'SessionToken': uuid.uuid4().hex,
+                'Expiration': datetime.now(timezone.utc) + timedelta(seconds=params.get('DurationSeconds', 3600)),
+            },
+            'AssumedRoleUser': {
+                'AssumedRoleId': f'AROALOCAL:{params["RoleSessionName"]}',
+                'Arn': f'{params["RoleArn"]}/{params["RoleSessionName"]}',
+            },
+        }
+
+    # -- SSM ------------------------------------------------------------------
+
+    def _get_parameter(self, region: str, params: dict) -> dict:
+        # Only Canonical's public AMI parameters; each region gets its own image id
+        name = params['Name']
+        if not name.startswith('/aws/service/canonical/'):
+            raise LocalAWSError('ParameterNotFound', f'Parameter {name} not found', 400)
+        return {'Parameter': {'Name': name, 'Type': 'String', 'Value': f'ami-{zlib.crc32(f"{region}{name}".encode()):017x}', 'Version': 1}}
+
+    # -- CloudWatch -----------------------------------------------------------
+
+    def _get_metric_data(self, region: str, params: dict) -> dict:
+        queries = params['MetricDataQueries']
+        if len(queries) > 500:
+            raise LocalAWSError('ValidationError', 'The collection MetricDataQueries must not have a size greater than 500.')
+        start, end = params['StartTime'], params['EndTime']
+        fleet = self.instances[region]
+        results = []
+        for query in queries:
+            stat = query['MetricStat']
+            period = stat['Period']
+            instance_id = stat['Metric']['Dimensions'][0]['Value']
+            instance = fleet.get(instance_id)
+            timestamps, values = [], []
+            if instance is not None and instance['State']['Name'] == 'running':
+                serial = int(instance_id[2:], 16)
+                # Newest first, like CloudWatch's default TimestampDescending
+                at = datetime.fromtimestamp((end.timestamp() - 1) // period * period, tz=timezone.utc)
+                while at >= start:
+                    timestamps.append(at)
+                    values.append(float((serial * 7 + int(at.timestamp()) // period) % 100))
+                    at -= timedelta(seconds=period)
+            results.append({
+                'Id': query['Id'],
+                'Label': stat['Metric']['MetricName'],
+                'Timestamps': timestamps,
+                'Values': values,
+                'StatusCode': 'Complete',
+            })
+        return {'MetricDataResults': results, 'Messages': []}
+
+    # -- SQS / EventBridge ----------------------------------------------------
+
+    def create_queue(self, name: str, region: str = 'us-east-1') -> str:
+        url = f'https://sqs.{region}.amazonaws.com/000000000000/{name}'
+        with self._lock:
+            self.queues.setdefault(url, deque())
+        return url
+
+    def route_state_changes(self, queue_url: str) -> None:
+        """Deliver an EventBridge state-change notification to ``queue_url`` whenever an instance changes state."""
+        self.state_change_queue = queue_url
+
+    def publish_state_change(self, region: str, instance_id: str, state: str, at: datetime | None = None) -> None:
+        if self.state_change_queue is None:
+            return
+        event = {
+            'version': '0',
+            'id': str(uuid.uuid4()),
+            'detail-type': 'EC2 Instance State-change Notification',
+            'source': 'aws.ec2',
+            'account': '000000000000',
+            'time': (at or datetime.now(timezone.utc)).strftime('%Y-%m-%dT%H:%M:%SZ'),
+            'region': region,
+            'resources': [f'arn:aws:ec2:{region}:000000000000:instance/{instance_id}'],
+            'detail': {'instance-id': instance_id, 'state': state},
+        }
+        self._enqueue(self.state_change_queue, json.dumps(event))
+
+    def _enqueue(self, queue_url: str, body: str) -> str:
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self.queues[queue_url].append({'MessageId': message_id, 'Body': body})
+        return message_id
+
+    def _send_message(self, region: str, params: dict) -> dict:
+        return {'MessageId': self._enqueue(params['QueueUrl'], params['MessageBody'])}
+
+    def _receive_message(self, region: str, params: dict) -> dict:
+        # No long polling or visibility timeout: an empty queue answers at once, received messages stay in flight
+        queue = self.queues[params['QueueUrl']]
+        messages = []
+        while queue and len(messages) < params.get('MaxNumberOfMessages', 1):
+            message = dict(queue.popleft(), ReceiptHandle=uuid.uuid4().hex)
+            self.in_flight[message['ReceiptHandle']] = message
+            messages.append(message)
+        return {'Messages': messages} if messages else {}
+
+    def _delete_message_batch(self, region: str, params: dict) -> dict:
+        if len(params['Entries']) > 10:
+            raise LocalAWSError('AWS.SimpleQueueService.TooManyEntriesInBatchRequest', 'Maximum number of entries per request are 10.')
+        successful = []
+        for entry in params['Entries']:
+            self.in_flight.pop(entry['ReceiptHandle'], None)
+            successful.append({'Id': entry['Id']})
+        return {'Successful': successful, 'Failed': []}
+
+    # -- Route53 --------------------------------------------------------------
+
+    def _create_hosted_zone(self, region: str, params: dict) -> dict:
+        zone_id = f'Z{uuid.uuid4().hex[:12].upper()}'
+        name = params['Name'].rstrip('.') + '.'
+        self.hosted_zones[zone_id] = {'Name': name, 'records': {}}
+        return {
+            'HostedZone': {'Id': f'/hostedzone/{zone_id}', 'Name': name, 'CallerReference': params['CallerReference']},
+            'ChangeInfo': self._change_info(),
+            'DelegationSet': {'NameServers': ['ns-1.local-aws.invalid']},
+            'Location': f'https://route53.amazonaws.com/2013-04-01/hostedzone/{zone_id}',
+        }
+
+    def _list_hosted_zones(self, region: str, params: dict) -> dict:
+        return {
+            'HostedZones': [
+                {'Id': f'/hostedzone/{zone_id}', 'Name': zone['Name'], 'CallerReference': zone_id}
+                for zone_id, zone in self.hosted_zones.items()
+            ],
+            'IsTruncated': False,
+            'MaxItems': '100',
+        }
+
+    def _zone(self, params: dict) -> dict:
+        zone = self.hosted_zones.get(params['HostedZoneId'].split('/')[-1])
+        if zone is None:
+            raise LocalAWSError('NoSuchHostedZone', f'No hosted zone found with ID: {params["HostedZoneId"]}', 404)
+        return zone
+
+    def _change_resource_record_sets(self, region: str, params: dict) -> dict:
+        zone = self._zone(params)
+        changes = params['ChangeBatch']['Changes']
+        if len(changes) > 1000:
+            raise LocalAWSError('InvalidChangeBatch', 'Number of records limit of 1000 exceeded.')
+        for change in changes:
+            record = change['ResourceRecordSet']
+            key = (record['Name'].rstrip('.') + '.', record['Type'])
+            if change['Action'] == 'DELETE':
+                if key not in zone['records']:
+                    raise LocalAWSError('InvalidChangeBatch', f'Tried to delete resource record set {key} but it was not found')
+                del zone['records'][key]
+            elif change['Action'] == 'CREATE' and key in zone['records']:
+                raise LocalAWSError('InvalidChangeBatch', f'Tried to create resource record set {key} but it already exists')
+            else:
+                zone['records'][key] = {**record, 'Name': key[0]}
+        return {'ChangeInfo': self._change_info()}
+
+    def _list_resource_record_sets(self, region: str, params: dict) -> dict:
+        zone = self._zone(params)
+        records = sorted(zone['records'].items())
+        if params.get('StartRecordName'):
+            start = (params['StartRecordName'].rstrip('.') + '.', params.get('StartRecordType', ''))
+            records = [item for item in records if item[0] >= start]
+        max_items = int(params.get('MaxItems') or 300)
+        response = {
+            'ResourceRecordSets': [record for _, record in records[:max_items]],
+            'IsTruncated': len(records) > max_items,
+            'MaxItems': str(max_items),
+        }
+        if response['IsTruncated']:
+            response['NextRecordName'], response['NextRecordType'] = records[max_items][0]
+        return response
+
+    # -- ELBv2 ----------------------------------------------------------------
+
+    def create_target_group(self, name: str, region: str = 'us-east-1', port: int = 80) -> str:
+        arn = f'arn:aws:elasticloadbalancing:{region}:000000000000:targetgroup/{name}/{uuid.uuid4().hex[:16]}'
+        with self._lock:
+            self.target_groups[arn] = {'region': region, 'port': port, 'targets': {}}
+        return arn
+
+    def _target_group(self, region: str, params: dict) -> dict:
+        group = self.target_groups.get(params['TargetGroupArn'])
+        if group is None or group['region'] != region:
+            raise LocalAWSError('TargetGroupNotFound', f'Target groups \'{params["TargetGroupArn"]}\' not found')
+        return group
+
+    def _register_targets(self, region: str, params: dict) -> dict:
+        group = self._target_group(region, params)
+        for target in params['Targets']:
+            instance = self.instances[region].get(target['Id'])
+            # Like ELB, only running instances can be registered
+            if instance is None or instance['State']['Name'] != 'running':
+                raise LocalAWSError('InvalidTarget', f'The following targets are not in a running state and cannot be registered: \'{target["Id"]}\'')
+        for target in params['Targets']:
+            group['targets'][target['Id']] = target.get('Port', group['port'])
+        return {}
+
+    def _deregister_targets(self, region: str, params: dict) -> dict:
+        group = self._target_group(region, params)
+        for target in params['Targets']:
+            group['targets'].pop(target['Id'], None)
+        return {}
+
+    def _describe_target_health(self, region: str, params: dict) -> dict:
+        group = self._target_group(region, params)
+        descriptions = []
+        for instance_id, port in group['targets'].items():
+            instance = self.instances[region].get(instance_id)
+            if instance is not None and instance['State']['Name'] == 'running':
+                health = {'State': 'healthy'}
+            else:
+                health = {'State': 'unused', 'Reason': 'Target.InvalidState', 'Description': 'Target is in the stopped state'}
+            descriptions.append({'Target': {'Id': instance_id, 'Port': port}, 'HealthCheckPort': str(port), 'TargetHealth': health})
+        return {'TargetHealthDescriptions': descriptions}
+
+    @staticmethod
+    def _change_info() -> dict:
+        return {'Id': f'/change/C{uuid.uuid4().hex[:12].upper()}', 'Status': 'PENDING', 'SubmittedAt': datetime.now(timezone.utc)}
@@ -0,0 +1,222 @@
+"""
+Client-side rate limiting for AWS API calls.
+
+AWS throttles per account, per region and per API family (EC2 for instance
+has separate buckets for Describe* and mutating calls), so we keep one token
+bucket for every (account, region, family) triple and make every client built
+by ``resources.api.clients`` draw from it before each call.
+
+The buckets hook into botocore's event system rather than wrapping the client,
+so paginators and waiters are limited too. botocore's own ``adaptive`` retry
+mode still handles backoff for individual requests; these buckets are shared
+between clients and threads so a parallel sync can't throttle itself.
+"""
+import logging
+import threading
+import time
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_ERROR_CODES: frozenset[str] = frozenset({
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'PriorRequestNotComplete',
+    'SlowDown',
+})
+
+# Services whose endpoints (and throttling buckets) are global.
+GLOBAL_SERVICES: frozenset[str] = frozenset({'route53', 'route53domains', 'iam'})
+
+# (refill rate per second, burst capacity) per API family. These follow the
+# documented AWS defaults; accounts with raised limits can override them
+# through settings.AWS_RATE_LIMITS.
+DEFAULT_RATE_LIMITS: dict[str, tuple[float, int]] = {
+    'ec2:describe': (20.0, 100),
+    'ec2:mutate': (5.0, 50),
+    'route53': (5.0, 5),
+    'route53domains': (1.0, 5),
+    'sts': (10.0, 20),
+    'default': (10.0, 20),
+}
+
+READ_PREFIXES: tuple[str, ...] = ('Describe', 'List', 'Get')
+
+
+def api_family(service_name: str, operation_name: str) -> str:
+    """Return the throttling family an operation is billed against."""
+    if service_name == 'ec2':
+        return 'ec2:describe' if operation_name.startswith(READ_PREFIXES) else 'ec2:mutate'
+    return service_name
+
+
+@dataclass
+class BucketStats:
+    calls: int = 0
+    throttles: int = 0
+    retries: int = 0
+    errors: int = 0
+    wait_seconds: float = 0.0
+    max_wait_seconds: float = 0.0
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket with additive-increase/multiplicative-decrease.
+
+    A throttling response halves the refill rate (down to ``min_rate``) and
+    every successful call nudges it back towards the configured rate, so the
+    bucket converges on whatever the account actually allows.
+    """
+
+    def __init__(self, rate: float, capacity: int, max_in_flight: int = 0, min_rate: float = 0.5):
+        self.max_rate: float = rate
+        self.rate: float = rate
+        self.min_rate: float = min(min_rate, rate)
+        self.capacity: int = capacity
+        self.tokens: float = float(capacity)
+        self.stats: BucketStats = BucketStats()
+        self._updated_at: float = time.monotonic()
+        self._lock: threading.Lock = threading.Lock()
+        self._in_flight: threading.BoundedSemaphore | None = (
+            threading.BoundedSemaphore(max_in_flight) if max_in_flight > 0 else None
+        )
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self) -> float:
+        """Block until a token (and an in-flight slot) is available; return seconds waited."""
+        started = time.monotonic()
+        if self._in_flight is not None:
+            self._in_flight.acquire()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    waited = now - started
+                    self.stats.calls += 1
+                    self.stats.wait_seconds += waited
+                    self.stats.max_wait_seconds = max(self.stats.max_wait_seconds, waited)
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def release(self) -> None:
+        if self._in_flight is not None:
+            self._in_flight.release()
+
+    def record_throttle(self) -> None:
+        with self._lock:
+            self.stats.throttles += 1
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def record_result(self, retries: int = 0, failed: bool = False) -> None:
+        with self._lock:
+            self.stats.retries += retries
+            if failed:
+                self.stats.errors += 1
+            else:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+
+class AWSRateLimiter:
+    """Registry of token buckets keyed by (account, region, API family)."""
+
+    def __init__(self, limits: dict[str, tuple[float, int]] | None = None, max_in_flight: int = 0):
+        self.limits: dict[str, tuple[float, int]] = {**DEFAULT_RATE_LIMITS, **(limits or {})}
+        self.max_in_flight: int = max_in_flight
+        self._buckets: dict[tuple[str, str, str], TokenBucket] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    def bucket(self, account: str, region: str, family: str) -> TokenBucket:
+        key = (account, region, family)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(key)
+                if bucket is None:
+                    rate, capacity = self.limits.get(family, self.limits['default'])
+                    bucket = TokenBucket(rate, capacity, max_in_flight=self.max_in_flight)
+                    self._buckets[key] = bucket
+        return bucket
+
+    def attach(self, client, account: str, region: str) -> None:
+        """Route every API call made through ``client`` via this limiter."""
+        service_name = client.meta.service_model.service_name
+        if service_name in GLOBAL_SERVICES:
+            region = 'global'
+
+        def before_call(model, context, **kwargs):
+            bucket = self.bucket(account, region, api_family(service_name, model.name))
+            waited = bucket.acquire()
+            context['rate_limit_bucket'] = bucket
+            if waited > 1:
+                logger.info("Waited %.2fs for %s %s token (%s)", waited, service_name, model.name, region)
+
+        def needs_retry(response, request_dict, **kwargs):
+            # Fires once per attempt, so throttles that botocore retried
+            # successfully still slow the shared bucket down.
+            context = request_dict.get('context', {})
+            bucket = context.get('rate_limit_bucket')
+            if bucket is None or response is None:
+                return
+            context['rate_limit_attempt_seen'] = True
+            error_code = response[1].get('Error', {}).get('Code')
+            if error_code in THROTTLE_ERROR_CODES:
+                logger.warning("AWS throttled %s in %s for account %s", service_name, region, account)
+                bucket.record_throttle()
+
+        def after_call(parsed, context, **kwargs):
+            bucket = context.pop('rate_limit_bucket', None)
+            if bucket is None:
+                return
+            bucket.release()
+            error_code = parsed.get('Error', {}).get('Code')
+            if error_code in THROTTLE_ERROR_CODES and not context.pop('rate_limit_attempt_seen', False):
+                # Stubbed responses never reach needs-retry.
+                bucket.record_throttle()
+            bucket.record_result(
+                retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+                failed=error_code is not None,
+            )
+
+        def after_call_error(context, **kwargs):
+            bucket = context.pop('rate_limit_bucket', None)
+            if bucket is not None:
+                bucket.release()
+                bucket.record_result(failed=True)
+
+        events = client.meta.events
+        events.register_first('before-call.*.*', before_call)
+        events.register('needs-retry.*.*', needs_retry)
+        events.register('after-call.*.*', after_call)
+        events.register('after-call-error.*.*', after_call_error)
+
+    def snapshot(self) -> list[dict[str, object]]:
+        """Return per-bucket counters for monitoring."""
+        with self._lock:
+            buckets = list(self._buckets.items())
+        return [
+            {
+                'account': account,
+                'region': region,
+                'family': family,
+                'rate': round(bucket.rate, 3),
+                'calls': bucket.stats.calls,
+                'throttles': bucket.stats.throttles,
+                'retries': bucket.stats.retries,
+                'errors': bucket.stats.errors,
+                'wait_seconds': round(bucket.stats.wait_seconds, 6),
+                'max_wait_seconds': round(bucket.stats.max_wait_seconds, 6),
+            }
+            for (account, region, family), bucket in buckets
+        ]
@@ -0,0 +1,187 @@
+"""
+Which regions of an AWS account sync should scan.
+
+``describe_regions`` is called once per account and the enabled set is
+cached for ``AWS_REGION_CACHE_SECONDS``, so opt-in regions the account never
+enabled are not scanned at all. ``RegionActivity`` remembers what each scan
+found: regions that have instances are scanned on every sync, regions that
+have never had any only every ``SYNC_IDLE_REGION_INTERVAL`` seconds. While
+state-change events are being consumed (``resources.events``), regions with
+instances are only reconciled every ``SYNC_RECONCILE_INTERVAL`` seconds or
+when an event reports an instance the app doesn't know.
+
+The same rows are the sync's shards. Before reading a region, a sync
+claims it with a conditional UPDATE (``claim_region``) that only succeeds
+if no other worker holds an unexpired lease and nobody scanned it since
+this sync started. Processes and nodes syncing at the same time therefore
+split the regions between them instead of each scanning all of them, and
+a worker that dies holding a region loses it after
+``SYNC_SHARD_LEASE_SECONDS``.
+"""
+import logging
+import os
+import socket
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from resources.api.coalesce import get_flight
+from resources.events import events_active, region_dirty_since
+from resources.models import EC2Instance, RegionActivity
+
+logger = logging.getLogger(__name__)
+
+SUPPORTED_REGIONS: tuple[str, ...] = tuple(code for code, _ in EC2Instance.REGION_CHOICES)
+ENABLED_OPT_IN_STATUSES: tuple[str, ...] = ('opt-in-not-required', 'opted-in')
+
+
+def enabled_regions_cache_key(account) -> str:
+    return f'aws-enabled-regions:{account.cache_key}'
+
+
+def enabled_regions(account) -> tuple[str, ...]:
+    """Supported regions the account has enabled, from cache or one ``describe_regions`` call."""
+    key = enabled_regions_cache_key(account)
+    regions = cache.get(key)
+    if regions is not None:
+        return regions
+
+    def describe() -> dict:
+        return account.client('ec2', getattr(settings, 'AWS_DISCOVERY_REGION', 'us-east-1')).describe_regions()
+
+    try:
+        response, _ = get_flight('describe_regions').do(account.key, describe)
+    except Exception as e:
+        # Not cached, so the next sync tries again.
+        logger.warning("Error discovering enabled regions", extra={'account': account.label, 'error': str(e)})
+        return SUPPORTED_REGIONS
+    enabled = {
+        region['RegionName'] for region in response['Regions']
+        if region.get('OptInStatus', 'opt-in-not-required') in ENABLED_OPT_IN_STATUSES
+    }
+    regions = tuple(code for code in SUPPORTED_REGIONS if code in enabled)
+    cache.set(key, regions, getattr(settings, 'AWS_REGION_CACHE_SECONDS', 86400))
+    logger.info("Discovered enabled regions", extra={'account': account.label, 'regions': len(regions)})
+    return regions
+
+
+def forget_enabled_regions(account) -> None:
+    """Drop the cached region list, e.g. after enabling an opt-in region."""
+    cache.delete(enabled_regions_cache_key(account))
+
+
+@dataclass
+class RegionPlan:
+    scan: list[str] = field(default_factory=list)
+    skipped: list[str] = field(default_factory=list)
+    activity: dict[str, RegionActivity] = field(default_factory=dict)
+
+
+def plan_regions(account, full: bool = False, now: datetime | None = None) -> RegionPlan:
+    """Split the account's enabled regions into the ones to scan now and the idle ones to skip."""
+    now = now or timezone.now()
+    plan = RegionPlan(activity={a.region: a for a in RegionActivity.objects.filter(account=account.cache_key)})
+    idle_before = now - timedelta(seconds=getattr(settings, 'SYNC_IDLE_REGION_INTERVAL', 21600))
+    reconcile_before = now - timedelta(seconds=getattr(settings, 'SYNC_RECONCILE_INTERVAL', 3600))
+    candidates = []
+    for region in enabled_regions(account):
+        activity = plan.activity.get(region)
+        # Events keep known instances current; scans only have to catch what they can't see
+        event_driven = events_active(region)
+        if full or activity is None or activity.last_scanned_at is None:
+            plan.scan.append(region)
+        elif event_driven and region_dirty_since(region, activity.last_scanned_at):
+            plan.scan.append(region)
+        elif activity.instance_count:
+            if not event_driven or activity.last_scanned_at <= reconcile_before:
+                plan.scan.append(region)
+            else:
+                plan.skipped.append(region)
+        elif activity.last_scanned_at <= idle_before:
+            plan.scan.append(region)
+        else:
+            candidates.append(region)
+    if candidates:
+        # Instances launched through the app since the last scan make a region active again.
+        since = min(plan.activity[region].last_scanned_at for region in candidates)
+        launched = set(
+            EC2Instance.objects
+            .filter(creating_user_id__in=account.user_ids, region__in=candidates, created_at__gte=since)
+            .order_by()
+            .values_list('region', flat=True)
+            .distinct()
+        )
+        for region in candidates:
+            (plan.scan if region in launched else plan.skipped).append(region)
+    return plan
+
+
+def record_scans(account, plan: RegionPlan, counts: dict[str, int], now: datetime | None = None) -> None:
+    """Store what this sync found per region, in one upsert."""
+    if not counts:
+        return
+    now = now or timezone.now()
+    rows = []
+    for region, count in counts.items():
+        previous = plan.activity.get(region)
+        rows.append(RegionActivity(
+            account=account.cache_key,
+            region=region,
+            instance_count=count,
+            last_scanned_at=now,
+            last_seen_instances_at=now if count else (previous.last_seen_instances_at if previous else None),
+        ))
+    RegionActivity.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=['account', 'region'],
+        update_fields=['instance_count', 'last_scanned_at', 'last_seen_instances_at'],
+    )
+
+
+def worker_id() -> str:
+    """This process as a lease owner; computed per call so forked workers don't share it."""
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def ensure_shards(account, regions: list[str]) -> None:
+    """Create missing shard rows for the regions, in one insert."""
+    RegionActivity.objects.bulk_create(
+        [RegionActivity(account=account.cache_key, region=region) for region in regions],
+        ignore_conflicts=True,
+    )
+
+
+def claim_region(account, region: str, started: datetime, now: datetime | None = None) -> bool:
+    """
+    Lease one region for this worker; False if another worker holds it or
+    scanned it after ``started``, so it doesn't have to be read again.
+
+    A single conditional UPDATE: on Postgres a concurrent claim waits for
+    the row and re-checks the conditions, so exactly one worker wins.
+    """
+    now = now or timezone.now()
+    lease = timedelta(seconds=getattr(settings, 'SYNC_SHARD_LEASE_SECONDS', 300))
+    claimed = (
+        RegionActivity.objects
+        .filter(account=account.cache_key, region=region)
+        .filter(Q(lease_expires_at__isnull=True) | Q(lease_expires_at__lte=now))
+        .filter(Q(last_scanned_at__isnull=True) | Q(last_scanned_at__lt=started))
+        .update(lease_owner=worker_id(), lease_expires_at=now + lease)
+    )
+    return claimed == 1
+
+
+def release_region(account, region: str, count: int | None = None) -> None:
+    """Give up this worker's lease; with ``count`` the scan is recorded in the same UPDATE."""
+    now = timezone.now()
+    fields = {'lease_owner': '', 'lease_expires_at': None}
+    if count is not None:
+        fields.update(instance_count=count, last_scanned_at=now)
+        if count:
+            fields['last_seen_instances_at'] = now
+    RegionActivity.objects.filter(account=account.cache_key, region=region, lease_owner=worker_id()).update(**fields)
@@ -0,0 +1,129 @@
+"""
+Move long-terminated instances out of the live ``EC2Instance`` table.
+
+Rows terminated more than ``INSTANCE_ARCHIVE_AFTER_DAYS`` ago are copied to
+``ArchivedEC2Instance`` and deleted from the live table in batches of
+``ARCHIVE_BATCH_SIZE``, one transaction per batch, so the dashboard, the
+admin and every sync diff only scan instances that can still change.
+Archived rows keep their id, so anything that stored an instance id still
+finds it through ``find_instance`` or ``all_instances``.
+
+Run ``python manage.py archive_instances`` periodically (e.g. from cron).
+"""
+import logging
+from collections.abc import Iterator
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import BooleanField, QuerySet, Value
+from django.utils import timezone
+
+from resources.models import ArchivedEC2Instance, EC2Instance
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_BATCH_SIZE: int = 1000
+# Columns both tables share, in the order ``all_instances`` returns them.
+SHARED_FIELDS: tuple[str, ...] = (
+    'id', 'name', 'aws_instance_id', 'status', 'instance_type', 'region', 'ip_address',
+    'creating_user_id', 'created_at', 'updated_at', 'terminated_at',
+)
+
+
+def archive_cutoff(now: datetime | None = None) -> datetime:
+    """Instances terminated before this are archived."""
+    days = getattr(settings, 'INSTANCE_ARCHIVE_AFTER_DAYS', 7)
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def archivable(cutoff: datetime) -> QuerySet:
+    return EC2Instance.objects.filter(status='terminated', terminated_at__lt=cutoff)
+
+
+def archive_batch(cutoff: datetime, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move up to ``batch_size`` archivable rows in one transaction; return how many moved."""
+    with transaction.atomic():
+        batch = archivable(cutoff).order_by('terminated_at')
+        if connection.features.has_select_for_update_skip_locked:
+            # Concurrent archivers take different batches instead of waiting on each other
+            batch = batch.select_for_update(skip_locked=True)
+        instances = list(batch[:batch_size])
+        if not instances:
+            return 0
+        now = timezone.now()
+        # No ignore_conflicts: an id already in the archive fails the batch instead of deleting a row it didn't copy
+        ArchivedEC2Instance.objects.bulk_create(
+            [
+                ArchivedEC2Instance(
+                    id=instance.pk,
+                    name=instance.name,
+                    ip_address=instance.ip_address,
+                    port=instance.port,
+                    creating_user_id=instance.creating_user_id,
+                    username=instance.username,
+                    instance_type=instance.instance_type,
+                    aws_instance_id=instance.aws_instance_id,
+                    region=instance.region,
+                    status=instance.status,
+                    created_at=instance.created_at,
+                    updated_at=instance.updated_at,
+                    terminated_at=instance.terminated_at,
+                    archived_at=now,
+                )
+                for instance in instances
+            ],
+        )
+        EC2Instance.objects.filter(pk__in=[instance.pk for instance in instances]).delete()
+    return len(instances)
+
+
+def iter_archive(
+    now: datetime | None = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE,
+    limit: int | None = None,
+) -> Iterator[int]:
+    """Archive batches until none are left (or ``limit`` rows moved), yielding each batch's size."""
+    cutoff = archive_cutoff(now)
+    moved = 0
+    while limit is None or moved < limit:
+        count = archive_batch(cutoff, batch_size if limit is None else min(batch_size, limit - moved))
+        if not count:
+            break
+        moved += count
+        yield count
+
+
+def archive_terminated(now: datetime | None = None, batch_size: int = ARCHIVE_BATCH_SIZE, limit: int | None = None) -> int:
+    """Archive every instance terminated before the retention cutoff; return how many moved."""
+    moved = sum(iter_archive(now, batch_size, limit))
+    logger.info("Archived terminated instances", extra={'count': moved})
+    return moved
+
+
+def all_instances(**filters) -> QuerySet:
+    """
+    ``SHARED_FIELDS`` dicts of live and archived instances matching
+    ``filters``, with ``archived`` telling them apart.
+
+    A UNION ALL of both tables; only use it where history is needed, live
+    views should keep querying ``EC2Instance``.
+    """
+    live = EC2Instance.objects.filter(**filters).order_by().values(
+        *SHARED_FIELDS, archived=Value(False, output_field=BooleanField()),
+    )
+    archived = ArchivedEC2Instance.objects.filter(**filters).order_by().values(
+        *SHARED_FIELDS, archived=Value(True, output_field=BooleanField()),
+    )
+    return live.union(archived, all=True)
+
+
+def find_instance(pk: int | None = None, aws_instance_id: str | None = None) -> EC2Instance | ArchivedEC2Instance | None:
+    """The live instance with this id or AWS id, else its archived row, else None."""
+    if pk is None and not aws_instance_id:
+        raise ValueError("pk or aws_instance_id is required")
+    filters = {'pk': pk} if pk is not None else {'aws_instance_id': aws_instance_id}
+    return (
+        EC2Instance.objects.filter(**filters).first()
+        or ArchivedEC2Instance.objects.filter(**filters).order_by('-archived_at').first()
+    )
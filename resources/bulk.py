@@ -0,0 +1,182 @@
+"""
+Instance actions over large selections, batched and run in the background.
+
+Selected instances are grouped by owner and region, and each group goes to
+EC2 in calls of up to ``ACTION_BATCH_SIZE`` instance ids, so starting a
+thousand instances is a handful of API calls instead of a thousand, and the
+status updates are one UPDATE per call. ``submit_instance_action`` hands the
+job to a small worker pool once the request's transaction commits, so the
+admin answers straight away however many instances were selected.
+"""
+import logging
+import re
+import threading
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from accounts.models import User
+from InfraSmartRouter.metrics import REGISTRY
+from resources.history import record_transitions
+from resources.models import EC2Instance
+
+logger = logging.getLogger(__name__)
+
+ACTION_BATCH_SIZE: int = 500
+
+ACTION_INSTANCES = REGISTRY.counter(
+    'instance_action_instances_total',
+    'Instances handled by batched (admin) actions.',
+    ('action', 'outcome'),
+)
+
+
+# action -> (resources.api.api_resources function, status the model methods record on success)
+STATE_ACTIONS: dict[str, tuple[str, str]] = {
+    'start': ('start_ec2_instances', 'running'),
+    'stop': ('stop_ec2_instances', 'stopped'),
+    'terminate': ('terminate_ec2_instances', 'terminated'),
+}
+ACTIONS: tuple[str, ...] = (*STATE_ACTIONS, 'refresh')
+
+NOT_FOUND_ERROR: str = 'InvalidInstanceID.NotFound'
+# The error message names the ids AWS doesn't know
+INSTANCE_ID_PATTERN = re.compile(r'\bi-[0-9a-f]+\b')
+
+
+def instance_batches(instance_ids: Iterable[int]) -> Iterator[tuple[User, str, dict[str, int]]]:
+    """Yield ``(owner, region, {aws_instance_id: pk})`` batches of the instances that exist in AWS."""
+    groups: dict[tuple[object, str], dict[str, int]] = {}
+    rows = (
+        EC2Instance.objects
+        .filter(pk__in=list(instance_ids), aws_instance_id__isnull=False)
+        .order_by()
+        .values_list('pk', 'aws_instance_id', 'region', 'creating_user_id')
+    )
+    for pk, aws_instance_id, region, user_id in rows:
+        groups.setdefault((user_id, region), {})[aws_instance_id] = pk
+    users = User.objects.in_bulk({user_id for user_id, _ in groups})
+    for (user_id, region), instances in groups.items():
+        aws_ids = list(instances)
+        for start in range(0, len(aws_ids), ACTION_BATCH_SIZE):
+            chunk = aws_ids[start:start + ACTION_BATCH_SIZE]
+            yield users[user_id], region, {aws_id: instances[aws_id] for aws_id in chunk}
+
+
+def _describe_existing(user: User, region: str, aws_ids: list[str]) -> list[dict]:
+    """``describe_ec2_instances``, dropping ids AWS no longer knows instead of failing the whole batch."""
+    from botocore.exceptions import ClientError
+
+    from resources.api.api_resources import describe_ec2_instances
+
+    while aws_ids:
+        try:
+            return describe_ec2_instances(user, aws_ids, region)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != NOT_FOUND_ERROR:
+                raise
+            missing = set(INSTANCE_ID_PATTERN.findall(str(e))) & set(aws_ids)
+            if not missing:
+                raise
+            logger.warning("Instances no longer exist in AWS", extra={'region': region, 'instance_ids': sorted(missing)})
+            aws_ids = [aws_id for aws_id in aws_ids if aws_id not in missing]
+    return []
+
+
+def _refresh_batch(user: User, region: str, batch: dict[str, int]) -> int:
+    """Update status and IP of one batch from a single describe; return the rows written."""
+    now = timezone.now()
+    previous = dict(EC2Instance.objects.filter(pk__in=batch.values()).values_list('pk', 'status'))
+    rows = []
+    for instance in _describe_existing(user, region, list(batch)):
+        rows.append(EC2Instance(
+            pk=batch[instance['InstanceId']],
+            status=instance['State']['Name'],
+            ip_address=instance.get('PublicIpAddress'),
+            updated_at=now,
+        ))
+    # Like ``refresh_from_aws``, a describe without a public IP keeps the stored one
+    EC2Instance.objects.bulk_update([row for row in rows if row.ip_address], ['status', 'ip_address', 'updated_at'])
+    EC2Instance.objects.bulk_update([row for row in rows if not row.ip_address], ['status', 'updated_at'])
+    terminated = [row.pk for row in rows if row.status == 'terminated']
+    if terminated:
+        EC2Instance.objects.filter(pk__in=terminated, terminated_at__isnull=True).update(terminated_at=now)
+    record_transitions(((row.pk, row.status) for row in rows if previous.get(row.pk) != row.status), at=now)
+    return len(rows)
+
+
+def mark_status(instance_ids: Iterable[int], status: str) -> None:
+    """Store the status a successful EC2 call put the instances in, in one UPDATE."""
+    instance_ids = list(instance_ids)
+    now = timezone.now()
+    # Only instances that weren't already in the target state make it into the history
+    changed = list(EC2Instance.objects.filter(pk__in=instance_ids).exclude(status=status).values_list('pk', flat=True))
+    EC2Instance.objects.filter(pk__in=instance_ids).update(status=status, updated_at=now)
+    record_transitions(((pk, status) for pk in changed), at=now)
+    if status == 'terminated':
+        EC2Instance.objects.filter(pk__in=instance_ids, terminated_at__isnull=True).update(terminated_at=now)
+
+
+def run_instance_action(action: str, instance_ids: Iterable[int]) -> dict[str, int]:
+    """Apply ``action`` to the instances, one EC2 call per batch; return counts by outcome."""
+    from resources.api import api_resources
+
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown instance action: {action}")
+    counts = {'succeeded': 0, 'failed': 0}
+    for user, region, batch in instance_batches(instance_ids):
+        if action == 'refresh':
+            try:
+                _refresh_batch(user, region, batch)
+            except Exception as e:
+                logger.error("Error refreshing instances", extra={'region': region, 'count': len(batch), 'error': str(e)})
+                outcome = 'failed'
+            else:
+                outcome = 'succeeded'
+        else:
+            function_name, status = STATE_ACTIONS[action]
+            if getattr(api_resources, function_name)(user, list(batch), region):
+                mark_status(batch.values(), status)
+                outcome = 'succeeded'
+            else:
+                outcome = 'failed'
+        counts[outcome] += len(batch)
+        ACTION_INSTANCES.inc(len(batch), action=action, outcome=outcome)
+    return counts
+
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(1, getattr(settings, 'INSTANCE_ACTION_WORKERS', 2)),
+                thread_name_prefix='instance-action',
+            )
+    return _executor
+
+
+def _run_job(action: str, instance_ids: list[int]) -> None:
+    try:
+        counts = run_instance_action(action, instance_ids)
+        logger.info("Finished instance action", extra={'action': action, **counts})
+    except Exception as e:
+        logger.error("Error running instance action", extra={'action': action, 'count': len(instance_ids), 'error': str(e)})
+    finally:
+        # Worker threads keep their own connection; don't leave it open between jobs.
+        connection.close()
+
+
+def submit_instance_action(action: str, instance_ids: Iterable[int]) -> None:
+    """Run ``action`` over the instances in the background, after the current transaction commits."""
+    if action not in ACTIONS:
+        raise ValueError(f"Unknown instance action: {action}")
+    instance_ids = list(instance_ids)
+    transaction.on_commit(lambda: get_executor().submit(_run_job, action, instance_ids))
@@ -0,0 +1,256 @@
+"""
+Inventory updates from EC2 state-change events instead of polling.
+
+An EventBridge rule sends every "EC2 Instance State-change Notification" to
+the SQS queue named by ``INSTANCE_EVENTS_QUEUE_URL``. ``consume`` reads it
+and applies the events to ``EC2Instance`` rows in micro-batches: up to
+``INSTANCE_EVENTS_BATCH_SIZE`` messages, or whatever arrived within
+``INSTANCE_EVENTS_MAX_WAIT`` seconds. Each batch is one transaction, and
+its messages are deleted only after it commits, so a failed batch is
+redelivered by SQS.
+
+While a consumer is running, it keeps a heartbeat in the cache for each
+region whose events reach its queue (``INSTANCE_EVENTS_REGIONS``, by default
+the queue's own region), written after every batch commits, and
+``events_active(region)`` is true for those regions. Status polls there then
+read the database instead of calling ``describe_instances``, and sync scans a
+region with instances only every ``SYNC_RECONCILE_INTERVAL`` seconds, or
+sooner when an event names an instance the app doesn't know
+(``region_dirty_since``). Sync only repairs drift.
+
+Events carry no IP address. An instance that starts loses its stored
+public IP, so its next status poll describes it and stores the new one.
+
+Run ``python manage.py consume_instance_events`` as a long-lived process.
+"""
+import json
+import logging
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from InfraSmartRouter.metrics import REGISTRY
+from resources.history import record_transitions
+from resources.models import EC2Instance, InstanceStateEvent
+
+logger = logging.getLogger(__name__)
+
+STATE_CHANGE_DETAIL_TYPE = 'EC2 Instance State-change Notification'
+# An instance entering these gets a new public IP
+STARTED_STATES: frozenset[str] = frozenset({'pending', 'running'})
+# SQS limits
+RECEIVE_MAX_MESSAGES: int = 10
+DELETE_BATCH_SIZE: int = 10
+
+INSTANCE_EVENTS = REGISTRY.counter(
+    'instance_state_events_total',
+    'EC2 state-change events consumed, by what happened to them.',
+    ('outcome',),
+)
+
+
+@dataclass
+class StateChange:
+    aws_instance_id: str
+    state: str
+    region: str
+    at: datetime
+
+
+def parse_state_change(body: str) -> StateChange | None:
+    """The state change in an EventBridge message body; None for anything else."""
+    try:
+        event = json.loads(body)
+        if event.get('detail-type') != STATE_CHANGE_DETAIL_TYPE:
+            return None
+        at = datetime.strptime(event['time'], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=dt_timezone.utc)
+        return StateChange(event['detail']['instance-id'], event['detail']['state'], event['region'], at)
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def dirty_cache_key(region: str) -> str:
+    return f'instance-events:dirty:{region}'
+
+
+def region_dirty_since(region: str, since: datetime) -> bool:
+    """Whether an event named an unknown instance in ``region`` after ``since``."""
+    dirty_at = cache.get(dirty_cache_key(region))
+    return dirty_at is not None and dirty_at > since.timestamp()
+
+
+def heartbeat_cache_key(region: str) -> str:
+    return f'instance-events:heartbeat:{region}'
+
+
+def events_active(region: str) -> bool:
+    """Whether a consumer has been applying ``region``'s events recently enough to trust the database."""
+    if not getattr(settings, 'INSTANCE_EVENTS_QUEUE_URL', ''):
+        return False
+    heartbeat = cache.get(heartbeat_cache_key(region))
+    return heartbeat is not None and time.time() - heartbeat < getattr(settings, 'INSTANCE_EVENTS_HEARTBEAT_SECONDS', 60)
+
+
+def apply_state_changes(changes: Iterable[StateChange]) -> dict[str, int]:
+    """
+    Apply a micro-batch of events in one transaction; return counts by outcome.
+
+    Only the newest event per instance counts. An event older than the
+    instance's last recorded transition is stale (a sync or action already
+    saw a later state) and is skipped; other writes to the row, such as a
+    tag change, don't make it stale. An unknown instance marks its region dirty, so the next
+    sync scans it. An instance that starts has its IP cleared until a
+    describe stores the new one.
+    """
+    newest: dict[str, StateChange] = {}
+    for change in changes:
+        current = newest.get(change.aws_instance_id)
+        if current is None or change.at >= current.at:
+            newest[change.aws_instance_id] = change
+    counts = {'applied': 0, 'unchanged': 0, 'stale': 0, 'unknown': 0}
+    if not newest:
+        return counts
+
+    now = timezone.now()
+    with transaction.atomic():
+        rows = {
+            aws_instance_id: (pk, status)
+            for pk, aws_instance_id, status in (
+                EC2Instance.objects
+                .filter(aws_instance_id__in=list(newest))
+                .select_for_update()
+                .order_by()
+                .values_list('pk', 'aws_instance_id', 'status')
+            )
+        }
+        # When each instance's state was last seen to change
+        observed = dict(
+            InstanceStateEvent.objects
+            .filter(instance_id__in=[pk for pk, _ in rows.values()])
+            .values('instance_id')
+            .annotate(at=Max('at'))
+            .values_list('instance_id', 'at')
+        )
+        updates: list[EC2Instance] = []
+        restarted: list[EC2Instance] = []
+        transitions: list[tuple[int, str]] = []
+        for aws_instance_id, change in newest.items():
+            row = rows.get(aws_instance_id)
+            if row is None:
+                counts['unknown'] += 1
+                cache.set(dirty_cache_key(change.region), now.timestamp(), None)
+                continue
+            pk, status = row
+            # Event times are whole seconds
+            if pk in observed and change.at < observed[pk].replace(microsecond=0):
+                counts['stale'] += 1
+            elif change.state == status:
+                counts['unchanged'] += 1
+            elif change.state in STARTED_STATES and status not in STARTED_STATES:
+                restarted.append(EC2Instance(pk=pk, status=change.state, ip_address=None, updated_at=now))
+                transitions.append((pk, change.state))
+                counts['applied'] += 1
+            else:
+                updates.append(EC2Instance(pk=pk, status=change.state, updated_at=now))
+                transitions.append((pk, change.state))
+                counts['applied'] += 1
+        if restarted:
+            EC2Instance.objects.bulk_update(restarted, ['status', 'ip_address', 'updated_at'])
+        if updates:
+            EC2Instance.objects.bulk_update(updates, ['status', 'updated_at'])
+            terminated = [instance.pk for instance in updates if instance.status == 'terminated']
+            if terminated:
+                EC2Instance.objects.filter(pk__in=terminated, terminated_at__isnull=True).update(terminated_at=now)
+        record_transitions(transitions, at=now)
+    for outcome, count in counts.items():
+        if count:
+            INSTANCE_EVENTS.inc(count, outcome=outcome)
+    return counts
+
+
+def queue_region(queue_url: str) -> str:
+    """Region out of ``https://sqs.<region>.amazonaws.com/<account>/<name>``."""
+    host = queue_url.split('/')[2]
+    return host.split('.')[1] if host.startswith('sqs.') else 'us-east-1'
+
+
+class SQSQueue:
+    """The SQS calls ``consume`` needs, through the app's shared AWS clients."""
+
+    def __init__(self, queue_url: str):
+        from resources.api.clients import get_aws_client
+
+        self.queue_url: str = queue_url
+        self.client = get_aws_client('sqs', region_name=queue_region(queue_url))
+        # Regions whose state-change rules target this queue
+        self.regions: list[str] = list(getattr(settings, 'INSTANCE_EVENTS_REGIONS', None) or [queue_region(queue_url)])
+
+    def receive(self, wait_seconds: int) -> list[dict]:
+        response = self.client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=RECEIVE_MAX_MESSAGES,
+            WaitTimeSeconds=wait_seconds,
+        )
+        return response.get('Messages', [])
+
+    def delete(self, receipt_handles: list[str]) -> None:
+        for start in range(0, len(receipt_handles), DELETE_BATCH_SIZE):
+            chunk = receipt_handles[start:start + DELETE_BATCH_SIZE]
+            self.client.delete_message_batch(
+                QueueUrl=self.queue_url,
+                Entries=[{'Id': str(index), 'ReceiptHandle': handle} for index, handle in enumerate(chunk)],
+            )
+
+
+def beat(regions: Iterable[str]) -> None:
+    """Mark the regions' events as flowing."""
+    cache.set_many({heartbeat_cache_key(region): time.time() for region in regions}, None)
+
+
+def consume_batch(queue: SQSQueue, batch_size: int | None = None, max_wait: float | None = None) -> dict[str, int]:
+    """Receive one micro-batch, apply it and delete its messages; return counts by outcome."""
+    batch_size = batch_size or getattr(settings, 'INSTANCE_EVENTS_BATCH_SIZE', 100)
+    max_wait = getattr(settings, 'INSTANCE_EVENTS_MAX_WAIT', 1.0) if max_wait is None else max_wait
+    deadline = time.monotonic() + max_wait
+    messages: list[dict] = []
+    while len(messages) < batch_size:
+        # Long-poll only while the batch is empty; once something arrived, flush by the deadline
+        received = queue.receive(wait_seconds=0 if messages else min(20, max(0, int(max_wait))))
+        messages.extend(received)
+        if not received or time.monotonic() >= deadline:
+            break
+    if not messages:
+        beat(queue.regions)
+        return {}
+
+    changes = []
+    for message in messages:
+        change = parse_state_change(message['Body'])
+        if change is None:
+            # Not a state change (or malformed): drop it rather than redelivering it forever
+            INSTANCE_EVENTS.inc(outcome='ignored')
+            continue
+        changes.append(change)
+    counts = apply_state_changes(changes)
+    queue.delete([message['ReceiptHandle'] for message in messages])
+    # Only once the batch is in the database may status polls rely on it
+    beat(queue.regions)
+    logger.info("Applied instance events", extra={'messages': len(messages), **counts})
+    return counts
+
+
+def consume(queue: SQSQueue, stop: Callable[[], bool] = lambda: False) -> None:
+    """Apply micro-batches until ``stop()`` is true; a failing batch is retried after SQS redelivers it."""
+    while not stop():
+        try:
+            consume_batch(queue)
+        except Exception as e:
+            logger.error("Error applying instance events", extra={'error': str(e)})
+            time.sleep(1)
@@ -0,0 +1,271 @@
+"""
+Compact in-memory fleet model used by the inventory sync.
+
+boto3 hands back a deeply nested dict per instance (block devices, network
+interfaces, security groups, ...) of which sync needs six strings and the
+tags. The reader below turns each page into ``InstanceRecord`` objects as
+it arrives, so the full response dicts can be freed page by page, and
+interns the low-cardinality strings (region, type, state, tag keys) so 100k
+records share a few dozen string objects. The diff engine then compares
+records against ``values_list`` tuples from the database instead of model
+instances; tags are compared with the ``InstanceTag`` rows separately.
+"""
+import sys
+from collections.abc import Collection, Iterable, Iterator
+from dataclasses import dataclass, field
+
+from django.utils import timezone
+
+from InfraSmartRouter.metrics import DB_WRITE_DURATION, DB_WRITE_ROWS, timed
+from resources.history import record_transitions
+from resources.models import EC2Instance
+from resources.tags import NAME_TAG, load_tags, replace_tags, touch
+
+# Columns loaded from the database for diffing, in ``values_list`` order.
+ROW_FIELDS: tuple[str, ...] = ('id', 'aws_instance_id', 'name', 'status', 'instance_type', 'ip_address', 'region', 'creating_user_id')
+LOOKUP_CHUNK_SIZE: int = 1000
+WRITE_BATCH_SIZE: int = 500
+
+
+class InstanceRecord:
+    __slots__ = ('aws_instance_id', 'name', 'state', 'instance_type', 'ip_address', 'region', 'tags', 'owner_id', 'pk', 'created')
+
+    def __init__(
+        self,
+        aws_instance_id: str,
+        name: str,
+        state: str,
+        instance_type: str,
+        ip_address: str | None,
+        region: str,
+        owner_id: object = None,
+        tags: tuple[tuple[str, str], ...] = (),
+    ):
+        self.aws_instance_id: str = aws_instance_id
+        self.name: str = name
+        self.state: str = sys.intern(state)
+        self.instance_type: str = sys.intern(instance_type)
+        self.ip_address: str | None = ip_address
+        self.region: str = sys.intern(region)
+        # Sorted (key, value) pairs except Name (that's ``name``); usually empty, and () is shared
+        self.tags: tuple[tuple[str, str], ...] = tags
+        self.owner_id: object = owner_id
+        self.pk: int | None = None
+        self.created: bool = False
+
+    @classmethod
+    def from_boto(cls, instance: dict, owner_id: object = None, tag_sets: dict | None = None) -> 'InstanceRecord':
+        """
+        Build a record from one ``describe_instances`` instance dict.
+
+        Records built with the same ``tag_sets`` dict share one tuple per
+        distinct set of tags; fleets mostly repeat a few (team, env, ...).
+        """
+        tags = {sys.intern(tag['Key']): tag['Value'] for tag in instance.get('Tags', ())}
+        name = tags.pop(NAME_TAG, instance['InstanceId'])
+        tag_tuple = tuple(sorted(tags.items())) if tags else ()
+        if tag_sets is not None and tag_tuple:
+            tag_tuple = tag_sets.setdefault(tag_tuple, tag_tuple)
+        return cls(
+            aws_instance_id=instance['InstanceId'],
+            name=name,
+            state=instance['State']['Name'],
+            instance_type=instance['InstanceType'],
+            ip_address=instance.get('PublicIpAddress'),
+            region=instance['Placement']['AvailabilityZone'][:-1],
+            owner_id=owner_id,
+            tags=tag_tuple,
+        )
+
+    def copy(self) -> 'InstanceRecord':
+        """Same AWS fields, without the sync state (pk, owner, created) a diff fills in."""
+        return InstanceRecord(self.aws_instance_id, self.name, self.state, self.instance_type, self.ip_address, self.region, tags=self.tags)
+
+    def differs_from(self, row: tuple) -> bool:
+        """Compare against a ``ROW_FIELDS`` tuple."""
+        _, _, name, status, instance_type, ip_address, region, owner_id = row
+        return (
+            name != self.name
+            or status != self.state
+            or instance_type != self.instance_type
+            or ip_address != self.ip_address
+            or region != self.region
+            or owner_id != self.owner_id
+        )
+
+    def as_dict(self) -> dict[str, object]:
+        """Shape used by the sync endpoint's JSON response."""
+        return {
+            'id': self.pk,
+            'aws_instance_id': self.aws_instance_id,
+            'name': self.name,
+            'state': self.state,
+            'type': self.instance_type,
+            'ip_address': self.ip_address,
+            'region': self.region,
+            'created': self.created,
+        }
+
+    def __repr__(self) -> str:
+        return f'InstanceRecord({self.aws_instance_id}, {self.name!r}, {self.state}, {self.region})'
+
+
+def read_inventory(aws_instances: Iterable[dict], owner_id: object = None) -> list[InstanceRecord]:
+    tag_sets: dict = {}
+    return [InstanceRecord.from_boto(instance, owner_id, tag_sets) for instance in aws_instances]
+
+
+@dataclass
+class FleetDiff:
+    created: list[InstanceRecord] = field(default_factory=list)
+    updated: list[InstanceRecord] = field(default_factory=list)
+    unchanged: list[InstanceRecord] = field(default_factory=list)
+    # Terminated instances with no live row: never stored, or already archived
+    ignored: list[InstanceRecord] = field(default_factory=list)
+    # The subset of ``updated`` whose state changed, for the state history
+    state_changed: list[InstanceRecord] = field(default_factory=list)
+
+    def __iter__(self) -> Iterator[InstanceRecord]:
+        yield from self.created
+        yield from self.updated
+        yield from self.unchanged
+        yield from self.ignored
+
+    def __len__(self) -> int:
+        return len(self.created) + len(self.updated) + len(self.unchanged) + len(self.ignored)
+
+
+def load_rows(aws_instance_ids: list[str]) -> dict[str, tuple]:
+    """Fetch ``ROW_FIELDS`` tuples for the given instance ids, keyed by AWS id."""
+    rows: dict[str, tuple] = {}
+    for start in range(0, len(aws_instance_ids), LOOKUP_CHUNK_SIZE):
+        chunk = aws_instance_ids[start:start + LOOKUP_CHUNK_SIZE]
+        for row in EC2Instance.objects.filter(aws_instance_id__in=chunk).values_list(*ROW_FIELDS):
+            rows[row[1]] = row
+    return rows
+
+
+def diff_fleet(
+    records: Iterable[InstanceRecord],
+    rows: dict[str, tuple],
+    owner_ids: Collection | None = None,
+    default_owner_id: object = None,
+) -> FleetDiff:
+    """
+    Split records into new, changed and unchanged relative to ``rows``.
+
+    Records without an owner keep the row's owner if it is one of
+    ``owner_ids`` (any owner when ``owner_ids`` is None) and otherwise get
+    ``default_owner_id``, so rows attributed to the wrong account are fixed.
+    Instances that are already terminated when first seen are ignored:
+    AWS keeps listing them for about an hour, and re-inserting them would
+    bring archived rows back into the live table.
+    """
+    diff = FleetDiff()
+    for record in records:
+        row = rows.get(record.aws_instance_id)
+        if row is None:
+            if record.state == 'terminated':
+                diff.ignored.append(record)
+                continue
+            if record.owner_id is None:
+                record.owner_id = default_owner_id
+            diff.created.append(record)
+            continue
+        record.pk = row[0]
+        if record.name == record.aws_instance_id:
+            # No Name tag in AWS: keep the name the app gave the instance
+            record.name = row[2]
+        if record.owner_id is None:
+            owner_id = row[7]
+            if owner_ids is not None and owner_id not in owner_ids:
+                owner_id = default_owner_id
+            record.owner_id = owner_id
+        if record.differs_from(row):
+            diff.updated.append(record)
+            if record.state != row[3]:
+                diff.state_changed.append(record)
+        else:
+            diff.unchanged.append(record)
+    return diff
+
+
+def apply_fleet_diff(diff: FleetDiff, default_owner_id: object) -> None:
+    """
+    Write a diff with one bulk INSERT/UPDATE per batch instead of a query pair per row.
+
+    New instances and state changes are appended to the state history in one more bulk insert.
+    """
+    if diff.created:
+        with timed(DB_WRITE_DURATION, operation='bulk_create'):
+            created = EC2Instance.objects.bulk_create(
+                [
+                    EC2Instance(
+                        aws_instance_id=record.aws_instance_id,
+                        name=record.name,
+                        status=record.state,
+                        instance_type=record.instance_type,
+                        ip_address=record.ip_address,
+                        region=record.region,
+                        creating_user_id=record.owner_id or default_owner_id,
+                        username='ubuntu',
+                    )
+                    for record in diff.created
+                ],
+                batch_size=WRITE_BATCH_SIZE,
+            )
+        for record, row in zip(diff.created, created):
+            record.pk = row.pk
+            record.created = True
+        DB_WRITE_ROWS.inc(len(created), operation='bulk_create')
+
+    if diff.updated:
+        now = timezone.now()
+        update_fields = ['name', 'status', 'instance_type', 'ip_address', 'region', 'creating_user', 'updated_at']
+        rows = [
+            EC2Instance(
+                id=record.pk,
+                name=record.name,
+                status=record.state,
+                instance_type=record.instance_type,
+                ip_address=record.ip_address,
+                region=record.region,
+                creating_user_id=record.owner_id,
+                updated_at=now,
+            )
+            for record in diff.updated
+        ]
+        with timed(DB_WRITE_DURATION, operation='bulk_update'):
+            EC2Instance.objects.bulk_update(rows, update_fields, batch_size=WRITE_BATCH_SIZE)
+        DB_WRITE_ROWS.inc(len(rows), operation='bulk_update')
+        terminated = [record.pk for record in diff.updated if record.state == 'terminated']
+        if terminated:
+            # Only rows that weren't terminated before; the archive retention counts from the first time
+            EC2Instance.objects.filter(pk__in=terminated, terminated_at__isnull=True).update(terminated_at=now)
+
+    record_transitions(
+        (record.pk, record.state)
+        for records in (diff.created, diff.state_changed)
+        for record in records
+        if record.pk is not None
+    )
+    apply_tag_changes(diff)
+
+
+def apply_tag_changes(diff: FleetDiff) -> None:
+    """Store the tags of every record whose tags differ from the stored ones, in one read and one rewrite per chunk."""
+    changed = {record.pk: dict(record.tags) for record in diff.created if record.tags and record.pk is not None}
+    known = [record for records in (diff.updated, diff.unchanged) for record in records]
+    stored = load_tags(record.pk for record in known)
+    retagged = []
+    for record in known:
+        if dict(record.tags) != stored.get(record.pk, {}):
+            changed[record.pk] = dict(record.tags)
+            retagged.append(record.pk)
+    if not changed:
+        return
+    with timed(DB_WRITE_DURATION, operation='tags'):
+        replace_tags(changed)
+        if retagged:
+            touch(retagged)
+    DB_WRITE_ROWS.inc(len(changed), operation='tags')
@@ -0,0 +1,174 @@
+"""
+State-transition history of instances.
+
+Every place that learns an instance's state (sync, the start/stop/terminate
+actions, status refreshes) records only real transitions, in one
+``bulk_create`` per batch, as ``InstanceStateEvent`` rows of (instance id,
+state code, time). An unchanged poll writes nothing, so frequent syncs stay
+cheap.
+
+Events older than ``STATE_HISTORY_RAW_DAYS`` are downsampled into
+``InstanceStateDaily`` rows (seconds per instance, state and UTC day) by
+``manage.py rollup_state_history``. An anchor event at the cutoff carries
+each instance's state over into the raw range. ``time_in_state`` adds both
+up, so "how long was this box running last month" resolves to the second
+for recent history and to whole days for older history.
+"""
+import logging
+from collections.abc import Iterable, Iterator
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from resources.models import InstanceStateDaily, InstanceStateEvent
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE: int = 1000
+STATE_CODES: dict[str, int] = {state: code for code, state in InstanceStateEvent.STATE_CHOICES}
+TERMINATED: int = STATE_CODES['terminated']
+
+
+def record_transitions(transitions: Iterable[tuple[int, str]], at: datetime | None = None) -> int:
+    """
+    Append ``(instance_id, state)`` transitions in one bulk insert.
+
+    Callers pass only instances whose state actually changed. States EC2
+    may add later are skipped rather than failing the write that found them.
+    """
+    at = at or timezone.now()
+    events = [
+        InstanceStateEvent(instance_id=instance_id, state=STATE_CODES[state], at=at)
+        for instance_id, state in transitions
+        if state in STATE_CODES
+    ]
+    if events:
+        InstanceStateEvent.objects.bulk_create(events, batch_size=WRITE_BATCH_SIZE)
+    return len(events)
+
+
+def _events(instance_id: int, start: datetime, end: datetime) -> list[tuple[int, datetime]]:
+    before = (
+        InstanceStateEvent.objects
+        .filter(instance_id=instance_id, at__lt=start)
+        .order_by('-at')
+        .values_list('state', 'at')
+        .first()
+    )
+    events = list(
+        InstanceStateEvent.objects
+        .filter(instance_id=instance_id, at__gte=start, at__lt=end)
+        .order_by('at')
+        .values_list('state', 'at')
+    )
+    if before is not None:
+        events.insert(0, (before[0], start))
+    return events
+
+
+def state_events(instance_id: int, start: datetime, end: datetime) -> list[tuple[str, datetime]]:
+    """``(state, since)`` pairs covering ``[start, end)``: the state in effect at ``start``, then each change."""
+    return [(InstanceStateEvent.STATES[state], at) for state, at in _events(instance_id, start, end)]
+
+
+def _intervals(events: list[tuple[int, datetime]], end: datetime) -> Iterator[tuple[int, datetime, datetime]]:
+    """``(state, from, to)`` spans between consecutive events, the last one running to ``end``."""
+    for index, (state, at) in enumerate(events):
+        until = events[index + 1][1] if index + 1 < len(events) else end
+        if until > at and state != TERMINATED:
+            yield state, at, until
+
+
+def time_in_state(instance_id: int, start: datetime, end: datetime | None = None) -> dict[str, float]:
+    """Seconds the instance spent in each state between ``start`` and ``end`` (default now)."""
+    end = end or timezone.now()
+    totals: dict[str, float] = {}
+    # Rolled-up days count only when they lie wholly inside the range
+    start_utc = start.astimezone(dt_timezone.utc)
+    first_day = start_utc.date() if start_utc.time() == time() else start_utc.date() + timedelta(days=1)
+    last_day = end.astimezone(dt_timezone.utc).date()
+    daily = (
+        InstanceStateDaily.objects
+        .filter(instance_id=instance_id, day__gte=first_day, day__lt=last_day)
+        .values_list('state')
+        .annotate(total=Sum('seconds'))
+        .order_by()
+    )
+    for state, seconds in daily:
+        name = InstanceStateEvent.STATES[state]
+        totals[name] = totals.get(name, 0) + seconds
+    # Raw events, to the second
+    for state, since, until in _intervals(_events(instance_id, start, end), end):
+        name = InstanceStateEvent.STATES[state]
+        totals[name] = totals.get(name, 0) + (until - since).total_seconds()
+    return totals
+
+
+def rollup_cutoff(now: datetime | None = None) -> datetime:
+    """Midnight UTC ``STATE_HISTORY_RAW_DAYS`` ago; events before it are rolled up."""
+    days = getattr(settings, 'STATE_HISTORY_RAW_DAYS', 35)
+    cutoff_day = ((now or timezone.now()).astimezone(dt_timezone.utc) - timedelta(days=days)).date()
+    return datetime.combine(cutoff_day, time(), tzinfo=dt_timezone.utc)
+
+
+def _split_by_day(since: datetime, until: datetime) -> Iterator[tuple[date, float]]:
+    while since < until:
+        next_midnight = datetime.combine(since.astimezone(dt_timezone.utc).date() + timedelta(days=1), time(), tzinfo=dt_timezone.utc)
+        boundary = min(next_midnight, until)
+        yield since.astimezone(dt_timezone.utc).date(), (boundary - since).total_seconds()
+        since = boundary
+
+
+def _rollup_instance(
+    instance_id: int,
+    events: list[tuple[int, datetime]],
+    cutoff: datetime,
+    daily: dict[tuple[int, date, int], float],
+    anchors: list[InstanceStateEvent],
+) -> None:
+    """Add one instance's pre-cutoff spans to ``daily`` and queue its anchor event."""
+    for state, since, until in _intervals(events, cutoff):
+        for day, seconds in _split_by_day(since, until):
+            key = (instance_id, day, state)
+            daily[key] = daily.get(key, 0) + seconds
+    last_state = events[-1][0]
+    if last_state != TERMINATED:
+        anchors.append(InstanceStateEvent(instance_id=instance_id, state=last_state, at=cutoff))
+
+
+def rollup_state_history(now: datetime | None = None) -> int:
+    """Fold events before the cutoff into daily rows and delete them; return how many events were folded."""
+    cutoff = rollup_cutoff(now)
+    old_events = InstanceStateEvent.objects.filter(at__lt=cutoff)
+    daily: dict[tuple[int, date, int], float] = {}
+    anchors: list[InstanceStateEvent] = []
+    folded = 0
+    with transaction.atomic():
+        current_id = None
+        events: list[tuple[int, datetime]] = []
+        rows = old_events.order_by('instance_id', 'at').values_list('instance_id', 'state', 'at')
+        for instance_id, state, at in rows.iterator(chunk_size=WRITE_BATCH_SIZE):
+            if instance_id != current_id:
+                if events:
+                    _rollup_instance(current_id, events, cutoff, daily, anchors)
+                current_id, events = instance_id, []
+            events.append((state, at))
+            folded += 1
+        if events:
+            _rollup_instance(current_id, events, cutoff, daily, anchors)
+        InstanceStateDaily.objects.bulk_create(
+            [
+                InstanceStateDaily(instance_id=instance_id, day=day, state=state, seconds=round(seconds))
+                for (instance_id, day, state), seconds in daily.items()
+            ],
+            # Each run covers whole days from the previous cutoff (a midnight) on, so days never repeat
+            batch_size=WRITE_BATCH_SIZE,
+        )
+        old_events.delete()
+        # After the delete: an anchor from an earlier run sits before this cutoff and was just folded
+        InstanceStateEvent.objects.bulk_create(anchors, batch_size=WRITE_BATCH_SIZE)
+    logger.info("Rolled up state history", extra={'events': folded, 'days': len(daily), 'cutoff': cutoff.isoformat()})
+    return folded
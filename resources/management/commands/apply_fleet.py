@@ -0,0 +1,48 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.models import User
+from resources.plan import FleetSpec, apply_plan, dns_changes, plan_fleet
+
+
+class Command(BaseCommand):
+    help = "Converge a user's instances and DNS records on a declarative fleet spec (see resources/plan.py)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('spec', help='path to the JSON fleet spec')
+        parser.add_argument('--user', required=True, help='username whose AWS account owns the fleet')
+        parser.add_argument('--dry-run', action='store_true', help='only print the plan')
+
+    def handle(self, *args, **options):
+        try:
+            with open(options['spec']) as spec_file:
+                spec = FleetSpec.from_dict(json.load(spec_file))
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Invalid fleet spec: {e}")
+        owner = User.objects.filter(username=options['user']).first()
+        if owner is None:
+            raise CommandError(f"No user named {options['user']}")
+
+        plan = plan_fleet(spec, owner)
+        self.stdout.write(f"Plan ({plan.unchanged} instances already as specified):")
+        for line in plan.describe():
+            self.stdout.write(f"  {line}")
+        for note in plan.notes:
+            self.stdout.write(self.style.WARNING(f"  {note}"))
+        if options['dry_run']:
+            if spec.records:
+                changes, _ = dns_changes(spec, owner)
+                self.stdout.write(f"  {len(changes)} DNS records differ now; they are recomputed after the instance changes")
+            return
+
+        report = apply_plan(plan, progress=lambda step: self.stdout.write(f"  {step.describe()}"))
+        for action in report.skipped:
+            self.stdout.write(self.style.WARNING(f"  skipped: {action.describe()}"))
+        if spec.records:
+            self.stdout.write(f"  {report.dns_changes} DNS record changes in {report.dns_calls} calls")
+            for name in report.dns_waiting:
+                self.stdout.write(self.style.WARNING(f"  {name}: some instances have no public IP yet; apply again"))
+        if not report.ok:
+            raise CommandError("Fleet apply failed; see the steps above")
+        self.stdout.write(self.style.SUCCESS("Fleet converged"))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from resources.archive import ARCHIVE_BATCH_SIZE, archivable, archive_cutoff, iter_archive
+
+
+class Command(BaseCommand):
+    help = "Move instances terminated longer than INSTANCE_ARCHIVE_AFTER_DAYS ago to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=ARCHIVE_BATCH_SIZE, help='rows moved per transaction')
+        parser.add_argument('--limit', type=int, help='stop after moving this many rows')
+        parser.add_argument('--dry-run', action='store_true', help='only report how many rows would move')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archivable(archive_cutoff()).count()
+            self.stdout.write(f"{count} terminated instances would be archived")
+            return
+        moved = 0
+        for count in iter_archive(batch_size=options['batch_size'], limit=options['limit']):
+            moved += count
+            if options['verbosity'] > 1:
+                self.stdout.write(f"Archived {moved} instances so far")
+        self.stdout.write(self.style.SUCCESS(f"Archived {moved} terminated instances"))
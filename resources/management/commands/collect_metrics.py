@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from resources.api.cloudwatch import collect_metrics, prune_metric_samples
+from resources.sync import group_accounts
+
+
+class Command(BaseCommand):
+    help = "Fetch CPU, network and status-check metrics of every live instance from CloudWatch."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-prune', action='store_true', help='keep samples older than CLOUDWATCH_RETENTION_DAYS')
+
+    def handle(self, *args, **options):
+        accounts = group_accounts(User.objects.filter(is_active=True))
+        written = collect_metrics(accounts)
+        pruned = 0 if options['no_prune'] else prune_metric_samples()
+        self.stdout.write(self.style.SUCCESS(f"Stored {written} samples from {len(accounts)} accounts, pruned {pruned}"))
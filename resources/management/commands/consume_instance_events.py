@@ -0,0 +1,29 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from resources.events import SQSQueue, consume, consume_batch
+
+
+class Command(BaseCommand):
+    help = "Apply EC2 state-change events from the INSTANCE_EVENTS_QUEUE_URL SQS queue to the inventory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queue-url', default=getattr(settings, 'INSTANCE_EVENTS_QUEUE_URL', ''))
+        parser.add_argument('--once', action='store_true', help='apply a single micro-batch and exit')
+
+    def handle(self, *args, **options):
+        if not options['queue_url']:
+            raise CommandError("Set INSTANCE_EVENTS_QUEUE_URL or pass --queue-url")
+        queue = SQSQueue(options['queue_url'])
+        if options['once']:
+            self.stdout.write(f"{consume_batch(queue) or 'No events'}")
+            return
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        self.stdout.write(f"Consuming instance events from {options['queue_url']}")
+        try:
+            consume(queue, stop=lambda: bool(stopping))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from resources.history import rollup_cutoff, rollup_state_history
+
+
+class Command(BaseCommand):
+    help = "Fold instance state events older than STATE_HISTORY_RAW_DAYS into daily totals."
+
+    def handle(self, *args, **options):
+        folded = rollup_state_history()
+        self.stdout.write(self.style.SUCCESS(f"Rolled up {folded} state events before {rollup_cutoff():%Y-%m-%d}"))
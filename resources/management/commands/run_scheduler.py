@@ -0,0 +1,27 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from resources.scheduler import run_due, run_scheduler
+
+
+class Command(BaseCommand):
+    help = "Stop and terminate instances whose InstanceSchedule deadline or idle rule is due."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run the schedules due now and exit')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            counts = run_due()
+            self.stdout.write(
+                f"{counts['claimed']} schedules due: stopped {counts['stop']}, terminated {counts['terminate']}, failed {counts['failed']}"
+            )
+            return
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda *_: stopping.append(True))
+        self.stdout.write("Running instance schedules")
+        try:
+            run_scheduler(stop=lambda: bool(stopping))
+        except KeyboardInterrupt:
+            pass
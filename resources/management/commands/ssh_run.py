@@ -0,0 +1,59 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from resources.models import EC2Instance
+from resources.ssh import fan_out, ssh_targets
+
+
+class Command(BaseCommand):
+    help = "Run a shell command over SSH on every matching running instance, streaming each host's output."
+
+    def add_arguments(self, parser):
+        parser.add_argument('remote_command', help='command to run on each instance')
+        parser.add_argument('--id', type=int, action='append', dest='ids', help='instance id (repeatable)')
+        parser.add_argument('--name', help='only instances whose name starts with this')
+        parser.add_argument('--region')
+        parser.add_argument('--owner', help='only instances created by this username')
+        parser.add_argument('--concurrency', type=int, help='hosts worked on at once (default SSH_CONCURRENCY)')
+        parser.add_argument('--timeout', type=float, help='seconds per host (default SSH_COMMAND_TIMEOUT)')
+
+    def handle(self, *args, **options):
+        instances = EC2Instance.objects.filter(status='running', ip_address__isnull=False)
+        if options['ids']:
+            instances = instances.filter(pk__in=options['ids'])
+        if options['name']:
+            instances = instances.filter(name__startswith=options['name'])
+        if options['region']:
+            instances = instances.filter(region=options['region'])
+        if options['owner']:
+            instances = instances.filter(creating_user__username=options['owner'])
+        targets = ssh_targets(instances.order_by('name'))
+        if not targets:
+            raise CommandError("No running instances with an IP address match")
+
+        width = max(len(target.name) for target in targets)
+
+        def on_output(target, stream, line):
+            writer = self.stderr if stream == 'stderr' else self.stdout
+            writer.write(f"{target.name:<{width}} | {line}")
+
+        def on_result(result):
+            if result.error:
+                self.stderr.write(self.style.ERROR(f"{result.target.name:<{width}} ! {result.error}"))
+
+        result = asyncio.run(fan_out(
+            targets,
+            options['remote_command'],
+            on_output=on_output,
+            on_result=on_result,
+            concurrency=options['concurrency'],
+            timeout=options['timeout'],
+        ))
+        summary = ', '.join(
+            f"{'error' if code is None else f'exit {code}'}: {count}"
+            for code, count in sorted(result.exit_codes().items(), key=lambda item: (item[0] is None, item[0] or 0))
+        )
+        self.stdout.write(f"{len(result.results)} hosts: {summary}")
+        if not result.ok:
+            raise CommandError(f"{len(result.failed)} hosts failed")
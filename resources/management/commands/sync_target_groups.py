@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from resources.api.elb import sync_target_groups
+
+
+class Command(BaseCommand):
+    help = "Register running members of every TargetGroup with its load balancer target group and deregister the rest."
+
+    def handle(self, *args, **options):
+        counts = sync_target_groups()
+        self.stdout.write(self.style.SUCCESS(
+            f"Registered {counts['registered']} and deregistered {counts['deregistered']} targets in {counts['groups']} groups, {counts['failed']} failed"
+        ))
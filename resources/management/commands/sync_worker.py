@@ -0,0 +1,48 @@
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from resources.api.elb import sync_target_groups
+from resources.sync import group_accounts, iter_account_sync
+
+
+class Command(BaseCommand):
+    help = "Sync the instances of every active user; run one per node, they split the regions between them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='run one sync pass and exit')
+        parser.add_argument('--interval', type=int, default=None, help='seconds between passes (default SYNC_WORKER_INTERVAL)')
+        parser.add_argument('--full', action='store_true', help='scan every enabled region, not just the planned ones')
+
+    def sync_pass(self, full: bool) -> None:
+        accounts = group_accounts(User.objects.filter(is_active=True))
+        regions = instances = 0
+        for _, _, records in iter_account_sync(accounts, full=full):
+            regions += 1
+            instances += len(records)
+        self.stdout.write(f"Synced {regions} regions ({instances} instances) of {len(accounts)} accounts")
+        # Load balancers follow the statuses the pass just wrote
+        targets = sync_target_groups()
+        if targets['registered'] or targets['deregistered']:
+            self.stdout.write(f"Registered {targets['registered']} and deregistered {targets['deregistered']} load balancer targets")
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.sync_pass(options['full'])
+            return
+        interval = options['interval'] or getattr(settings, 'SYNC_WORKER_INTERVAL', 60)
+        stopping = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+        self.stdout.write("Running sync worker")
+        try:
+            while not stopping.is_set():
+                try:
+                    self.sync_pass(options['full'])
+                except Exception as e:
+                    self.stderr.write(f"Sync pass failed: {e}")
+                stopping.wait(interval)
+        except KeyboardInterrupt:
+            pass
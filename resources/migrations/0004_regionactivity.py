@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0003_alter_ec2instance_aws_instance_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegionActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('account', models.CharField(max_length=64)),
+                ('region', models.CharField(choices=[('us-east-1', 'US East (N. Virginia)'), ('us-east-2', 'US East (Ohio)'), ('us-west-1', 'US West (N. California)'), ('us-west-2', 'US West (Oregon)'), ('ca-central-1', 'Canada (Central)'), ('eu-central-1', 'Europe (Frankfurt)'), ('eu-west-1', 'Europe (Ireland)'), ('eu-west-2', 'Europe (London)'), ('eu-west-3', 'Europe (Paris)'), ('eu-north-1', 'Europe (Stockholm)'), ('ap-northeast-1', 'Asia Pacific (Tokyo)'), ('ap-northeast-2', 'Asia Pacific (Seoul)'), ('ap-southeast-1', 'Asia Pacific (Singapore)'), ('ap-southeast-2', 'Asia Pacific (Sydney)'), ('ap-south-1', 'Asia Pacific (Mumbai)'), ('sa-east-1', 'South America (São Paulo)')], max_length=20)),
+                ('instance_count', models.PositiveIntegerField(default=0)),
+                ('last_scanned_at', models.DateTimeField(blank=True, null=True)),
+                ('last_seen_instances_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('account', 'region'), name='unique_region_activity')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0004_regionactivity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ec2instance',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0005_ec2instance_updated_at_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ec2instance',
+            name='ip_address',
+            field=models.GenericIPAddressField(blank=True, db_index=True, null=True),
+        ),
+    ]
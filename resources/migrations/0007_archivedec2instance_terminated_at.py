@@ -0,0 +1,51 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:28
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_terminated_at(apps, schema_editor):
+    # Rows terminated before this migration: their last update is when sync saw the termination
+    EC2Instance = apps.get_model('resources', 'EC2Instance')
+    EC2Instance.objects.filter(status='terminated', terminated_at__isnull=True).update(terminated_at=models.F('updated_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0006_ec2instance_ip_address_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ec2instance',
+            name='terminated_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.RunPython(backfill_terminated_at, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='ArchivedEC2Instance',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('name', models.CharField(max_length=255)),
+                ('ip_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('port', models.PositiveIntegerField(default=22)),
+                ('username', models.CharField(max_length=100)),
+                ('instance_type', models.CharField(choices=[('t2.nano', 't2.nano'), ('t2.micro', 't2.micro'), ('t2.small', 't2.small'), ('t2.medium', 't2.medium'), ('t2.large', 't2.large'), ('t3.nano', 't3.nano'), ('t3.micro', 't3.micro'), ('t3.small', 't3.small'), ('t3.medium', 't3.medium'), ('t3.large', 't3.large')], max_length=20)),
+                ('aws_instance_id', models.CharField(blank=True, db_index=True, max_length=20, null=True)),
+                ('region', models.CharField(choices=[('us-east-1', 'US East (N. Virginia)'), ('us-east-2', 'US East (Ohio)'), ('us-west-1', 'US West (N. California)'), ('us-west-2', 'US West (Oregon)'), ('ca-central-1', 'Canada (Central)'), ('eu-central-1', 'Europe (Frankfurt)'), ('eu-west-1', 'Europe (Ireland)'), ('eu-west-2', 'Europe (London)'), ('eu-west-3', 'Europe (Paris)'), ('eu-north-1', 'Europe (Stockholm)'), ('ap-northeast-1', 'Asia Pacific (Tokyo)'), ('ap-northeast-2', 'Asia Pacific (Seoul)'), ('ap-southeast-1', 'Asia Pacific (Singapore)'), ('ap-southeast-2', 'Asia Pacific (Sydney)'), ('ap-south-1', 'Asia Pacific (Mumbai)'), ('sa-east-1', 'South America (São Paulo)')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('stopped', 'Stopped'), ('terminated', 'Terminated')], max_length=20)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('terminated_at', models.DateTimeField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('creating_user', models.ForeignKey(on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_instances', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
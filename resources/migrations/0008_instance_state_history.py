@@ -0,0 +1,38 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0007_archivedec2instance_terminated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceStateDaily',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.BigIntegerField()),
+                ('day', models.DateField()),
+                ('state', models.PositiveSmallIntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'stopping'), (3, 'stopped'), (4, 'shutting-down'), (5, 'terminated')])),
+                ('seconds', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('instance_id', 'day', 'state'), name='unique_instance_state_day')],
+            },
+        ),
+        migrations.CreateModel(
+            name='InstanceStateEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.BigIntegerField()),
+                ('state', models.PositiveSmallIntegerField(choices=[(0, 'pending'), (1, 'running'), (2, 'stopping'), (3, 'stopped'), (4, 'shutting-down'), (5, 'terminated')])),
+                ('at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['instance_id', 'at'], name='state_event_instance_at')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0008_instance_state_history'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceMetricSample',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.BigIntegerField()),
+                ('metric', models.PositiveSmallIntegerField(choices=[(0, 'cpu_utilization'), (1, 'network_in'), (2, 'network_out'), (3, 'status_check_failed')])),
+                ('at', models.DateTimeField()),
+                ('value', models.FloatField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['at'], name='metric_sample_at')],
+                'constraints': [models.UniqueConstraint(fields=('instance_id', 'metric', 'at'), name='unique_instance_metric_sample')],
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0009_instancemetricsample'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceSchedule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stop_at', models.DateTimeField(blank=True, null=True)),
+                ('terminate_at', models.DateTimeField(blank=True, null=True)),
+                ('idle_action', models.CharField(blank=True, choices=[('stop', 'Stop'), ('terminate', 'Terminate')], max_length=10)),
+                ('idle_cpu_percent', models.FloatField(default=5.0)),
+                ('idle_minutes', models.PositiveIntegerField(default=60)),
+                ('idle_checked_at', models.DateTimeField(blank=True, null=True)),
+                ('next_due_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('last_action', models.CharField(blank=True, max_length=20)),
+                ('last_action_at', models.DateTimeField(blank=True, null=True)),
+                ('instance', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='schedule', to='resources.ec2instance')),
+            ],
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0010_instanceschedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='regionactivity',
+            name='lease_expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='regionactivity',
+            name='lease_owner',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+    ]
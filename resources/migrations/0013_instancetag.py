@@ -0,0 +1,26 @@
+# Generated by Django 5.2.4 on 2026-10-19 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('resources', '0012_targetgroup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstanceTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('instance_id', models.BigIntegerField()),
+                ('key', models.CharField(max_length=128)),
+                ('value', models.CharField(blank=True, max_length=256)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'value'], name='instance_tag_key_value')],
+                'constraints': [models.UniqueConstraint(fields=('instance_id', 'key'), name='unique_instance_tag')],
+            },
+        ),
+    ]
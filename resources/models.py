@@ -1,10 +1,14 @@
+import logging
+from datetime import datetime, timedelta
+
 from typing_extensions import override
+from django.conf import settings
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
 from django.utils import timezone
-from resources.api.api_resources import create_ec2_instance
 from accounts.models import User
-from resources.api.api_resources import get_ec2_client
+
+logger = logging.getLogger(__name__)
 
 # Create your models here.
 # pyright: reportInvalidTypeArguments=false
@@ -23,8 +27,9 @@ class EC2Instance(models.Model):
         ('t3.medium', 't3.medium'),
         ('t3.large', 't3.large'),
     )
-    # this is the AMI ID for the Ubuntu 20.04 LTS AMI in us-east-1
+    # this is the AMI ID for the Ubuntu 20.04 LTS AMI in us-east-1; other regions look theirs up (ami_for_region)
     AMI_ID: str = "ami-08a6efd148b1f7504"
+    AMI_REGION: str = 'us-east-1'
     STATUS_CHOICES: tuple[tuple[str, str], ...] = (
         ('pending', 'Pending'),
         ('running', 'Running'),
@@ -51,7 +56,7 @@ class EC2Instance(models.Model):
     )
 
     name: str= models.CharField(max_length=255, unique=True) 
-    ip_address: str= models.GenericIPAddressField(null=True, blank=True)  
+    ip_address: str= models.GenericIPAddressField(null=True, blank=True, db_index=True)
     port: str= models.PositiveIntegerField(
         default=22,
         validators=[MinValueValidator(1), MaxValueValidator(65535)]
@@ -83,7 +88,10 @@ class EC2Instance(models.Model):
         default='pending'
     )
     created_at: str= models.DateTimeField(default=timezone.now)
-    updated_at: str= models.DateTimeField(auto_now=True)
+    # Indexed for the dashboard's changed-rows query and its max(updated_at) ETag
+    updated_at: str= models.DateTimeField(auto_now=True, db_index=True)
+    # When the app first saw the instance terminated; resources/archive.py moves it out after a retention period
+    terminated_at: str= models.DateTimeField(null=True, blank=True, db_index=True)
     
     class Meta:
         ordering: list[str] = ['-created_at']
@@ -92,18 +100,58 @@ class EC2Instance(models.Model):
     def __str__(self):
         return f"{self.name} ({self.status})"
     
+    def set_status(self, status: str) -> list[str]:
+        """
+        Change ``status``, stamping ``terminated_at`` and recording the
+        transition in the state history; return the fields to save.
+        Call it and ``save()`` in one ``transaction.atomic()`` so the history
+        never holds a transition the row didn't get.
+        """
+        from resources.history import record_transitions
+        
+        changed = []
+        if status != self.status:
+            self.status = status
+            changed.append('status')
+            record_transitions([(self.pk, status)])
+        if status == 'terminated' and self.terminated_at is None:
+            self.terminated_at = timezone.now()
+            changed.append('terminated_at')
+        return changed
+    
+    @classmethod
+    def ami_for_region(cls, user: User, region: str) -> str | None:
+        """The Ubuntu 20.04 AMI to launch in ``region``."""
+        from resources.api.api_resources import ubuntu_ami_id
+        
+        if region == cls.AMI_REGION:
+            return cls.AMI_ID
+        return ubuntu_ami_id(user, region)
+    
     def create_instance(self) -> str | None:
+        from resources.api.api_resources import create_ec2_instance
+        from resources.history import record_transitions
+        from resources.tags import launch_tags, replace_tags
         
+        ami_id = self.ami_for_region(self.creating_user, self.region)
+        if not ami_id:
+            return None
+        tags = launch_tags(self.creating_user, self.name)
         instance_id = create_ec2_instance(
             user=self.creating_user,
-            ami_id=self.AMI_ID,
-            instance_type=self.instance_type
+            ami_id=ami_id,
+            instance_type=self.instance_type,
+            tags=tags,
+            region=self.region,
         )
         
         if instance_id:
             self.aws_instance_id = instance_id
             self.status = 'pending'
             self.save()
+            # The first entry of its state history
+            record_transitions([(self.pk, self.status)])
+            replace_tags({self.pk: tags})
             return instance_id
         return None
     def start_instance(self) -> bool:
@@ -114,12 +162,14 @@ class EC2Instance(models.Model):
             
         response = start_ec2_instances(
             user=self.creating_user,
-            instance_ids=[self.aws_instance_id]
+            instance_ids=[self.aws_instance_id],
+            region=self.region
         )
         
         if response:
-            self.status = 'running'
-            self.save()
+            with transaction.atomic():
+                self.set_status('running')
+                self.save()
             return True
         return False
         
@@ -131,12 +181,14 @@ class EC2Instance(models.Model):
             
         response = stop_ec2_instances(
             user=self.creating_user,
-            instance_ids=[self.aws_instance_id]
+            instance_ids=[self.aws_instance_id],
+            region=self.region
         )
         
         if response:
-            self.status = 'stopped'
-            self.save()
+            with transaction.atomic():
+                self.set_status('stopped')
+                self.save()
             return True
         return False    
 
@@ -148,55 +200,268 @@ class EC2Instance(models.Model):
             
         response = terminate_ec2_instances(
             user=self.creating_user,
-            instance_ids=[self.aws_instance_id]
+            instance_ids=[self.aws_instance_id],
+            region=self.region
         )
         
         if response:
-            self.status = 'terminated'
-            self.save()
+            with transaction.atomic():
+                self.set_status('terminated')
+                self.save()
             return True
         return False    
         
-    def get_instance_status(self)-> str | None:
+    def refresh_from_aws(self) -> dict[str, str | None] | None:
+        """Update status and IP from a single describe_instances call; None if AWS couldn't be asked."""
+        from resources.api.api_resources import describe_instance
         
         if not self.aws_instance_id:
             return None
             
         try:
-            ec2 = get_ec2_client(self.creating_user)
-            response = ec2.describe_instances(InstanceIds=[self.aws_instance_id])
-            
-            if response['Reservations']:
-                instance = response['Reservations'][0]['Instances'][0]
-                status = instance['State']['Name']
-                
-                if status != self.status:
-                    self.status = status
-                    self.save()
-                    
-                return status
+            instance = describe_instance(self.creating_user, self.aws_instance_id, self.region)
         except Exception as e:
-            print(f"Error getting instance status: {e}")
-        return None    
-        
-    def get_instance_ip_address(self):
-        
-        if not self.aws_instance_id:
+            logger.error("Error refreshing instance", extra={"aws_instance_id": self.aws_instance_id, "error": str(e)})
+            return None
+        if instance is None:
             return None
             
-        try:
-            ec2 = get_ec2_client(self.creating_user)
-            response = ec2.describe_instances(InstanceIds=[self.aws_instance_id])
-            
-            if response['Reservations']:
-                instance = response['Reservations'][0]['Instances'][0]
-                public_ip = instance.get('PublicIpAddress')
-                
-                if public_ip and public_ip != self.ip_address:
-                    self.ip_address = public_ip
-                    self.save()
-                    
-                return public_ip
-        except Exception as e:
-            print(f"Error getting instance IP: {e}")
-        return None    
+        status = instance['State']['Name']
+        public_ip = instance.get('PublicIpAddress')
+        changed = []
+        with transaction.atomic():
+            if status != self.status:
+                changed.extend(self.set_status(status))
+            if public_ip and public_ip != self.ip_address:
+                self.ip_address = public_ip
+                changed.append('ip_address')
+            if changed:
+                self.save(update_fields=changed + ['updated_at'])
+        return {'status': status, 'ip_address': public_ip}
+        
+    def get_instance_status(self)-> str | None:
+        state = self.refresh_from_aws()
+        return state['status'] if state else None
+        
+    def get_instance_ip_address(self):
+        state = self.refresh_from_aws()
+        return state['ip_address'] if state else None
+
+
+
+class InstanceTag(models.Model):
+    """
+    One AWS tag of an instance, kept in sync by inventory sync and
+    ``resources.tags``, so filtering by tag is an indexed join.
+    """
+    # Not a foreign key: tags stay with the id when the instance is archived, like InstanceStateEvent
+    instance_id: int= models.BigIntegerField()
+    # EC2 limits: 128 characters per key, 256 per value
+    key: str= models.CharField(max_length=128)
+    value: str= models.CharField(max_length=256, blank=True)
+
+    class Meta:
+        constraints = [
+            # Also the index for loading an instance's tags
+            models.UniqueConstraint(fields=['instance_id', 'key'], name='unique_instance_tag'),
+        ]
+        indexes = [
+            models.Index(fields=['key', 'value'], name='instance_tag_key_value'),
+        ]
+
+    @override
+    def __str__(self):
+        return f"{self.instance_id} {self.key}={self.value}"
+
+class RegionActivity(models.Model):
+    """
+    What sync has seen in one region of one AWS account, used to skip empty
+    regions; also the sync shard that a worker leases while it syncs the region.
+    """
+    # AWSAccount.cache_key: a hash, never the access key itself
+    account: str= models.CharField(max_length=64)
+    region: str= models.CharField(max_length=20, choices=EC2Instance.REGION_CHOICES)
+    instance_count: int= models.PositiveIntegerField(default=0)
+    last_scanned_at: str= models.DateTimeField(null=True, blank=True)
+    last_seen_instances_at: str= models.DateTimeField(null=True, blank=True)
+    # Which worker (host:pid) is syncing the region, until when
+    lease_owner: str= models.CharField(max_length=100, blank=True)
+    lease_expires_at: str= models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'region'], name='unique_region_activity'),
+        ]
+
+    @override
+    def __str__(self):
+        return f"{self.account} {self.region} ({self.instance_count})"
+
+
+class ArchivedEC2Instance(models.Model):
+    """
+    An instance that was terminated longer ago than the retention period.
+
+    Rows keep the id they had in ``EC2Instance``; connection secrets
+    (password, SSH key) are dropped when a row is archived.
+    """
+    id: int= models.BigIntegerField(primary_key=True)
+    name: str= models.CharField(max_length=255)
+    ip_address: str= models.GenericIPAddressField(null=True, blank=True)
+    port: int= models.PositiveIntegerField(default=22)
+    creating_user: User= models.ForeignKey(
+        User,
+        on_delete=models.DO_NOTHING,
+        related_name='archived_instances',
+    )
+    username: str= models.CharField(max_length=100)
+    instance_type: str= models.CharField(max_length=20, choices=EC2Instance.INSTANCE_TYPE_CHOICES)
+    aws_instance_id: str= models.CharField(max_length=20, null=True, blank=True, db_index=True)
+    region: str= models.CharField(max_length=20, choices=EC2Instance.REGION_CHOICES)
+    status: str= models.CharField(max_length=20, choices=EC2Instance.STATUS_CHOICES)
+    created_at: str= models.DateTimeField()
+    updated_at: str= models.DateTimeField()
+    terminated_at: str= models.DateTimeField(null=True, blank=True)
+    archived_at: str= models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        ordering: list[str] = ['-created_at']
+
+    @override
+    def __str__(self):
+        return f"{self.name} ({self.status}, archived)"
+
+
+class InstanceStateEvent(models.Model):
+    """One state transition of an instance, as small as a row gets: id, state code, time."""
+    STATES: tuple[str, ...] = ('pending', 'running', 'stopping', 'stopped', 'shutting-down', 'terminated')
+    STATE_CHOICES: tuple[tuple[int, str], ...] = tuple(enumerate(STATES))
+
+    # Not a foreign key: history outlives the live row when it is archived
+    instance_id: int= models.BigIntegerField()
+    state: int= models.PositiveSmallIntegerField(choices=STATE_CHOICES)
+    at: str= models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['instance_id', 'at'], name='state_event_instance_at'),
+        ]
+
+    @property
+    def state_name(self) -> str:
+        return self.STATES[self.state]
+
+    @override
+    def __str__(self):
+        return f"{self.instance_id} {self.state_name} at {self.at}"
+
+
+class InstanceStateDaily(models.Model):
+    """Seconds an instance spent in a state on one (UTC) day, for history older than the raw events."""
+    instance_id: int= models.BigIntegerField()
+    day: str= models.DateField()
+    state: int= models.PositiveSmallIntegerField(choices=InstanceStateEvent.STATE_CHOICES)
+    seconds: int= models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['instance_id', 'day', 'state'], name='unique_instance_state_day'),
+        ]
+
+    @override
+    def __str__(self):
+        return f"{self.instance_id} {InstanceStateEvent.STATES[self.state]} on {self.day}: {self.seconds}s"
+
+
+class InstanceMetricSample(models.Model):
+    """One CloudWatch datapoint of one instance: id, metric code, period start, value."""
+    METRICS: tuple[str, ...] = ('cpu_utilization', 'network_in', 'network_out', 'status_check_failed')
+    METRIC_CHOICES: tuple[tuple[int, str], ...] = tuple(enumerate(METRICS))
+
+    # Not a foreign key, like InstanceStateEvent
+    instance_id: int= models.BigIntegerField()
+    metric: int= models.PositiveSmallIntegerField(choices=METRIC_CHOICES)
+    at: str= models.DateTimeField()
+    value: float= models.FloatField()
+
+    class Meta:
+        constraints = [
+            # Also the (instance, metric, time) index range reads use; re-collected periods overwrite
+            models.UniqueConstraint(fields=['instance_id', 'metric', 'at'], name='unique_instance_metric_sample'),
+        ]
+        indexes = [
+            models.Index(fields=['at'], name='metric_sample_at'),
+        ]
+
+    @property
+    def metric_name(self) -> str:
+        return self.METRICS[self.metric]
+
+    @override
+    def __str__(self):
+        return f"{self.instance_id} {self.metric_name} at {self.at}: {self.value}"
+
+
+class InstanceSchedule(models.Model):
+    """
+    Stop/terminate deadlines and an idle rule for one instance.
+
+    ``next_due_at`` is the earliest time the scheduler (``resources.scheduler``)
+    has to look at the instance again; it is recomputed on every save.
+    """
+    ACTION_CHOICES: tuple[tuple[str, str], ...] = (
+        ('stop', 'Stop'),
+        ('terminate', 'Terminate'),
+    )
+
+    instance: EC2Instance= models.OneToOneField(EC2Instance, on_delete=models.CASCADE, related_name='schedule')
+    stop_at: str= models.DateTimeField(null=True, blank=True)
+    terminate_at: str= models.DateTimeField(null=True, blank=True)
+    # Idle rule: act when average CPU stayed below the threshold for the whole window
+    idle_action: str= models.CharField(max_length=10, choices=ACTION_CHOICES, blank=True)
+    idle_cpu_percent: float= models.FloatField(default=5.0)
+    idle_minutes: int= models.PositiveIntegerField(default=60)
+    idle_checked_at: str= models.DateTimeField(null=True, blank=True)
+    next_due_at: str= models.DateTimeField(null=True, blank=True, db_index=True)
+    last_action: str= models.CharField(max_length=20, blank=True)
+    last_action_at: str= models.DateTimeField(null=True, blank=True)
+
+    def next_due(self, now: datetime) -> datetime | None:
+        """Earliest deadline or idle check still ahead (or overdue) of this schedule."""
+        due = [at for at in (self.stop_at, self.terminate_at) if at is not None]
+        if self.idle_action:
+            interval = timedelta(seconds=getattr(settings, 'SCHEDULER_IDLE_CHECK_SECONDS', 300))
+            due.append(self.idle_checked_at + interval if self.idle_checked_at else now)
+        return min(due, default=None)
+
+    @override
+    def save(self, *args, **kwargs):
+        self.next_due_at = self.next_due(timezone.now())
+        super().save(*args, **kwargs)
+
+    @override
+    def __str__(self):
+        return f"Schedule of {self.instance_id} (next due {self.next_due_at})"
+
+
+class TargetGroup(models.Model):
+    """
+    An ELBv2 target group whose registered targets follow ``instances``.
+
+    ``resources.api.elb.sync_target_groups`` registers the members that are
+    running and passing status checks and deregisters the other instances
+    the app manages.
+    """
+    name: str= models.CharField(max_length=255, unique=True)
+    arn: str= models.CharField(max_length=255, unique=True, help_text="ARN of the existing ELBv2 target group")
+    region: str= models.CharField(max_length=20, choices=EC2Instance.REGION_CHOICES, default='us-east-1')
+    # Blank: the port the target group was created with
+    port: int= models.PositiveIntegerField(null=True, blank=True, validators=[MinValueValidator(1), MaxValueValidator(65535)])
+    # Whose AWS credentials manage the target group
+    owner: User= models.ForeignKey(User, on_delete=models.CASCADE, related_name='target_groups')
+    instances = models.ManyToManyField(EC2Instance, blank=True, related_name='target_groups')
+    synced_at: str= models.DateTimeField(null=True, blank=True)
+
+    @override
+    def __str__(self):
+        return f"{self.name} ({self.region})"
@@ -0,0 +1,404 @@
+"""
+Declarative fleet changes: describe the fleet you want, plan, apply.
+
+A ``FleetSpec`` (usually a JSON file) lists instance groups and the DNS
+records that point at them::
+
+    {
+        "groups": [
+            {"name": "web", "count": 20, "instance_type": "t3.micro", "region": "us-east-1"},
+            {"name": "batch", "count": 4, "region": "eu-west-1", "state": "stopped"}
+        ],
+        "dns": {
+            "hosted_zone_id": "Z0123456789",
+            "records": [{"name": "web.example.com", "group": "web", "ttl": 60}]
+        }
+    }
+
+A group's members are the owner's live instances named ``<group>-<n>``.
+Groups launch the Ubuntu image of their region unless they name an
+``ami_id``; AMI ids differ between regions.
+``plan_fleet`` diffs the spec against the synced inventory and returns the
+minimal set of actions: terminate surplus members and members of the wrong
+type or region, start or stop members in the wrong state, launch the
+shortfall. Actions are grouped so each one is a single API call: one
+``run_instances`` per group and one ``start/stop/terminate_instances`` per
+region, up to ``ACTION_BATCH_SIZE`` instances each.
+
+``apply_plan`` runs the actions in dependency order (removals, then
+launches and starts, then DNS), each phase's actions in parallel on
+``FLEET_APPLY_WORKERS`` threads. DNS A records then get the public IPs of
+their group's running members, in one ``ChangeResourceRecordSets`` call per
+1000 changes. Converging a 200-instance change takes a handful of calls.
+
+Run ``python manage.py apply_fleet spec.json --user <username>``.
+"""
+import logging
+import time
+from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+from accounts.models import User
+from InfraSmartRouter.metrics import REGISTRY
+from resources.bulk import ACTION_BATCH_SIZE, STATE_ACTIONS, mark_status, run_instance_action
+from resources.history import record_transitions
+from resources.models import EC2Instance
+from resources.tags import launch_tags, replace_tags, tags_from_boto
+
+logger = logging.getLogger(__name__)
+
+GROUP_TAG = 'fleet:group'
+GROUP_STATES: tuple[str, ...] = ('running', 'stopped')
+# Statuses that already count as the group's desired state
+SETTLED: dict[str, tuple[str, ...]] = {
+    'running': ('pending', 'running'),
+    'stopped': ('stopping', 'stopped'),
+}
+
+FLEET_ACTIONS = REGISTRY.counter(
+    'fleet_apply_actions_total',
+    'Actions run by apply_fleet, by kind and outcome.',
+    ('kind', 'outcome'),
+)
+
+
+@dataclass(frozen=True)
+class GroupSpec:
+    name: str
+    count: int
+    instance_type: str = 't2.micro'
+    region: str = 'us-east-1'
+    state: str = 'running'
+    # None: the region's Ubuntu image (EC2Instance.ami_for_region)
+    ami_id: str | None = None
+
+    def member_index(self, instance_name: str) -> int | None:
+        """``n`` of an instance named ``<group>-<n>``, else None."""
+        prefix = f'{self.name}-'
+        suffix = instance_name[len(prefix):]
+        return int(suffix) if instance_name.startswith(prefix) and suffix.isdigit() else None
+
+
+@dataclass(frozen=True)
+class RecordSpec:
+    name: str
+    group: str
+    ttl: int = 300
+
+
+@dataclass
+class FleetSpec:
+    groups: list[GroupSpec]
+    records: list[RecordSpec] = field(default_factory=list)
+    hosted_zone_id: str | None = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'FleetSpec':
+        """Build and validate a spec; raises ValueError on anything it can't apply."""
+        instance_types = {code for code, _ in EC2Instance.INSTANCE_TYPE_CHOICES}
+        regions = {code for code, _ in EC2Instance.REGION_CHOICES}
+        groups = []
+        for entry in data.get('groups', []):
+            try:
+                group = GroupSpec(**entry)
+            except TypeError as e:
+                raise ValueError(f"Invalid group {entry}: {e}") from e
+            if not group.name or group.count < 0:
+                raise ValueError(f"Group needs a name and a count of at least 0: {entry}")
+            if group.instance_type not in instance_types:
+                raise ValueError(f"Unknown instance type {group.instance_type!r} in group {group.name}")
+            if group.region not in regions:
+                raise ValueError(f"Unknown region {group.region!r} in group {group.name}")
+            if group.state not in GROUP_STATES:
+                raise ValueError(f"Group state must be one of {', '.join(GROUP_STATES)}: {group.name}")
+            groups.append(group)
+        names = [group.name for group in groups]
+        if len(set(names)) != len(names):
+            raise ValueError("Group names must be unique")
+
+        dns = data.get('dns') or {}
+        try:
+            records = [RecordSpec(**entry) for entry in dns.get('records', [])]
+        except TypeError as e:
+            raise ValueError(f"Invalid DNS record: {e}") from e
+        for record in records:
+            if record.group not in names:
+                raise ValueError(f"DNS record {record.name} points at unknown group {record.group!r}")
+        if records and not dns.get('hosted_zone_id'):
+            raise ValueError("DNS records need a hosted_zone_id")
+        return cls(groups=groups, records=records, hosted_zone_id=dns.get('hosted_zone_id'))
+
+
+@dataclass
+class PlanAction:
+    kind: str
+    region: str
+    # aws_instance_id -> pk for start/stop/terminate; filled in for launches once they ran
+    instances: dict[str, int] = field(default_factory=dict)
+    # Launches only
+    group: GroupSpec | None = None
+    names: list[str] = field(default_factory=list)
+
+    @property
+    def count(self) -> int:
+        return len(self.names) if self.kind == 'launch' else len(self.instances)
+
+    def describe(self) -> str:
+        if self.kind == 'launch':
+            return f"launch {self.count} x {self.group.instance_type} in {self.region} ({self.names[0]} .. {self.names[-1]})"
+        return f"{self.kind} {self.count} instances in {self.region}"
+
+
+@dataclass
+class FleetPlan:
+    owner: User
+    spec: FleetSpec
+    actions: list[PlanAction] = field(default_factory=list)
+    unchanged: int = 0
+    # What the plan can't do yet, e.g. start an instance that is still stopping
+    notes: list[str] = field(default_factory=list)
+
+    def phases(self) -> list[list[PlanAction]]:
+        """Actions in dependency order: removals free capacity and names before anything is added."""
+        return [
+            [action for action in self.actions if action.kind in ('terminate', 'stop')],
+            [action for action in self.actions if action.kind in ('launch', 'start')],
+        ]
+
+    def describe(self) -> list[str]:
+        return [action.describe() for phase in self.phases() for action in phase] or ['no instance changes']
+
+
+def _state_actions(kind: str, region: str, instances: dict[str, int]) -> Iterable[PlanAction]:
+    aws_ids = list(instances)
+    for start in range(0, len(aws_ids), ACTION_BATCH_SIZE):
+        yield PlanAction(kind, region, instances={aws_id: instances[aws_id] for aws_id in aws_ids[start:start + ACTION_BATCH_SIZE]})
+
+
+def plan_fleet(spec: FleetSpec, owner: User) -> FleetPlan:
+    """Diff ``spec`` against the owner's instances in the database (one query per group)."""
+    plan = FleetPlan(owner=owner, spec=spec)
+    # (kind, region) -> {aws_instance_id: pk}, merged across groups so each region gets one call per kind
+    changes: dict[tuple[str, str], dict[str, int]] = {}
+    for group in spec.groups:
+        members = []
+        # Names are unique across owners and terminated rows, so new ones continue after the highest taken
+        last_index = 0
+        rows = (
+            EC2Instance.objects
+            .filter(name__startswith=f'{group.name}-')
+            .order_by()
+            .values_list('pk', 'name', 'status', 'instance_type', 'region', 'aws_instance_id', 'creating_user_id')
+        )
+        for pk, name, status, instance_type, region, aws_instance_id, owner_id in rows:
+            index = group.member_index(name)
+            if index is None:
+                continue
+            last_index = max(last_index, index)
+            if owner_id == owner.pk and status != 'terminated' and aws_instance_id:
+                members.append((index, (aws_instance_id, pk), status, instance_type, region))
+
+        settled = SETTLED[group.state]
+        matching = []
+        for index, instance, status, instance_type, region in members:
+            if (instance_type, region) == (group.instance_type, group.region):
+                matching.append((index, instance, status))
+            else:
+                changes.setdefault(('terminate', region), {}).update([instance])
+        # Keep members already in the right state first, then the oldest names
+        matching.sort(key=lambda member: (member[2] not in settled, member[0]))
+        for index, instance, status in matching[group.count:]:
+            changes.setdefault(('terminate', group.region), {}).update([instance])
+        for index, instance, status in matching[:group.count]:
+            if status in settled:
+                plan.unchanged += 1
+            elif group.state == 'running' and status == 'stopped':
+                changes.setdefault(('start', group.region), {}).update([instance])
+            elif group.state == 'stopped' and status in ('pending', 'running'):
+                changes.setdefault(('stop', group.region), {}).update([instance])
+            else:
+                plan.notes.append(f"{group.name}-{index} is {status}; apply again once it settles")
+
+        shortfall = group.count - min(len(matching), group.count)
+        if shortfall and group.state == 'stopped':
+            plan.notes.append(f"{group.name} is {shortfall} short; stopped groups are not launched into")
+        elif shortfall:
+            names = [f'{group.name}-{index}' for index in range(last_index + 1, last_index + 1 + shortfall)]
+            for start in range(0, len(names), ACTION_BATCH_SIZE):
+                plan.actions.append(PlanAction('launch', group.region, group=group, names=names[start:start + ACTION_BATCH_SIZE]))
+
+    for (kind, region), instances in changes.items():
+        plan.actions.extend(_state_actions(kind, region, instances))
+    return plan
+
+
+def dns_changes(spec: FleetSpec, owner: User) -> tuple[list[dict], list[str]]:
+    """
+    Route53 ``Changes`` that point each record at its group's running
+    members, and the records that still miss members without a public IP.
+    """
+    from ABL_routing import list_all_dns_records
+
+    if not spec.records:
+        return [], []
+    groups = {group.name: group for group in spec.groups}
+    addresses: dict[str, list[str]] = {}
+    waiting: list[str] = []
+    for record in spec.records:
+        group = groups[record.group]
+        rows = (
+            EC2Instance.objects
+            .filter(creating_user=owner, name__startswith=f'{group.name}-', region=group.region, status__in=('pending', 'running'))
+            .order_by()
+            .values_list('name', 'ip_address')
+        )
+        members = [(name, ip) for name, ip in rows if group.member_index(name) is not None]
+        addresses[record.name] = sorted({ip for _, ip in members if ip})
+        if any(not ip for _, ip in members):
+            waiting.append(record.name)
+
+    current = {
+        record_set['Name']: record_set
+        for record_set in list_all_dns_records(spec.hosted_zone_id)
+        if record_set['Type'] == 'A'
+    }
+    changes = []
+    for record in spec.records:
+        fqdn = record.name.rstrip('.') + '.'
+        existing = current.get(fqdn)
+        values = addresses[record.name]
+        if not values:
+            if existing is not None:
+                changes.append({'Action': 'DELETE', 'ResourceRecordSet': existing})
+            continue
+        existing_values = sorted(value['Value'] for value in existing.get('ResourceRecords', [])) if existing else None
+        if existing_values != values or existing.get('TTL') != record.ttl:
+            changes.append({
+                'Action': 'UPSERT',
+                'ResourceRecordSet': {
+                    'Name': fqdn,
+                    'Type': 'A',
+                    'TTL': record.ttl,
+                    'ResourceRecords': [{'Value': ip} for ip in values],
+                },
+            })
+    return changes, waiting
+
+
+@dataclass
+class StepResult:
+    action: PlanAction
+    ok: bool
+    seconds: float
+    error: str = ''
+    # Launches: the instances ``run_instances`` returned
+    launched: list[dict] = field(default_factory=list)
+
+    def describe(self) -> str:
+        outcome = 'ok' if self.ok else f'FAILED: {self.error}'
+        return f"{self.action.describe()}: {outcome} ({self.seconds:.1f}s)"
+
+
+@dataclass
+class ApplyReport:
+    steps: list[StepResult] = field(default_factory=list)
+    dns_changes: int = 0
+    dns_calls: int = 0
+    # Records whose group still has members without a public IP; apply again to add them
+    dns_waiting: list[str] = field(default_factory=list)
+    # Phases not run because an earlier one failed
+    skipped: list[PlanAction] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return all(step.ok for step in self.steps) and not self.skipped
+
+
+def _call_aws(owner: User, action: PlanAction) -> StepResult:
+    """One action's single AWS call, on a worker thread; the database is only written from the caller's thread."""
+    from resources.api import api_resources
+
+    started = time.monotonic()
+    result = StepResult(action, True, 0)
+    try:
+        if action.kind == 'launch':
+            group = action.group
+            ami_id = group.ami_id or EC2Instance.ami_for_region(owner, group.region)
+            # The group tag finds them in the console; per-instance names live in the app
+            launched = api_resources.run_ec2_instances(
+                owner, ami_id, group.instance_type, len(action.names), group.region, tags={**launch_tags(owner), GROUP_TAG: group.name},
+            ) if ami_id else None
+            result.launched = launched or []
+            result.ok = launched is not None
+        else:
+            function_name, _ = STATE_ACTIONS[action.kind]
+            result.ok = getattr(api_resources, function_name)(owner, list(action.instances), action.region) is not None
+        if not result.ok:
+            result.error = f"{action.kind} call failed"
+    except Exception as e:
+        # e.g. missing credentials: fail this step and let the rest of the phase finish
+        logger.error("Error applying fleet action", extra={'action': action.describe(), 'error': str(e)})
+        result.ok = False
+        result.error = str(e)
+    result.seconds = time.monotonic() - started
+    FLEET_ACTIONS.inc(kind=action.kind, outcome='succeeded' if result.ok else 'failed')
+    return result
+
+
+def _record(owner: User, result: StepResult) -> None:
+    """Write what a successful call changed: new rows for launches, statuses otherwise."""
+    action = result.action
+    if action.kind != 'launch':
+        mark_status(action.instances.values(), STATE_ACTIONS[action.kind][1])
+        return
+    group = action.group
+    created = EC2Instance.objects.bulk_create([
+        EC2Instance(
+            name=name,
+            aws_instance_id=instance['InstanceId'],
+            status=instance['State']['Name'],
+            instance_type=group.instance_type,
+            region=group.region,
+            ip_address=instance.get('PublicIpAddress'),
+            creating_user=owner,
+            username='ubuntu',
+        )
+        for name, instance in zip(action.names, result.launched)
+    ])
+    action.instances = {row.aws_instance_id: row.pk for row in created}
+    record_transitions((row.pk, row.status) for row in created)
+    replace_tags({row.pk: tags_from_boto(instance) for row, instance in zip(created, result.launched)})
+
+
+def apply_plan(plan: FleetPlan, progress: Callable[[StepResult], None] | None = None) -> ApplyReport:
+    """Run a plan phase by phase, each phase's AWS calls in parallel; stop after the first phase with a failure."""
+    from ABL_routing import change_dns_records
+
+    report = ApplyReport()
+    workers = max(1, getattr(settings, 'FLEET_APPLY_WORKERS', 4))
+    phases = [phase for phase in plan.phases() if phase]
+    for number, phase in enumerate(phases):
+        with ThreadPoolExecutor(max_workers=min(workers, len(phase)), thread_name_prefix='fleet-apply') as executor:
+            for result in executor.map(lambda action: _call_aws(plan.owner, action), phase):
+                if result.ok:
+                    _record(plan.owner, result)
+                report.steps.append(result)
+                logger.info("Applied fleet action", extra={'step': result.describe()})
+                if progress:
+                    progress(result)
+        if not all(step.ok for step in report.steps):
+            report.skipped = [action for later in phases[number + 1:] for action in later]
+            return report
+
+    # Started instances get a new public IP and launched ones may only have one now
+    added = [pk for action in plan.actions if action.kind in ('launch', 'start') for pk in action.instances.values()]
+    if added:
+        run_instance_action('refresh', added)
+    if plan.spec.records:
+        changes, report.dns_waiting = dns_changes(plan.spec, plan.owner)
+        report.dns_changes = len(changes)
+        report.dns_calls = change_dns_records(plan.spec.hosted_zone_id, changes) if changes else 0
+    return report
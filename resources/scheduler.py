@@ -0,0 +1,219 @@
+"""
+Scheduled and idle auto-stop/terminate of instances.
+
+Each ``InstanceSchedule`` keeps ``next_due_at``, the earliest of its stop
+and terminate deadlines and its next idle check, in an indexed column. A
+scheduler pass therefore reads only the due rows, oldest first, however
+many schedules exist. It claims them (``select_for_update(skip_locked)``
+on Postgres, so several workers split the work), decides what each one
+needs, and hands the instances to ``resources.bulk.run_instance_action``,
+which makes one ``stop_instances``/``terminate_instances`` call per owner
+and region for up to ``ACTION_BATCH_SIZE`` instances.
+
+Idle rules use the CPU samples ``manage.py collect_metrics`` stores: an
+instance is idle when its samples cover the whole ``idle_minutes`` window
+and every one is below ``idle_cpu_percent``.
+
+``run_scheduler`` is the long-lived loop behind ``manage.py run_scheduler``.
+It takes a clock, so tests can drive it with ``FakeClock`` instead of
+waiting.
+"""
+import logging
+import time
+from collections.abc import Callable
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from InfraSmartRouter.metrics import REGISTRY
+from resources.bulk import run_instance_action
+from resources.models import EC2Instance, InstanceMetricSample, InstanceSchedule
+
+logger = logging.getLogger(__name__)
+
+CPU_METRIC: int = InstanceMetricSample.METRICS.index('cpu_utilization')
+# Statuses each action still has to change
+ACTIONABLE: dict[str, tuple[str, ...]] = {
+    'stop': ('pending', 'running'),
+    'terminate': ('pending', 'running', 'stopping', 'stopped'),
+}
+SCHEDULE_FIELDS: tuple[str, ...] = ('stop_at', 'terminate_at', 'idle_checked_at', 'next_due_at', 'last_action', 'last_action_at')
+
+SCHEDULED_ACTIONS = REGISTRY.counter(
+    'scheduled_instance_actions_total',
+    'Instances stopped or terminated by the scheduler, by action and reason.',
+    ('action', 'reason'),
+)
+
+
+class Clock:
+    """Wall-clock time; ``run_scheduler`` only ever asks for ``now`` and ``sleep``."""
+
+    def now(self) -> datetime:
+        return timezone.now()
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+
+class FakeClock(Clock):
+    """A clock that only moves when slept on, for driving the scheduler in tests."""
+
+    def __init__(self, start: datetime | None = None):
+        self.current: datetime = start or datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+
+    def now(self) -> datetime:
+        return self.current
+
+    def sleep(self, seconds: float) -> None:
+        self.current += timedelta(seconds=seconds)
+
+
+def idle_instances(schedules: list[InstanceSchedule], now: datetime) -> set[int]:
+    """Instance ids of ``schedules`` whose CPU stayed under their threshold for their whole window, in one query."""
+    if not schedules:
+        return set()
+    period = timedelta(seconds=getattr(settings, 'CLOUDWATCH_PERIOD_SECONDS', 300))
+    since = now - timedelta(minutes=max(schedule.idle_minutes for schedule in schedules)) - period
+    samples: dict[int, list[tuple[datetime, float]]] = {}
+    rows = (
+        InstanceMetricSample.objects
+        .filter(instance_id__in=[schedule.instance_id for schedule in schedules], metric=CPU_METRIC, at__gte=since)
+        .order_by()
+        .values_list('instance_id', 'at', 'value')
+    )
+    for instance_id, at, value in rows:
+        samples.setdefault(instance_id, []).append((at, value))
+    idle = set()
+    for schedule in schedules:
+        window_start = now - timedelta(minutes=schedule.idle_minutes)
+        # The period that started just before the window counts; it covers the window's first minutes
+        window = [(at, value) for at, value in samples.get(schedule.instance_id, ()) if at >= window_start - period]
+        # No samples (or a gap at the start) is not proof of idleness: metrics may just not be collected yet
+        if window and min(at for at, _ in window) <= window_start and all(value < schedule.idle_cpu_percent for _, value in window):
+            idle.add(schedule.instance_id)
+    return idle
+
+
+def _decide(schedule: InstanceSchedule, now: datetime, idle: set[int]) -> tuple[str, str] | None:
+    """``(action, reason)`` due for one claimed schedule, if any."""
+    status = schedule.instance.status
+    if schedule.terminate_at and schedule.terminate_at <= now:
+        return ('terminate', 'deadline') if status in ACTIONABLE['terminate'] else None
+    if schedule.stop_at and schedule.stop_at <= now:
+        return ('stop', 'deadline') if status in ACTIONABLE['stop'] else None
+    if schedule.idle_action and schedule.instance_id in idle and status in ACTIONABLE[schedule.idle_action]:
+        return schedule.idle_action, 'idle'
+    return None
+
+
+def _settle(schedule: InstanceSchedule, now: datetime, action: str | None, status: str) -> None:
+    """Clear what fired (or no longer applies) and work out the next due time."""
+    if schedule.terminate_at and schedule.terminate_at <= now and status not in ACTIONABLE['terminate']:
+        schedule.terminate_at = None
+    if schedule.stop_at and schedule.stop_at <= now and status not in ACTIONABLE['stop']:
+        schedule.stop_at = None
+    idle_interval = timedelta(seconds=getattr(settings, 'SCHEDULER_IDLE_CHECK_SECONDS', 300))
+    if schedule.idle_action and (schedule.idle_checked_at is None or schedule.idle_checked_at + idle_interval <= now):
+        schedule.idle_checked_at = now
+    if action:
+        schedule.last_action, schedule.last_action_at = action, now
+    # A terminated instance has nothing left to schedule
+    schedule.next_due_at = None if status == 'terminated' else schedule.next_due(now)
+
+
+def run_due(now: datetime | None = None, batch_size: int | None = None) -> dict[str, int]:
+    """
+    Act on up to ``batch_size`` due schedules; return counts of claimed,
+    stopped, terminated and failed instances.
+
+    Schedules that need an AWS call are claimed by pushing ``next_due_at``
+    out by ``SCHEDULER_RETRY_SECONDS`` in the claiming transaction, so a
+    concurrent worker doesn't pick them up and a failed call is retried
+    then. Only a call that took effect clears its deadline.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or getattr(settings, 'SCHEDULER_BATCH_SIZE', 1000)
+    retry_at = now + timedelta(seconds=getattr(settings, 'SCHEDULER_RETRY_SECONDS', 300))
+    counts = {'claimed': 0, 'stop': 0, 'terminate': 0, 'failed': 0}
+
+    with transaction.atomic():
+        due = InstanceSchedule.objects.filter(next_due_at__lte=now).select_related('instance').order_by('next_due_at')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True, of=('self',))
+        schedules = list(due[:batch_size])
+        if not schedules:
+            return counts
+        counts['claimed'] = len(schedules)
+        idle = idle_instances(
+            [s for s in schedules if s.idle_action and s.instance.status in ACTIONABLE[s.idle_action]],
+            now,
+        )
+        acting: list[tuple[InstanceSchedule, str, str]] = []
+        for schedule in schedules:
+            decision = _decide(schedule, now, idle)
+            if decision:
+                acting.append((schedule, *decision))
+                schedule.next_due_at = retry_at
+            else:
+                _settle(schedule, now, None, schedule.instance.status)
+        InstanceSchedule.objects.bulk_update(schedules, SCHEDULE_FIELDS)
+    if not acting:
+        return counts
+
+    # Outside the transaction: AWS calls must not hold row locks
+    for action in ('terminate', 'stop'):
+        instance_ids = [schedule.instance_id for schedule, kind, _ in acting if kind == action]
+        if instance_ids:
+            result = run_instance_action(action, instance_ids)
+            counts[action] += result['succeeded']
+            counts['failed'] += result['failed']
+
+    statuses = dict(
+        EC2Instance.objects
+        .filter(pk__in=[schedule.instance_id for schedule, _, _ in acting])
+        .values_list('pk', 'status')
+    )
+    settled = []
+    for schedule, action, reason in acting:
+        status = statuses.get(schedule.instance_id, 'terminated')
+        if status not in ACTIONABLE[action]:
+            _settle(schedule, now, action, status)
+            settled.append(schedule)
+            SCHEDULED_ACTIONS.inc(action=action, reason=reason)
+    InstanceSchedule.objects.bulk_update(settled, SCHEDULE_FIELDS)
+    logger.info("Ran due schedules", extra={**counts, 'at': now.isoformat()})
+    return counts
+
+
+def next_wake(now: datetime) -> float:
+    """Seconds until the earliest due schedule, capped at ``SCHEDULER_POLL_SECONDS`` so new schedules are seen."""
+    poll = getattr(settings, 'SCHEDULER_POLL_SECONDS', 30)
+    next_due_at = (
+        InstanceSchedule.objects
+        .filter(next_due_at__isnull=False)
+        .order_by('next_due_at')
+        .values_list('next_due_at', flat=True)
+        .first()
+    )
+    if next_due_at is None:
+        return poll
+    return min(poll, max(0.0, (next_due_at - now).total_seconds()))
+
+
+def run_scheduler(clock: Clock | None = None, stop: Callable[[], bool] = lambda: False) -> None:
+    """Run due schedules until ``stop()`` is true, sleeping until the next one is due."""
+    clock = clock or Clock()
+    batch_size = getattr(settings, 'SCHEDULER_BATCH_SIZE', 1000)
+    while not stop():
+        try:
+            counts = run_due(clock.now(), batch_size)
+        except Exception as e:
+            logger.error("Error running schedules", extra={'error': str(e)})
+            clock.sleep(getattr(settings, 'SCHEDULER_POLL_SECONDS', 30))
+            continue
+        # A full batch means more is due right now
+        if counts['claimed'] < batch_size:
+            clock.sleep(next_wake(clock.now()))
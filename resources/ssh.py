@@ -0,0 +1,259 @@
+"""
+Run a shell command on many instances at once over SSH.
+
+Commands go out with ``asyncssh`` from a single event loop: at most
+``SSH_CONCURRENCY`` hosts are worked on at a time, each host's connection
+is opened once per ``SSHPool`` and reused by every command sent to it,
+and output is streamed line by line to a callback as it arrives instead of
+being collected per host. ``FanoutResult`` aggregates the exit codes.
+
+Credentials come from the instance rows: ``username``, ``port``, and
+``ssh_key`` (private key text) or ``password``; instances with neither
+fall back to the keys of the user running the app. Host keys are checked
+against the known_hosts file ``SSH_KNOWN_HOSTS`` names; without one,
+``SSHPool`` refuses to connect unless ``SSH_INSECURE_SKIP_HOST_KEY_CHECK``
+explicitly turns checking off.
+
+``asyncssh`` is optional: only this module needs it. Any SSH server works
+for trying it out, e.g. ``asyncssh.listen()`` or a local sshd on a spare
+port.
+
+Run ``python manage.py ssh_run "uptime" --name web-``.
+"""
+import asyncio
+import logging
+import time
+from collections import Counter
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from resources.models import EC2Instance
+
+logger = logging.getLogger(__name__)
+
+# on_output(target, stream name, line)
+OutputCallback = Callable[['SSHTarget', str, str], None]
+
+
+def _asyncssh():
+    try:
+        import asyncssh
+    except ImportError as e:
+        raise ImproperlyConfigured("SSH commands need the asyncssh package: pip install asyncssh") from e
+    return asyncssh
+
+
+@dataclass(frozen=True)
+class SSHTarget:
+    instance_id: int
+    name: str
+    host: str
+    port: int = 22
+    username: str = 'ubuntu'
+    password: str = ''
+    ssh_key: str = ''
+
+    @classmethod
+    def from_instance(cls, instance: EC2Instance) -> 'SSHTarget':
+        return cls(
+            instance_id=instance.pk,
+            name=instance.name,
+            host=instance.ip_address,
+            port=instance.port,
+            username=instance.username or 'ubuntu',
+            password=instance.password,
+            ssh_key=instance.ssh_key,
+        )
+
+    @property
+    def key(self) -> tuple[str, int, str]:
+        """What a connection is shared by."""
+        return self.host, self.port, self.username
+
+
+@dataclass
+class HostResult:
+    target: SSHTarget
+    # None when the command never ran to completion (connect error, timeout)
+    exit_status: int | None = None
+    error: str = ''
+    seconds: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return self.exit_status == 0
+
+
+@dataclass
+class FanoutResult:
+    results: list[HostResult] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return all(result.ok for result in self.results)
+
+    @property
+    def failed(self) -> list[HostResult]:
+        return [result for result in self.results if not result.ok]
+
+    def exit_codes(self) -> Counter:
+        """Hosts per exit status; ``None`` counts hosts that errored before exiting."""
+        return Counter(result.exit_status for result in self.results)
+
+
+class SSHPool:
+    """One connection per (host, port, username), opened on first use and reused until ``close``."""
+
+    def __init__(self, connect_timeout: float | None = None, known_hosts: str | None = None):
+        self.connect_timeout: float = connect_timeout or getattr(settings, 'SSH_CONNECT_TIMEOUT', 10)
+        known_hosts = known_hosts or getattr(settings, 'SSH_KNOWN_HOSTS', '')
+        if not known_hosts and not getattr(settings, 'SSH_INSECURE_SKIP_HOST_KEY_CHECK', False):
+            raise ImproperlyConfigured(
+                "Set SSH_KNOWN_HOSTS to a known_hosts file, or SSH_INSECURE_SKIP_HOST_KEY_CHECK=True to accept any host key"
+            )
+        # None: asyncssh accepts any host key
+        self.known_hosts: str | None = known_hosts or None
+        self._connections: dict[tuple[str, int, str], object] = {}
+        self._locks: dict[tuple[str, int, str], asyncio.Lock] = {}
+
+    async def connection(self, target: SSHTarget):
+        """The open connection for ``target``, connecting if there is none yet."""
+        asyncssh = _asyncssh()
+        # Concurrent commands for the same host wait for one connect instead of racing
+        lock = self._locks.setdefault(target.key, asyncio.Lock())
+        async with lock:
+            connection = self._connections.get(target.key)
+            if connection is None:
+                options = {
+                    'port': target.port,
+                    'username': target.username,
+                    'known_hosts': self.known_hosts,
+                    'connect_timeout': self.connect_timeout,
+                }
+                if target.ssh_key:
+                    options['client_keys'] = [asyncssh.import_private_key(target.ssh_key)]
+                if target.password:
+                    options['password'] = target.password
+                connection = await asyncssh.connect(target.host, **options)
+                self._connections[target.key] = connection
+            return connection
+
+    def discard(self, target: SSHTarget) -> None:
+        """Forget a broken connection so the next command reconnects."""
+        connection = self._connections.pop(target.key, None)
+        if connection is not None:
+            connection.close()
+
+    async def close(self) -> None:
+        connections, self._connections = list(self._connections.values()), {}
+        for connection in connections:
+            connection.close()
+        for connection in connections:
+            await connection.wait_closed()
+
+    async def __aenter__(self) -> 'SSHPool':
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+
+async def _pump(target: SSHTarget, stream_name: str, reader, on_output: OutputCallback | None) -> None:
+    async for line in reader:
+        # The reader yields '' once at EOF; an empty output line is still '\n'
+        if on_output and line:
+            on_output(target, stream_name, line.rstrip('\n'))
+
+
+async def _run_once(pool: SSHPool, target: SSHTarget, command: str, on_output: OutputCallback | None) -> int | None:
+    connection = await pool.connection(target)
+    async with connection.create_process(command) as process:
+        await asyncio.gather(
+            _pump(target, 'stdout', process.stdout, on_output),
+            _pump(target, 'stderr', process.stderr, on_output),
+        )
+        completed = await process.wait()
+    return completed.exit_status
+
+
+async def run_on_host(
+    pool: SSHPool,
+    target: SSHTarget,
+    command: str,
+    on_output: OutputCallback | None = None,
+    timeout: float | None = None,
+) -> HostResult:
+    """Run ``command`` on one host; errors and timeouts become the result instead of raising."""
+    asyncssh = _asyncssh()
+    timeout = timeout or getattr(settings, 'SSH_COMMAND_TIMEOUT', 300)
+    started = time.monotonic()
+    result = HostResult(target)
+    try:
+        try:
+            result.exit_status = await asyncio.wait_for(_run_once(pool, target, command, on_output), timeout)
+        except (asyncssh.ChannelOpenError, asyncssh.ConnectionLost, BrokenPipeError):
+            # A reused connection went away (host rebooted, idle timeout): reconnect once
+            pool.discard(target)
+            result.exit_status = await asyncio.wait_for(_run_once(pool, target, command, on_output), timeout)
+    except asyncio.TimeoutError:
+        result.error = f"timed out after {timeout}s"
+    except Exception as e:
+        # Connect errors, auth failures, a stored key that doesn't parse (KeyImportError): only this host fails
+        result.error = str(e) or e.__class__.__name__
+    result.seconds = time.monotonic() - started
+    if result.error:
+        logger.warning("SSH command failed", extra={'instance': target.name, 'host': target.host, 'error': result.error})
+    return result
+
+
+async def fan_out(
+    targets: Iterable[SSHTarget],
+    command: str,
+    on_output: OutputCallback | None = None,
+    on_result: Callable[[HostResult], None] | None = None,
+    concurrency: int | None = None,
+    timeout: float | None = None,
+    pool: SSHPool | None = None,
+) -> FanoutResult:
+    """Run ``command`` on every target, at most ``concurrency`` at a time; pass ``pool`` to reuse connections across calls."""
+    concurrency = concurrency or getattr(settings, 'SSH_CONCURRENCY', 50)
+    semaphore = asyncio.Semaphore(concurrency)
+    own_pool = pool is None
+    pool = pool or SSHPool()
+
+    async def run(target: SSHTarget) -> HostResult:
+        async with semaphore:
+            result = await run_on_host(pool, target, command, on_output, timeout)
+        if on_result:
+            on_result(result)
+        return result
+
+    try:
+        results = await asyncio.gather(*(run(target) for target in targets))
+    finally:
+        if own_pool:
+            await pool.close()
+    fanout = FanoutResult(list(results))
+    logger.info("Ran SSH command", extra={
+        'hosts': len(fanout.results),
+        'failed': len(fanout.failed),
+        'exit_codes': {str(code): count for code, count in fanout.exit_codes().items()},
+    })
+    return fanout
+
+
+def ssh_targets(instances: Iterable[EC2Instance]) -> list[SSHTarget]:
+    """Targets for the instances that can be reached: running, with an IP."""
+    return [
+        SSHTarget.from_instance(instance)
+        for instance in instances
+        if instance.status == 'running' and instance.ip_address
+    ]
+
+
+def run_command(instances: Iterable[EC2Instance], command: str, **options) -> FanoutResult:
+    """Synchronous entry point: build the targets from the rows, then fan out on a fresh event loop."""
+    return asyncio.run(fan_out(ssh_targets(instances), command, **options))
@@ -0,0 +1,286 @@
+"""
+Reconcile EC2 inventory from AWS into ``EC2Instance`` rows.
+
+The sync views and the benchmark suite both go through ``sync_accounts`` so
+there is a single code path to measure and optimise.
+
+Users are grouped into AWS accounts by their access key, so an account is
+scanned once however many users share it. Region reads run on a thread pool
+that hands out slots round-robin across accounts, with at most
+``SYNC_ACCOUNT_CONCURRENCY`` regions of one account in flight, so a tenant
+with a large fleet can't starve the others. Database writes stay on the
+calling thread and happen as each region's read completes. Which regions an
+account scans is decided by ``resources.api.regions``.
+
+With ``SYNC_SHARDING`` on, each region is leased (``claim_region``) just
+before it is read and released when it is written, so syncs running in
+several processes or on several nodes work through disjoint regions, and
+``manage.py sync_worker`` on each node adds throughput instead of
+repeating the same scans.
+"""
+import contextvars
+import hashlib
+import logging
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import User
+from InfraSmartRouter.metrics import SYNC_PHASE_DURATION, timed
+from resources.api.clients import DEFAULT_ACCOUNT, get_aws_client
+from resources.api.coalesce import advisory_lock, get_flight
+from resources.api.credentials import role_account_id
+from resources.api.regions import RegionPlan, claim_region, ensure_shards, plan_regions, record_scans, release_region
+from resources.fleet import FleetDiff, InstanceRecord, apply_fleet_diff, diff_fleet, load_rows, read_inventory
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AWSAccount:
+    """One set of AWS credentials and the users that share it."""
+    key: str
+    access_key_id: str | None
+    secret_access_key: str | None
+    owner_id: object
+    user_ids: set = field(default_factory=set)
+    role_arn: str | None = None
+
+    @property
+    def cache_key(self) -> str:
+        """Stable id for the account that can be stored or cached without exposing its key."""
+        if self.key == DEFAULT_ACCOUNT:
+            return DEFAULT_ACCOUNT
+        return hashlib.sha256(self.key.encode()).hexdigest()[:32]
+
+    @property
+    def label(self) -> str:
+        """Account name that is safe to log: the role's account id or the tail of the access key id."""
+        if self.role_arn:
+            return f'role:{role_account_id(self.role_arn)}'
+        return self.key if self.key == DEFAULT_ACCOUNT else f'...{self.key[-4:]}'
+
+    def client(self, service_name: str, region_code: str):
+        return get_aws_client(
+            service_name,
+            region_name=region_code,
+            access_key_id=self.access_key_id,
+            secret_access_key=self.secret_access_key,
+            role_arn=self.role_arn,
+        )
+
+
+def group_accounts(users: Iterable[User], preferred_owner: User | None = None) -> list[AWSAccount]:
+    """
+    Group users by distinct credentials.
+
+    Users with the same ``role_arn`` share an account whatever keys they
+    assume it with; users without keys or role share the ``default`` account
+    (boto3's credential chain). New instances are attributed to
+    ``preferred_owner`` when it belongs to the account, otherwise to its
+    oldest superuser or oldest user.
+    """
+    accounts: dict[str, AWSAccount] = {}
+    for user in sorted(users, key=lambda u: (not u.is_superuser, u.created_at)):
+        if user.access_key_id and user.secret_access_key:
+            access_key_id, secret_access_key = user.access_key_id, user.secret_access_key
+        else:
+            access_key_id, secret_access_key = None, None
+        key = user.role_arn or access_key_id or DEFAULT_ACCOUNT
+        account = accounts.get(key)
+        if account is None:
+            account = accounts[key] = AWSAccount(
+                key, access_key_id, secret_access_key, owner_id=user.pk, role_arn=user.role_arn or None,
+            )
+        account.user_ids.add(user.pk)
+    if preferred_owner is not None:
+        for account in accounts.values():
+            if preferred_owner.pk in account.user_ids:
+                account.owner_id = preferred_owner.pk
+    return list(accounts.values())
+
+
+def describe_region_instances(ec2_client) -> Iterator[dict]:
+    """Yield every instance in the client's region, following pagination."""
+    paginator = ec2_client.get_paginator('describe_instances')
+    for page in paginator.paginate():
+        for reservation in page['Reservations']:
+            yield from reservation['Instances']
+
+
+def read_region(account: AWSAccount, region_code: str) -> list[InstanceRecord]:
+    """
+    Fetch one region of one account; touches AWS only, never the database.
+
+    Syncs running at the same time share one read per region.
+    """
+    def describe() -> list[InstanceRecord]:
+        ec2_client = account.client('ec2', region_code)
+        with timed(SYNC_PHASE_DURATION, phase='describe', region=region_code):
+            return read_inventory(describe_region_instances(ec2_client))
+
+    records, shared = get_flight('describe_instances').do((account.key, region_code), describe)
+    # The leader's diff fills in pk/owner on its records; followers diff their own copies.
+    return [record.copy() for record in records] if shared else records
+
+
+def reconcile_region(account: AWSAccount, region_code: str, records: list[InstanceRecord]) -> FleetDiff:
+    """
+    Write one region's records, keeping owners that belong to the account.
+
+    Concurrent syncs of the same region take turns on an advisory lock, so a
+    second sync diffs against the first one's committed rows and finds
+    nothing to write instead of inserting the same instances again.
+    """
+    with timed(SYNC_PHASE_DURATION, phase='reconcile', region=region_code):
+        with transaction.atomic(), advisory_lock('reconcile', account.cache_key, region_code, transactional=True):
+            diff = diff_fleet(
+                records,
+                load_rows([record.aws_instance_id for record in records]),
+                owner_ids=account.user_ids,
+                default_owner_id=account.owner_id,
+            )
+            apply_fleet_diff(diff, default_owner_id=account.owner_id)
+    logger.info("Synced region", extra={
+        'account': account.label,
+        'region': region_code,
+        'inserted': len(diff.created),
+        'updated': len(diff.updated),
+        'unchanged': len(diff.unchanged),
+        'ignored': len(diff.ignored),
+    })
+    return diff
+
+
+def iter_account_sync(
+    accounts: list[AWSAccount],
+    regions: Iterable[str] | None = None,
+    full: bool = False,
+) -> Iterator[tuple[AWSAccount, str, list[InstanceRecord]]]:
+    """
+    Sync every (account, region) pair, yielding each one's records as soon as it is written.
+
+    Without explicit ``regions`` each account scans the regions
+    ``plan_regions`` picks (all enabled ones when ``full``). A failing region
+    is logged and skipped. With ``SYNC_SHARDING``, regions another worker
+    is syncing, or synced after this sync started, are skipped too: their
+    rows are already being brought up to date.
+    """
+    max_workers = max(1, getattr(settings, 'SYNC_MAX_WORKERS', 8))
+    per_account = max(1, getattr(settings, 'SYNC_ACCOUNT_CONCURRENCY', 4))
+    sharding = getattr(settings, 'SYNC_SHARDING', True)
+    started = timezone.now()
+
+    plans: dict[str, RegionPlan] = {}
+    pending: deque[tuple[AWSAccount, deque[str]]] = deque()
+    for account in accounts:
+        if regions is None:
+            plan = plans[account.key] = plan_regions(account, full=full)
+            account_regions = plan.scan
+            if plan.skipped:
+                logger.info("Skipping idle regions", extra={'account': account.label, 'regions': plan.skipped})
+        else:
+            account_regions = list(regions)
+        if account_regions:
+            if sharding:
+                ensure_shards(account, account_regions)
+            pending.append((account, deque(account_regions)))
+    in_flight: dict[str, int] = {account.key: 0 for account in accounts}
+    futures: dict[Future, tuple[AWSAccount, str]] = {}
+
+    # Leases still held if the caller stops iterating early or a write raises
+    leased: dict[tuple[str, str], AWSAccount] = {}
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sync') as executor:
+            while pending or futures:
+                # Hand out free slots round-robin so every account makes progress.
+                skipped = 0
+                while pending and len(futures) < max_workers and skipped < len(pending):
+                    account, account_regions = pending.popleft()
+                    if in_flight[account.key] >= per_account:
+                        pending.append((account, account_regions))
+                        skipped += 1
+                        continue
+                    skipped = 0
+                    region_code = account_regions.popleft()
+                    if account_regions:
+                        pending.append((account, account_regions))
+                    # Claimed only now, so idle workers elsewhere can take the regions still queued here
+                    if sharding:
+                        if not claim_region(account, region_code, started):
+                            logger.info("Region synced by another worker", extra={'account': account.label, 'region': region_code})
+                            continue
+                        leased[account.key, region_code] = account
+                    in_flight[account.key] += 1
+                    # Copy the context so per-request profiling still sees the AWS calls.
+                    context = contextvars.copy_context()
+                    futures[executor.submit(context.run, read_region, account, region_code)] = (account, region_code)
+
+                if not futures:
+                    continue
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    account, region_code = futures.pop(future)
+                    in_flight[account.key] -= 1
+                    try:
+                        records = future.result()
+                        if not records:
+                            logger.info("No instances found in region", extra={'account': account.label, 'region': region_code})
+                        else:
+                            reconcile_region(account, region_code, records)
+                    except Exception as e:
+                        logger.error("Error syncing instances from region", extra={
+                            'account': account.label,
+                            'region': region_code,
+                            'error': str(e),
+                        })
+                        if sharding:
+                            release_region(account, region_code)
+                            leased.pop((account.key, region_code), None)
+                        continue
+                    # Recorded as each region completes, so a sync stopped part-way keeps its finished scans
+                    if sharding:
+                        release_region(account, region_code, len(records))
+                        leased.pop((account.key, region_code), None)
+                    elif account.key in plans:
+                        record_scans(account, plans[account.key], {region_code: len(records)})
+                    yield account, region_code, records
+    finally:
+        for (_, region_code), account in leased.items():
+            release_region(account, region_code)
+
+
+def sync_accounts(
+    accounts: list[AWSAccount],
+    regions: Iterable[str] | None = None,
+    full: bool = False,
+) -> list[InstanceRecord]:
+    """Sync the given accounts; return every synced record."""
+    synced_instances: list[InstanceRecord] = []
+    for _, _, records in iter_account_sync(accounts, regions, full):
+        synced_instances.extend(records)
+    return synced_instances
+
+
+def user_account(user: User) -> AWSAccount:
+    """The account ``user``'s credentials reach, with every active user sharing it; ``user`` owns its new instances."""
+    users = list(User.objects.filter(is_active=True).exclude(pk=user.pk)) + [user]
+    return next(account for account in group_accounts(users, preferred_owner=user) if user.pk in account.user_ids)
+
+
+def iter_all_regions(user: User, full: bool = False) -> Iterator[tuple[AWSAccount, str, list[InstanceRecord]]]:
+    """``iter_account_sync`` over ``user``'s account only; ``sync_worker`` covers everyone else's."""
+    return iter_account_sync([user_account(user)], full=full)
+
+
+def sync_all_regions(user: User, full: bool = False) -> list[InstanceRecord]:
+    """Sync every region of ``user``'s account; return every synced record."""
+    synced_instances: list[InstanceRecord] = []
+    for _, _, records in iter_all_regions(user, full):
+        synced_instances.extend(records)
+    return synced_instances
@@ -0,0 +1,147 @@
+"""
+Instance tags: set at launch, changed in bulk, filtered through an index.
+
+Every tag sync sees is stored in ``InstanceTag``, one row per (instance,
+key) with a (key, value) index. "Instances tagged X" is therefore an
+indexed join (``tagged``), not a scan of each instance's tag list. The
+Postgres-only alternative, a JSONB column with a GIN index, would not
+work on the SQLite databases tests and benchmarks run on. The ``Name``
+tag is not repeated there: it is ``EC2Instance.name``.
+
+Instances the app launches carry ``launch_tags`` from the start, passed
+as ``TagSpecifications``. These mark them as managed by the app and name
+their owner, so they can be filtered in the EC2 console or with
+``describe_instances`` filters. ``set_instance_tags`` /
+``remove_instance_tags`` change tags on any number of instances with one
+``create_tags`` / ``delete_tags`` call per owner, region and
+``ACTION_BATCH_SIZE`` instances, and update the stored rows to match.
+"""
+import logging
+from collections.abc import Iterable
+
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from accounts.models import User
+from resources.bulk import instance_batches
+from resources.models import EC2Instance, InstanceTag
+
+logger = logging.getLogger(__name__)
+
+NAME_TAG: str = 'Name'
+MANAGED_BY_TAG: str = 'managed-by'
+MANAGED_BY_VALUE: str = 'infrasmartrouter'
+OWNER_TAG: str = 'infrasmartrouter:owner'
+LOOKUP_CHUNK_SIZE: int = 1000
+WRITE_BATCH_SIZE: int = 1000
+
+
+def launch_tags(user: User, name: str | None = None) -> dict[str, str]:
+    """Tags every instance the app launches gets: the managed-by marker, the owner and its name."""
+    tags = {MANAGED_BY_TAG: MANAGED_BY_VALUE, OWNER_TAG: str(user.pk)}
+    if name:
+        tags[NAME_TAG] = name
+    return tags
+
+
+def tags_from_boto(instance: dict) -> dict[str, str]:
+    """The ``Tags`` list of a ``describe_instances``/``run_instances`` instance as a dict, without Name."""
+    return {tag['Key']: tag['Value'] for tag in instance.get('Tags', ()) if tag['Key'] != NAME_TAG}
+
+
+def parse_tag_filter(value: str) -> tuple[str, str | None]:
+    """``key=value`` -> (key, value); a bare ``key`` matches any value."""
+    key, sep, tag_value = value.partition('=')
+    return key, tag_value if sep else None
+
+
+def tagged(queryset: QuerySet, key: str, value: str | None = None) -> QuerySet:
+    """Instances of ``queryset`` that have tag ``key`` (with ``value``, if given), through the tag index."""
+    if key == NAME_TAG:
+        return queryset if value is None else queryset.filter(name=value)
+    tags = InstanceTag.objects.filter(key=key)
+    if value is not None:
+        tags = tags.filter(value=value)
+    return queryset.filter(pk__in=tags.values('instance_id'))
+
+
+def load_tags(instance_ids: Iterable[int]) -> dict[int, dict[str, str]]:
+    """Stored tags by instance pk."""
+    instance_ids = list(instance_ids)
+    tags: dict[int, dict[str, str]] = {}
+    for start in range(0, len(instance_ids), LOOKUP_CHUNK_SIZE):
+        rows = (
+            InstanceTag.objects
+            .filter(instance_id__in=instance_ids[start:start + LOOKUP_CHUNK_SIZE])
+            .order_by()
+            .values_list('instance_id', 'key', 'value')
+        )
+        for instance_id, key, value in rows:
+            tags.setdefault(instance_id, {})[key] = value
+    return tags
+
+
+def replace_tags(tags_by_instance: dict[int, dict[str, str]]) -> None:
+    """Make the stored tags of each instance exactly the given ones (Name excluded)."""
+    if not tags_by_instance:
+        return
+    instance_ids = list(tags_by_instance)
+    for start in range(0, len(instance_ids), LOOKUP_CHUNK_SIZE):
+        InstanceTag.objects.filter(instance_id__in=instance_ids[start:start + LOOKUP_CHUNK_SIZE]).delete()
+    InstanceTag.objects.bulk_create(
+        [
+            InstanceTag(instance_id=instance_id, key=key, value=value)
+            for instance_id, tags in tags_by_instance.items()
+            for key, value in tags.items()
+            if key != NAME_TAG
+        ],
+        batch_size=WRITE_BATCH_SIZE,
+    )
+
+
+def touch(instance_ids: list[int]) -> None:
+    """Bump ``updated_at`` so dashboard ETags and row refreshes see the tag change."""
+    EC2Instance.objects.filter(pk__in=instance_ids).update(updated_at=timezone.now())
+
+
+def set_instance_tags(instance_ids: Iterable[int], tags: dict[str, str]) -> dict[str, int]:
+    """Add or overwrite ``tags`` on the instances, one ``create_tags`` call per batch; return counts by outcome."""
+    from resources.api.api_resources import create_ec2_tags
+
+    if NAME_TAG in tags:
+        raise ValueError("Instance names are unique; set the Name tag per instance, not in bulk")
+    counts = {'succeeded': 0, 'failed': 0}
+    if not tags:
+        return counts
+    for user, region, batch in instance_batches(instance_ids):
+        if not create_ec2_tags(user, list(batch), tags, region):
+            counts['failed'] += len(batch)
+            continue
+        InstanceTag.objects.bulk_create(
+            [InstanceTag(instance_id=pk, key=key, value=value) for pk in batch.values() for key, value in tags.items()],
+            batch_size=WRITE_BATCH_SIZE,
+            update_conflicts=True,
+            unique_fields=['instance_id', 'key'],
+            update_fields=['value'],
+        )
+        touch(list(batch.values()))
+        counts['succeeded'] += len(batch)
+    return counts
+
+
+def remove_instance_tags(instance_ids: Iterable[int], keys: Iterable[str]) -> dict[str, int]:
+    """Remove the tags named ``keys`` from the instances, one ``delete_tags`` call per batch; return counts by outcome."""
+    from resources.api.api_resources import delete_ec2_tags
+
+    keys = list(keys)
+    counts = {'succeeded': 0, 'failed': 0}
+    if not keys:
+        return counts
+    for user, region, batch in instance_batches(instance_ids):
+        if not delete_ec2_tags(user, list(batch), keys, region):
+            counts['failed'] += len(batch)
+            continue
+        InstanceTag.objects.filter(instance_id__in=batch.values(), key__in=keys).delete()
+        touch(list(batch.values()))
+        counts['succeeded'] += len(batch)
+    return counts
@@ -1,3 +1,1056 @@
-from django.test import TestCase
+import asyncio
+import json
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone as dt_timezone
+from importlib import import_module
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import boto3
+from django.apps import apps
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from accounts.models import User
+from resources.api.clients import DEFAULT_ACCOUNT, get_aws_client
+from resources.api.cloudwatch import collect_metrics
+from resources.api.coalesce import COALESCED_CALLS, DatabaseSingleFlight, SingleFlight, get_flight
+from resources.api.credentials import AssumedRole
+from resources.api.regions import claim_region, release_region
+from resources.api.local_aws import LocalAWS, LocalAWSError
+from resources.events import SQSQueue, consume_batch, events_active
+from resources.fleet import apply_fleet_diff, diff_fleet, load_rows, read_inventory
+from resources.api.elb import sync_target_groups
+from resources.archive import all_instances, archive_terminated, find_instance
+from resources.bulk import run_instance_action
+from resources.history import STATE_CODES, record_transitions, rollup_state_history, time_in_state
+from resources.models import ArchivedEC2Instance, EC2Instance, InstanceMetricSample, InstanceSchedule, InstanceStateDaily, InstanceStateEvent, RegionActivity, TargetGroup
+from resources.plan import FleetSpec, apply_plan, plan_fleet
+from resources.scheduler import CPU_METRIC, FakeClock, run_due, run_scheduler
+from resources.ssh import SSHPool, SSHTarget, fan_out
+from resources.sync import describe_region_instances, group_accounts, iter_account_sync, iter_all_regions, sync_all_regions, user_account
+from resources.tags import MANAGED_BY_TAG, MANAGED_BY_VALUE, load_tags, set_instance_tags
+
+try:
+    import asyncssh
+except ImportError:
+    asyncssh = None
+
+
+class LocalAWSTestCase(TestCase):
+    """A superuser and an in-memory AWS with a synced fleet in ``regions``."""
+
+    regions: tuple[str, ...] = ('us-east-1',)
+    fleet_size: int = 6
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_superuser(
+            email='ops@example.com', username='ops', first_name='Ops', last_name='Team', password='x',
+            access_key_id='AKIDLOCAL', secret_access_key='local',
+        )
+        self.aws = LocalAWS(regions=self.regions)
+        self.aws.add_fleet(self.fleet_size, states=('running',))
+        self.enterContext(self.aws)
+        self.prepare_aws()
+        sync_all_regions(self.user, full=True)
+
+    def prepare_aws(self) -> None:
+        """Set up queues, target groups, ... before the first sync."""
+
+    def ec2(self, region: str = 'us-east-1'):
+        return get_aws_client('ec2', region_name=region)
+
+
+class FleetDiffTests(LocalAWSTestCase):
+    def test_diff_and_apply(self):
+        stopped, moved, terminated, untouched = EC2Instance.objects.order_by('pk')[:4]
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        EC2Instance.objects.update(updated_at=an_hour_ago)
+        fleet = self.aws.instances['us-east-1']
+        fleet[stopped.aws_instance_id]['State'] = {'Code': 80, 'Name': 'stopped'}
+        fleet[moved.aws_instance_id]['PublicIpAddress'] = '192.0.2.10'
+        fleet[terminated.aws_instance_id]['State'] = {'Code': 48, 'Name': 'terminated'}
+        new = self.aws.add_instance('us-east-1', name='new')
+        # Gone before the app ever saw it
+        self.aws.add_instance('us-east-1', name='gone', state='terminated')
+        history = InstanceStateEvent.objects.count()
+
+        records = read_inventory(describe_region_instances(self.ec2()))
+        diff = diff_fleet(records, load_rows([record.aws_instance_id for record in records]), default_owner_id=self.user.pk)
+        apply_fleet_diff(diff, default_owner_id=self.user.pk)
+
+        self.assertEqual([record.aws_instance_id for record in diff.created], [new])
+        self.assertEqual([record.name for record in diff.ignored], ['gone'])
+        self.assertEqual({record.pk for record in diff.updated}, {stopped.pk, moved.pk, terminated.pk})
+        self.assertEqual({record.pk for record in diff.state_changed}, {stopped.pk, terminated.pk})
+        self.assertFalse(EC2Instance.objects.filter(name='gone').exists())
+
+        rows = EC2Instance.objects.in_bulk([stopped.pk, moved.pk, terminated.pk, untouched.pk])
+        self.assertEqual(rows[stopped.pk].status, 'stopped')
+        self.assertEqual(rows[moved.pk].ip_address, '192.0.2.10')
+        # bulk_update skips auto_now, so updated_at is written explicitly
+        self.assertGreater(rows[moved.pk].updated_at, an_hour_ago)
+        self.assertEqual(rows[untouched.pk].updated_at, an_hour_ago)
+        self.assertIsNotNone(rows[terminated.pk].terminated_at)
+        self.assertIsNone(rows[stopped.pk].terminated_at)
+        # The new instance and two state changes
+        self.assertEqual(InstanceStateEvent.objects.count() - history, 3)
+
+        # Nothing changed since: nothing is written
+        again = diff_fleet(records, load_rows([record.aws_instance_id for record in records]))
+        self.assertEqual((len(again.created), len(again.updated)), (0, 0))
+
+
+class AccountTests(LocalAWSTestCase):
+    def add_user(self, name: str, **fields) -> User:
+        return User.objects.create_user(email=f'{name}@example.com', username=name, **fields)
+
+    def test_users_are_grouped_by_credentials(self):
+        teammate = self.add_user('teammate', access_key_id='AKIDLOCAL', secret_access_key='local')
+        other = self.add_user('other', access_key_id='AKIDOTHER', secret_access_key='other')
+        role = 'arn:aws:iam::123456789012:role/ops'
+        # One role is one account, whatever keys assume it
+        assumer_a = self.add_user('assumer-a', access_key_id='AKIDA', secret_access_key='a', role_arn=role)
+        assumer_b = self.add_user('assumer-b', role_arn=role)
+        keyless = self.add_user('keyless')
+
+        accounts = {
+            account.key: account
+            for account in group_accounts([teammate, other, assumer_a, assumer_b, keyless, self.user])
+        }
+
+        self.assertEqual(set(accounts), {'AKIDLOCAL', 'AKIDOTHER', role, DEFAULT_ACCOUNT})
+        self.assertEqual(accounts['AKIDLOCAL'].user_ids, {self.user.pk, teammate.pk})
+        # The superuser owns new instances unless the syncing user is in the account
+        self.assertEqual(accounts['AKIDLOCAL'].owner_id, self.user.pk)
+        self.assertEqual(accounts[role].user_ids, {assumer_a.pk, assumer_b.pk})
+        self.assertEqual(accounts[DEFAULT_ACCOUNT].user_ids, {keyless.pk})
+        self.assertNotEqual(accounts['AKIDLOCAL'].cache_key, accounts['AKIDOTHER'].cache_key)
+        self.assertNotIn('AKIDLOCAL', accounts['AKIDLOCAL'].cache_key + accounts['AKIDLOCAL'].label)
+
+    def test_sync_attributes_new_instances_to_the_syncing_user(self):
+        teammate = self.add_user('teammate', access_key_id='AKIDLOCAL', secret_access_key='local')
+        self.add_user('other', access_key_id='AKIDOTHER', secret_access_key='other')
+        account = user_account(teammate)
+        self.assertEqual((account.key, account.owner_id), ('AKIDLOCAL', teammate.pk))
+
+        new = self.aws.add_instance('us-east-1', name='new')
+        sync_all_regions(teammate, full=True)
+
+        self.assertEqual(EC2Instance.objects.get(aws_instance_id=new).creating_user, teammate)
+        # Rows already owned by someone in the account keep their owner
+        self.assertFalse(EC2Instance.objects.exclude(aws_instance_id=new).exclude(creating_user=self.user).exists())
+
+
+@override_settings(AWS_ROLE_SESSION_SECONDS=3600, AWS_CREDENTIAL_REFRESH_MARGIN=1200)
+class AssumedRoleTests(SimpleTestCase):
+    role_arn = 'arn:aws:iam::123456789012:role/ops'
+
+    def setUp(self):
+        self.aws = self.enterContext(LocalAWS(regions=('us-east-1',)))
+        # Record refresh times instead of starting the refresher thread
+        self.refresher = self.enterContext(mock.patch('resources.api.credentials.get_refresher')).return_value
+        self.role = AssumedRole(self.role_arn, 'AKIDLOCAL', 'local')
+
+    def refresh_in(self) -> float:
+        """Seconds from now until the last scheduled background refresh."""
+        (role, at), _ = self.refresher.schedule.call_args
+        self.assertIs(role, self.role)
+        return at - time.time()
+
+    def test_refresh_is_scheduled_the_margin_before_expiry(self):
+        self.role.fetch()
+        self.assertAlmostEqual(self.refresh_in(), 3600 - 1200, delta=5)
+
+    @override_settings(AWS_ROLE_SESSION_SECONDS=900)
+    def test_short_sessions_refresh_half_way(self):
+        self.role.fetch()
+        self.assertAlmostEqual(self.refresh_in(), 450, delta=5)
+
+    def test_callers_only_wait_inside_botocores_refresh_window(self):
+        first = self.role.fetch()
+        self.assertIs(self.role.fetch(), first)
+        self.assertEqual(self.aws.calls['sts', 'AssumeRole'], 1)
+
+        # The refresher fell behind: the next caller assumes the role inline
+        self.role._expires_at = datetime.now(dt_timezone.utc) + timedelta(minutes=10)
+        self.assertNotEqual(self.role.fetch()['access_key'], first['access_key'])
+        self.assertEqual(self.aws.calls['sts', 'AssumeRole'], 2)
+
+    def test_clients_pick_up_refreshed_credentials(self):
+        self.aws.add_instance('us-east-1')
+        client = boto3.Session(botocore_session=self.role.session).client('ec2', region_name='us-east-1')
+        self.aws.attach(client)
+        client.describe_instances()
+        before = self.role.credentials.get_frozen_credentials().access_key
+
+        self.role.refresh()
+        # Forced past botocore's own window so it asks the role again
+        self.role.credentials._expiry_time = datetime.now(dt_timezone.utc) + timedelta(minutes=10)
+        client.describe_instances()
+
+        self.assertNotEqual(self.role.credentials.get_frozen_credentials().access_key, before)
+        # The background refresh's credentials, without another AssumeRole
+        self.assertEqual(self.aws.calls['sts', 'AssumeRole'], 2)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def wait_for_followers(self, flight: SingleFlight, count: int) -> None:
+        deadline = time.monotonic() + 5
+        while COALESCED_CALLS.value(flight=flight.name, role='follower') < count:
+            self.assertLess(time.monotonic(), deadline, "followers never joined")
+            time.sleep(0.001)
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight('test-threads')
+        release = threading.Event()
+        calls = []
+
+        def describe():
+            calls.append(1)
+            release.wait(5)
+            return {'State': 'running'}
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [executor.submit(flight.do, 'i-1', describe) for _ in range(4)]
+            self.wait_for_followers(flight, 3)
+            release.set()
+            results = [future.result() for future in futures]
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False, True, True, True])
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+        # Done flights are forgotten: the next caller calls again
+        flight.do('i-1', describe)
+        self.assertEqual(len(calls), 2)
+
+    def test_error_reaches_every_caller(self):
+        flight = SingleFlight('test-errors')
+        release = threading.Event()
+
+        def fail():
+            release.wait(5)
+            raise LocalAWSError('Throttling')
+
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            futures = [executor.submit(flight.do, 'i-1', fail) for _ in range(2)]
+            self.wait_for_followers(flight, 1)
+            release.set()
+            for future in futures:
+                with self.assertRaises(LocalAWSError):
+                    future.result()
+
+    async def test_async_followers_await_the_leader(self):
+        flight = SingleFlight('test-async')
+        release = threading.Event()
+        calls = []
+
+        def describe():
+            calls.append(1)
+            release.wait(5)
+            return 'running'
+
+        tasks = [asyncio.create_task(flight.do_async('i-1', describe)) for _ in range(3)]
+        # Every task joins before its first await
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(results), [('running', False), ('running', True), ('running', True)])
+
+
+@override_settings(AWS_COALESCE_TTL=60)
+class DatabaseSingleFlightTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_result_published_by_another_worker_is_reused(self):
+        # Two flight objects stand in for two workers sharing the cache
+        worker_a, worker_b = DatabaseSingleFlight('test-database'), DatabaseSingleFlight('test-database')
+        self.assertEqual(worker_a.do('i-1', lambda: {'State': 'running'}), ({'State': 'running'}, False))
+        result, _ = worker_b.do('i-1', lambda: self.fail("called AWS again"))
+        self.assertEqual(result, {'State': 'running'})
+        self.assertEqual(COALESCED_CALLS.value(flight='test-database', role='remote_follower'), 1)
+
+    def test_get_flight_follows_the_backend_setting(self):
+        with self.settings(AWS_COALESCE_BACKEND='database'):
+            self.assertIsInstance(get_flight('test-backend-database'), DatabaseSingleFlight)
+        self.assertNotIsInstance(get_flight('test-backend-local'), DatabaseSingleFlight)
+
+
+class ConditionalResponseTests(LocalAWSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+        self.instance = EC2Instance.objects.first()
+
+    def test_unchanged_dashboard_is_not_modified(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertEqual(self.client.get('/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        self.instance.save()
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_status_poll_is_not_modified_until_the_instance_changes(self):
+        url = f'/instances/{self.instance.pk}/status/'
+        response = self.client.get(url)
+        self.assertEqual(response.json()['status'], 'running')
+        etag = response['ETag']
+        # Still described, so a change in AWS is seen; nothing changed here
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.ec2().stop_instances(InstanceIds=[self.instance.aws_instance_id])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'stopped')
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class SyncStreamTests(LocalAWSTestCase):
+    regions = ('us-east-1', 'eu-west-1')
+
+    def stream(self) -> list[dict]:
+        self.client.force_login(self.user)
+        response = self.client.post('/sync-instances/', {'full': '1'}, HTTP_ACCEPT='application/x-ndjson')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        # Not gzipped, so lines reach the browser as they are produced
+        self.assertEqual(response['Content-Encoding'], 'identity')
+        return [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+    def test_one_line_per_region_then_a_summary(self):
+        lines = self.stream()
+        regions, summary = lines[:-1], lines[-1]
+        self.assertEqual(sorted(line['region'] for line in regions), ['eu-west-1', 'us-east-1'])
+        self.assertEqual(sum(line['count'] for line in regions), self.fleet_size)
+        self.assertEqual(
+            {instance['aws_instance_id'] for line in regions for instance in line['instances']},
+            set(EC2Instance.objects.values_list('aws_instance_id', flat=True)),
+        )
+        self.assertEqual(summary, {'type': 'summary', 'success': True, 'synced_count': self.fleet_size, 'regions': 2, 'accounts': 1})
+
+    def test_failure_ends_the_stream_with_a_failed_summary(self):
+        def fail_after_first_region(user, full=False):
+            yield from list(iter_all_regions(user, full=full))[:1]
+            raise RuntimeError('credentials expired')
+
+        with mock.patch('InfraSmartRouter.views.iter_all_regions', fail_after_first_region):
+            lines = self.stream()
+
+        self.assertEqual([line['type'] for line in lines], ['region', 'summary'])
+        self.assertEqual(lines[-1]['success'], False)
+        self.assertEqual(lines[-1]['error'], 'credentials expired')
+        self.assertEqual(lines[-1]['synced_count'], lines[0]['count'])
+
+
+class InstanceRowsTests(LocalAWSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.user)
+
+    def test_rows_changed_since(self):
+        an_hour_ago = timezone.now() - timedelta(hours=1)
+        EC2Instance.objects.update(updated_at=an_hour_ago)
+        changed = EC2Instance.objects.first()
+        changed.save()
+
+        response = self.client.get('/instances/rows/', {'since': an_hour_ago.timestamp() + 1})
+
+        self.assertEqual(response.content.decode().count('class="instance-card"'), 1)
+        self.assertContains(response, f'data-instance-id="{changed.pk}"')
+        changed.refresh_from_db()
+        self.assertAlmostEqual(float(response['X-Fleet-Updated']), changed.updated_at.timestamp(), places=5)
+
+    def test_bad_since_is_rejected(self):
+        for since in ('1e20', '-1e20', 'inf', 'nan', 'yesterday'):
+            self.assertEqual(self.client.get('/instances/rows/', {'since': since}).status_code, 400, since)
+        self.assertEqual(self.client.get('/instances/rows/').status_code, 400)
+
+
+class BulkActionTests(LocalAWSTestCase):
+    regions = ('us-east-1', 'eu-west-1')
+    fleet_size = 10
+
+    def setUp(self):
+        super().setUp()
+        self.instances = list(EC2Instance.objects.order_by('pk'))
+
+    def test_admin_action_runs_in_batches_after_commit(self):
+        self.client.force_login(self.user)
+        # Jobs run inline instead of on the worker pool's own connection
+        executor = self.enterContext(mock.patch('resources.bulk.get_executor')).return_value
+        executor.submit.side_effect = lambda fn, *args: fn(*args)
+
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            response = self.client.post('/admin/resources/ec2instance/', {
+                'action': 'stop_instances',
+                '_selected_action': [instance.pk for instance in self.instances],
+            })
+            self.assertEqual(response.status_code, 302)
+            # Nothing ran while the request's transaction was open
+            self.assertEqual(self.aws.calls['ec2', 'StopInstances'], 0)
+        for callback in callbacks:
+            callback()
+
+        # One call per region for all ten
+        self.assertEqual(self.aws.calls['ec2', 'StopInstances'], 2)
+        self.assertEqual(set(EC2Instance.objects.values_list('status', flat=True)), {'stopped'})
+
+    @mock.patch('resources.bulk.ACTION_BATCH_SIZE', 2)
+    def test_calls_are_batched(self):
+        east = [instance.pk for instance in self.instances if instance.region == 'us-east-1']
+        self.assertEqual(run_instance_action('stop', east), {'succeeded': 5, 'failed': 0})
+        self.assertEqual(self.aws.calls['ec2', 'StopInstances'], 3)
+
+    def test_refresh_drops_ids_aws_no_longer_knows(self):
+        gone, no_ip, *rest = [instance for instance in self.instances if instance.region == 'us-east-1']
+        fleet = self.aws.instances['us-east-1']
+        del fleet[gone.aws_instance_id]
+        del fleet[no_ip.aws_instance_id]['PublicIpAddress']
+        fleet[rest[0].aws_instance_id]['State'] = {'Code': 80, 'Name': 'stopped'}
+        self.aws.calls.clear()
+
+        run_instance_action('refresh', [instance.pk for instance in self.instances if instance.region == 'us-east-1'])
+
+        # Retried once without the missing id instead of failing the batch
+        self.assertEqual(self.aws.calls['ec2', 'DescribeInstances'], 2)
+        self.assertEqual(EC2Instance.objects.get(pk=rest[0].pk).status, 'stopped')
+        # No public IP reported: the stored one stays
+        self.assertEqual(EC2Instance.objects.get(pk=no_ip.pk).ip_address, no_ip.ip_address)
+
+
+@override_settings(CLOUDWATCH_PERIOD_SECONDS=300, CLOUDWATCH_LOOKBACK_SECONDS=900)
+class MetricCollectionTests(LocalAWSTestCase):
+    # 130 instances x 4 metrics: one call of 500 queries and one of 20
+    fleet_size = 130
+
+    def test_queries_are_batched_500_per_call(self):
+        sizes = []
+        get_metric_data = self.aws._handlers['cloudwatch', 'GetMetricData']
+
+        def recording(region, params):
+            sizes.append(len(params['MetricDataQueries']))
+            return get_metric_data(region, params)
+
+        self.aws.register_handler('cloudwatch', 'GetMetricData', recording)
+        account = user_account(self.user)
+
+        written = collect_metrics([account])
+
+        self.assertEqual(sizes, [500, 20])
+        # Three whole periods of four metrics per instance
+        self.assertEqual(written, self.fleet_size * 4 * 3)
+        self.assertEqual(InstanceMetricSample.objects.count(), written)
+        # Collecting the same periods again updates them in place
+        collect_metrics([account])
+        self.assertEqual(InstanceMetricSample.objects.count(), written)
+
+    def test_metrics_endpoint_rejects_bad_ranges(self):
+        instance = EC2Instance.objects.first()
+        collect_metrics([user_account(self.user)])
+        self.client.force_login(self.user)
+        url = f'/instances/{instance.pk}/metrics/'
+
+        series = self.client.get(url, {'hours': '1'}).json()['series']
+        self.assertEqual(len(series['cpu_utilization']), 3)
+        for hours in ('nan', 'inf', '0', '-1', 'soon'):
+            self.assertEqual(self.client.get(url, {'hours': hours}).status_code, 400, hours)
+
+
+class CreateInstanceTests(LocalAWSTestCase):
+    regions = ('us-east-1', 'eu-west-1')
+
+    def create(self, region: str) -> EC2Instance:
+        self.client.force_login(self.user)
+        response = self.client.post(
+            '/instances/create/', {'name': f'web-{region}', 'region': region}, content_type='application/json',
+        )
+        self.assertTrue(response.json()['success'])
+        return EC2Instance.objects.get(pk=response.json()['instance_id'])
+
+    def test_launches_in_the_instances_region_with_that_regions_ami(self):
+        instance = self.create('eu-west-1')
+        launched = self.aws.instances['eu-west-1'][instance.aws_instance_id]
+        self.assertNotEqual(launched['ImageId'], EC2Instance.AMI_ID)
+        self.assertNotIn(instance.aws_instance_id, self.aws.instances['us-east-1'])
+
+        # Managed where it was launched
+        self.assertTrue(instance.stop_instance())
+        self.assertEqual(launched['State']['Name'], 'stopped')
+
+    def test_us_east_1_keeps_the_pinned_ami(self):
+        instance = self.create('us-east-1')
+        self.assertEqual(self.aws.instances['us-east-1'][instance.aws_instance_id]['ImageId'], EC2Instance.AMI_ID)
+        self.assertEqual(self.aws.calls['ssm', 'GetParameter'], 0)
+
+
+class ArchiveTests(LocalAWSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.instances = list(EC2Instance.objects.order_by('pk'))
+
+    def terminate(self, instances: list[EC2Instance], days_ago: int) -> None:
+        EC2Instance.objects.filter(pk__in=[i.pk for i in instances]).update(
+            status='terminated', terminated_at=timezone.now() - timedelta(days=days_ago),
+        )
+
+    def test_moves_only_instances_terminated_before_the_cutoff(self):
+        old, recent = self.instances[:3], self.instances[3:4]
+        self.terminate(old, days_ago=30)
+        self.terminate(recent, days_ago=1)
+
+        self.assertEqual(archive_terminated(batch_size=2), 3)
+
+        self.assertEqual(set(ArchivedEC2Instance.objects.values_list('pk', flat=True)), {i.pk for i in old})
+        self.assertFalse(EC2Instance.objects.filter(pk__in=[i.pk for i in old]).exists())
+        self.assertTrue(EC2Instance.objects.filter(pk=recent[0].pk).exists())
+        # Nothing left to move
+        self.assertEqual(archive_terminated(), 0)
+
+    def test_lookups_span_both_tables(self):
+        archived, live = self.instances[:2]
+        self.terminate([archived], days_ago=30)
+        archive_terminated()
+
+        rows = {row['id']: row['archived'] for row in all_instances(region='us-east-1')}
+        self.assertEqual(len(rows), self.fleet_size)
+        self.assertEqual((rows[archived.pk], rows[live.pk]), (True, False))
+
+        self.assertIsInstance(find_instance(pk=archived.pk), ArchivedEC2Instance)
+        self.assertEqual(find_instance(aws_instance_id=archived.aws_instance_id).pk, archived.pk)
+        self.assertIsInstance(find_instance(pk=live.pk), EC2Instance)
+        self.assertIsNone(find_instance(aws_instance_id='i-unknown'))
+        with self.assertRaises(ValueError):
+            find_instance()
+
+    def test_migration_backfills_terminated_at_from_updated_at(self):
+        backfill_terminated_at = import_module('resources.migrations.0007_archivedec2instance_terminated_at').backfill_terminated_at
+        terminated, running = self.instances[:2]
+        seen_at = timezone.now() - timedelta(days=3)
+        EC2Instance.objects.filter(pk=terminated.pk).update(status='terminated', terminated_at=None, updated_at=seen_at)
+
+        backfill_terminated_at(apps, None)
+
+        self.assertEqual(EC2Instance.objects.get(pk=terminated.pk).terminated_at, seen_at)
+        self.assertIsNone(EC2Instance.objects.get(pk=running.pk).terminated_at)
+
+
+@override_settings(STATE_HISTORY_RAW_DAYS=35)
+class StateHistoryTests(TestCase):
+    instance_id = 1
+
+    def at(self, day: str, hour: int = 0) -> datetime:
+        return datetime.fromisoformat(day).replace(hour=hour, tzinfo=dt_timezone.utc)
+
+    def record(self, *events: tuple[str, datetime]) -> None:
+        for state, at in events:
+            record_transitions([(self.instance_id, state)], at=at)
+
+    def test_time_in_state_across_a_day_boundary(self):
+        self.record(('running', self.at('2026-10-01', 22)), ('stopped', self.at('2026-10-02', 2)))
+        # The state in effect at the start counts from the start
+        self.assertEqual(
+            time_in_state(self.instance_id, self.at('2026-10-01', 23), self.at('2026-10-02', 3)),
+            {'running': 3 * 3600, 'stopped': 3600},
+        )
+
+    def test_rollup_keeps_totals_and_is_idempotent(self):
+        # Cutoff: midnight 2026-09-14, 35 days before now
+        now = self.at('2026-10-19', 12)
+        self.record(
+            ('running', self.at('2026-09-10', 12)),
+            ('stopped', self.at('2026-09-12', 6)),
+            # Still running at the cutoff: carried over by an anchor
+            ('running', self.at('2026-09-13')),
+            ('stopped', self.at('2026-09-20')),
+        )
+        start, end = self.at('2026-09-10'), self.at('2026-09-21')
+        expected = {'running': (42 + 7 * 24) * 3600, 'stopped': (18 + 24) * 3600}
+        self.assertEqual(time_in_state(self.instance_id, start, end), expected)
+
+        self.assertEqual(rollup_state_history(now), 3)
+        self.assertEqual(
+            list(InstanceStateEvent.objects.order_by('at').values_list('state', 'at')),
+            [(STATE_CODES['running'], self.at('2026-09-14')), (STATE_CODES['stopped'], self.at('2026-09-20'))],
+        )
+        self.assertEqual(time_in_state(self.instance_id, start, end), expected)
+
+        # Same cutoff: nothing left to fold
+        days = InstanceStateDaily.objects.count()
+        self.assertEqual(rollup_state_history(now), 0)
+        self.assertEqual(InstanceStateDaily.objects.count(), days)
+        # A day later the anchor itself is folded and moves to the new cutoff
+        self.assertEqual(rollup_state_history(now + timedelta(days=1)), 1)
+        self.assertEqual(time_in_state(self.instance_id, start, end), expected)
+
+
+class InstanceEventsTests(LocalAWSTestCase):
+    regions = ('us-east-1', 'eu-west-1')
+
+    def prepare_aws(self):
+        self.queue_url = self.aws.create_queue('instance-events')
+        self.aws.route_state_changes(self.queue_url)
+        self.enterContext(override_settings(INSTANCE_EVENTS_QUEUE_URL=self.queue_url))
+
+    def stop(self, count: int) -> list[EC2Instance]:
+        instances = list(EC2Instance.objects.filter(region='us-east-1')[:count])
+        self.ec2().stop_instances(InstanceIds=[instance.aws_instance_id for instance in instances])
+        return instances
+
+    def test_consume_batch_applies_changes_and_deletes_messages(self):
+        stopped = self.stop(2)
+        history = InstanceStateEvent.objects.count()
+        self.assertFalse(events_active('us-east-1'))
+        counts = consume_batch(SQSQueue(self.queue_url), max_wait=0)
+
+        self.assertEqual(counts['applied'], 2)
+        self.assertEqual(len(self.aws.queues[self.queue_url]) + len(self.aws.in_flight), 0)
+        self.assertEqual(
+            set(EC2Instance.objects.filter(pk__in=[i.pk for i in stopped]).values_list('status', flat=True)),
+            {'stopped'},
+        )
+        self.assertEqual(InstanceStateEvent.objects.count() - history, 2)
+        # Only the queue's region is trusted
+        self.assertTrue(events_active('us-east-1'))
+        self.assertFalse(events_active('eu-west-1'))
+
+    def test_unrelated_write_does_not_make_an_event_stale(self):
+        instance = EC2Instance.objects.filter(region='us-east-1').first()
+        # First seen running by a sync ten minutes ago
+        InstanceStateEvent.objects.filter(instance_id=instance.pk).update(at=timezone.now() - timedelta(minutes=10))
+        stopped_at = timezone.now() - timedelta(minutes=1)
+        self.aws.instances['us-east-1'][instance.aws_instance_id]['State'] = {'Code': 80, 'Name': 'stopped'}
+        self.aws.publish_state_change('us-east-1', instance.aws_instance_id, 'stopped', at=stopped_at)
+        # A tag change lands between the stop and its delivery
+        set_instance_tags([instance.pk], {'env': 'prod'})
+
+        counts = consume_batch(SQSQueue(self.queue_url), max_wait=0)
+
+        self.assertEqual(counts['applied'], 1)
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, 'stopped')
+
+    def test_event_older_than_the_last_transition_is_stale(self):
+        instance = EC2Instance.objects.filter(region='us-east-1').first()
+        # The app stopped and started it since the event: its history is newer
+        self.assertTrue(instance.stop_instance())
+        self.assertTrue(instance.start_instance())
+        self.aws.queues[self.queue_url].clear()
+        self.aws.publish_state_change('us-east-1', instance.aws_instance_id, 'stopped', at=timezone.now() - timedelta(minutes=1))
+
+        counts = consume_batch(SQSQueue(self.queue_url), max_wait=0)
+
+        self.assertEqual(counts['stale'], 1)
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, 'running')
+
+    def test_failed_batch_is_redelivered_without_heartbeat(self):
+        self.stop(2)
+        with mock.patch('resources.events.apply_state_changes', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                consume_batch(SQSQueue(self.queue_url), max_wait=0)
+        # Received but not deleted: SQS delivers them again after the visibility timeout
+        self.assertEqual(len(self.aws.in_flight), 2)
+        self.assertFalse(events_active('us-east-1'))
+
+    def test_started_instance_ip_is_fetched_again(self):
+        instance = self.stop(1)[0]
+        queue = SQSQueue(self.queue_url)
+        consume_batch(queue, max_wait=0)
+        self.ec2().start_instances(InstanceIds=[instance.aws_instance_id])
+        consume_batch(queue, max_wait=0)
+        instance.refresh_from_db()
+        self.assertEqual(instance.status, 'running')
+        self.assertIsNone(instance.ip_address)
+
+        self.client.force_login(self.user)
+        response = self.client.get(f'/instances/{instance.pk}/status/')
+        self.assertEqual(response.json()['ip_address'], self.aws.instances['us-east-1'][instance.aws_instance_id]['PublicIpAddress'])
+
+
+class FleetPlanTests(LocalAWSTestCase):
+    regions = ('us-east-1', 'eu-west-1')
+    fleet_size = 0
+
+    def prepare_aws(self):
+        add = self.aws.add_instance
+        self.web = {
+            'web-1': add('us-east-1', name='web-1', instance_type='t3.micro'),
+            'web-2': add('us-east-1', name='web-2', instance_type='t3.micro'),
+            'web-3': add('us-east-1', name='web-3', instance_type='t2.micro'),
+            'web-4': add('us-east-1', name='web-4', instance_type='t3.micro', state='stopped'),
+            'web-5': add('eu-west-1', name='web-5', instance_type='t3.micro'),
+        }
+
+    def setUp(self):
+        super().setUp()
+        # Long gone, but its name is still taken
+        EC2Instance.objects.create(name='web-8', creating_user=self.user, username='ubuntu', status='terminated', aws_instance_id='i-gone')
+
+    def plan(self, *groups: dict):
+        return plan_fleet(FleetSpec.from_dict({'groups': list(groups)}), self.user)
+
+    def actions(self, plan) -> list[tuple[str, str, list[str]]]:
+        """(kind, region, names) per action, ids turned back into names."""
+        names = {aws_id: name for name, aws_id in self.web.items()}
+        return sorted(
+            (action.kind, action.region, action.names or sorted(names[aws_id] for aws_id in action.instances))
+            for action in plan.actions
+        )
+
+    def record_calls(self) -> list[str]:
+        """Names of the EC2 writes made from now on, in the order they were made."""
+        calls = []
+        for operation in ('RunInstances', 'StartInstances', 'StopInstances', 'TerminateInstances'):
+            def handler(region, params, operation=operation, answer=self.aws._handlers['ec2', operation]):
+                calls.append(operation)
+                return answer(region, params)
+            self.aws.register_handler('ec2', operation, handler)
+        return calls
+
+    def test_surplus_and_mismatched_members_are_terminated(self):
+        plan = self.plan({'name': 'web', 'count': 1, 'instance_type': 't3.micro'})
+        self.assertEqual(self.actions(plan), [
+            # web-1 is kept: running members go before stopped ones, then the lowest names
+            ('terminate', 'eu-west-1', ['web-5']),
+            ('terminate', 'us-east-1', ['web-2', 'web-3', 'web-4']),
+        ])
+        self.assertEqual(plan.unchanged, 1)
+
+    def test_shortfall_is_named_after_the_highest_taken_index(self):
+        plan = self.plan({'name': 'web', 'count': 5, 'instance_type': 't3.micro'})
+        self.assertEqual(self.actions(plan), [
+            ('launch', 'us-east-1', ['web-9', 'web-10']),
+            ('start', 'us-east-1', ['web-4']),
+            ('terminate', 'eu-west-1', ['web-5']),
+            ('terminate', 'us-east-1', ['web-3']),
+        ])
+
+    @mock.patch('resources.plan.ACTION_BATCH_SIZE', 2)
+    def test_actions_are_batched(self):
+        plan = self.plan({'name': 'web', 'count': 0}, {'name': 'batch', 'count': 5, 'region': 'eu-west-1'})
+        self.assertEqual(self.actions(plan), [
+            ('launch', 'eu-west-1', ['batch-1', 'batch-2']),
+            ('launch', 'eu-west-1', ['batch-3', 'batch-4']),
+            ('launch', 'eu-west-1', ['batch-5']),
+            ('terminate', 'eu-west-1', ['web-5']),
+            ('terminate', 'us-east-1', ['web-1', 'web-2']),
+            ('terminate', 'us-east-1', ['web-3', 'web-4']),
+        ])
+
+    def test_apply_removes_before_adding(self):
+        calls = self.record_calls()
+        plan = self.plan({'name': 'web', 'count': 3, 'instance_type': 't3.micro'}, {'name': 'batch', 'count': 1, 'region': 'eu-west-1'})
+
+        report = apply_plan(plan)
+
+        self.assertTrue(report.ok)
+        self.assertEqual(sorted(calls[:2]), ['TerminateInstances', 'TerminateInstances'])
+        self.assertEqual(sorted(calls[2:4]), ['RunInstances', 'StartInstances'])
+        statuses = dict(EC2Instance.objects.values_list('name', 'status'))
+        self.assertEqual([statuses[name] for name in ('web-3', 'web-4', 'web-5')], ['terminated', 'running', 'terminated'])
+        batch = EC2Instance.objects.get(name='batch-1')
+        # Launched with eu-west-1's own image
+        launched = self.aws.instances['eu-west-1'][batch.aws_instance_id]
+        self.assertEqual(launched['ImageId'], EC2Instance.ami_for_region(self.user, 'eu-west-1'))
+        self.assertNotEqual(launched['ImageId'], EC2Instance.AMI_ID)
+
+    def test_failed_phase_skips_the_rest(self):
+        calls = self.record_calls()
+
+        def unavailable(region, params):
+            raise LocalAWSError('Unavailable', 'Service unavailable', 503)
+
+        self.aws.register_handler('ec2', 'TerminateInstances', unavailable)
+        plan = self.plan({'name': 'web', 'count': 4, 'instance_type': 't3.micro'})
+
+        report = apply_plan(plan)
+
+        self.assertFalse(report.ok)
+        self.assertEqual(sorted(action.kind for action in report.skipped), ['launch', 'start'])
+        self.assertNotIn('RunInstances', calls)
+        self.assertNotIn('StartInstances', calls)
+        self.assertEqual(EC2Instance.objects.get(name='web-4').status, 'stopped')
+
+
+
+@override_settings(SCHEDULER_RETRY_SECONDS=300, SCHEDULER_IDLE_CHECK_SECONDS=300, CLOUDWATCH_PERIOD_SECONDS=300)
+class SchedulerTests(LocalAWSTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock(timezone.now())
+        self.start = self.clock.now()
+        self.instances = list(EC2Instance.objects.order_by('pk'))
+
+    def schedule(self, instance: EC2Instance, **fields) -> InstanceSchedule:
+        schedule = InstanceSchedule(instance=instance, **fields)
+        # Due from the fake clock's start, not from when save() runs
+        schedule.next_due_at = schedule.next_due(self.start)
+        InstanceSchedule.objects.bulk_create([schedule])
+        return schedule
+
+    def cpu(self, instance: EC2Instance, percent: float, minutes: int = 35) -> None:
+        InstanceMetricSample.objects.bulk_create([
+            InstanceMetricSample(instance_id=instance.pk, metric=CPU_METRIC, at=self.start - timedelta(minutes=offset), value=percent)
+            for offset in range(0, minutes + 1, 5)
+        ])
+
+    def status(self, instance: EC2Instance) -> str:
+        return EC2Instance.objects.values_list('status', flat=True).get(pk=instance.pk)
+
+    def test_deadline_stop(self):
+        due, later = self.instances[:2]
+        schedule = self.schedule(due, stop_at=self.start + timedelta(minutes=10))
+        self.schedule(later, stop_at=self.start + timedelta(days=1))
+
+        run_scheduler(self.clock, stop=lambda: self.clock.now() > self.start + timedelta(minutes=15))
+
+        self.assertEqual(self.status(due), 'stopped')
+        self.assertEqual(self.status(later), 'running')
+        self.assertEqual(self.aws.calls['ec2', 'StopInstances'], 1)
+        schedule.refresh_from_db()
+        self.assertIsNone(schedule.stop_at)
+        self.assertEqual(schedule.last_action, 'stop')
+
+    def test_idle_rule_only_stops_idle_instances(self):
+        idle, busy, unmeasured = self.instances[:3]
+        for instance in (idle, busy, unmeasured):
+            self.schedule(instance, idle_action='stop', idle_minutes=30, idle_cpu_percent=5.0)
+        self.cpu(idle, 1.0)
+        self.cpu(busy, 50.0)
+
+        counts = run_due(self.start)
+
+        self.assertEqual(counts['stop'], 1)
+        self.assertEqual(self.status(idle), 'stopped')
+        self.assertEqual(self.status(busy), 'running')
+        # No samples is not proof of idleness
+        self.assertEqual(self.status(unmeasured), 'running')
+        self.assertEqual(InstanceSchedule.objects.get(instance=busy).next_due_at, self.start + timedelta(seconds=300))
+
+    def test_failed_call_is_retried(self):
+        instance = self.instances[0]
+        schedule = self.schedule(instance, stop_at=self.start)
+        stop_instances = self.aws._handlers['ec2', 'StopInstances']
+
+        def unavailable(region, params):
+            raise LocalAWSError('Unavailable', 'Service unavailable', 503)
+
+        self.aws.register_handler('ec2', 'StopInstances', unavailable)
+        counts = run_due(self.start)
+        self.assertEqual(counts['failed'], 1)
+        self.assertEqual(self.status(instance), 'running')
+        schedule.refresh_from_db()
+        self.assertEqual(schedule.next_due_at, self.start + timedelta(seconds=300))
+        self.assertEqual(schedule.stop_at, self.start)
+
+        # Not due again before the retry
+        self.assertEqual(run_due(self.start + timedelta(seconds=60))['claimed'], 0)
+
+        self.aws.register_handler('ec2', 'StopInstances', stop_instances)
+        counts = run_due(self.start + timedelta(seconds=300))
+        self.assertEqual(counts['stop'], 1)
+        self.assertEqual(self.status(instance), 'stopped')
+        schedule.refresh_from_db()
+        self.assertIsNone(schedule.stop_at)
+
+
+@skipUnless(asyncssh, "needs asyncssh")
+class SSHFanoutTests(SimpleTestCase):
+    """``fan_out`` against a local ``asyncssh.listen()`` server that answers ``exit N`` with a line and status N."""
+
+    def setUp(self):
+        self.host_key = asyncssh.generate_private_key('ssh-ed25519')
+        self.directory = Path(self.enterContext(tempfile.TemporaryDirectory()))
+
+    @asynccontextmanager
+    async def listen(self):
+        class OpenServer(asyncssh.SSHServer):
+            def begin_auth(self, username):
+                return False
+
+        def handle(process):
+            process.stdout.write(f"{process.get_extra_info('username')} ran {process.command}\n")
+            process.exit(int(process.command.split()[-1]))
+
+        server = await asyncssh.listen(
+            '127.0.0.1', 0, server_factory=OpenServer, server_host_keys=[self.host_key], process_factory=handle,
+        )
+        try:
+            yield server.get_port()
+        finally:
+            server.close()
+            await server.wait_closed()
+
+    def known_hosts(self, port: int, key=None) -> str:
+        path = self.directory / 'known_hosts'
+        public_key = (key or self.host_key).export_public_key().decode()
+        path.write_text(f"[127.0.0.1]:{port} {public_key}")
+        return str(path)
+
+    async def test_fan_out_streams_output_and_counts_exit_codes(self):
+        lines = []
+        async with self.listen() as port, SSHPool(known_hosts=self.known_hosts(port)) as pool:
+            targets = [SSHTarget(1, 'web-1', '127.0.0.1', port, 'alice'), SSHTarget(2, 'web-2', '127.0.0.1', port, 'bob')]
+            result = await fan_out(targets, 'exit 0', on_output=lambda target, stream, line: lines.append((target.name, line)), pool=pool)
+            again = await fan_out(targets[:1], 'exit 3', pool=pool)
+
+        self.assertTrue(result.ok)
+        self.assertEqual(sorted(lines), [('web-1', 'alice ran exit 0'), ('web-2', 'bob ran exit 0')])
+        self.assertEqual(again.exit_codes(), {3: 1})
+
+    async def test_bad_key_fails_only_its_host(self):
+        async with self.listen() as port, SSHPool(known_hosts=self.known_hosts(port)) as pool:
+            targets = [
+                SSHTarget(1, 'web-1', '127.0.0.1', port, 'alice'),
+                SSHTarget(2, 'web-2', '127.0.0.1', port, 'bob', ssh_key='not a private key'),
+            ]
+            result = await fan_out(targets, 'exit 0', pool=pool)
+
+        self.assertEqual(result.exit_codes(), {0: 1, None: 1})
+        self.assertEqual([failed.target.name for failed in result.failed], ['web-2'])
+
+    async def test_unknown_host_key_is_rejected(self):
+        other_key = asyncssh.generate_private_key('ssh-ed25519')
+        async with self.listen() as port, SSHPool(known_hosts=self.known_hosts(port, other_key)) as pool:
+            result = await fan_out([SSHTarget(1, 'web-1', '127.0.0.1', port, 'alice')], 'exit 0', pool=pool)
+
+        self.assertFalse(result.ok)
+        self.assertIsNone(result.results[0].exit_status)
+
+    @override_settings(SSH_KNOWN_HOSTS='', SSH_INSECURE_SKIP_HOST_KEY_CHECK=False)
+    def test_pool_refuses_to_skip_host_key_checks_implicitly(self):
+        with self.assertRaises(ImproperlyConfigured):
+            SSHPool()
+        with self.settings(SSH_INSECURE_SKIP_HOST_KEY_CHECK=True):
+            self.assertIsNone(SSHPool().known_hosts)
+
+
+class RegionLeaseTests(LocalAWSTestCase):
+    regions = ('us-east-1', 'eu-west-1')
+
+    def setUp(self):
+        super().setUp()
+        self.account = user_account(self.user)
+        self.started = timezone.now()
+
+    def as_worker(self, name: str):
+        return mock.patch('resources.api.regions.worker_id', return_value=name)
+
+    def lease(self, region: str = 'us-east-1') -> RegionActivity:
+        return RegionActivity.objects.get(account=self.account.cache_key, region=region)
+
+    def test_lease_blocks_a_second_claim(self):
+        with self.as_worker('node-a:1'):
+            self.assertTrue(claim_region(self.account, 'us-east-1', self.started))
+        with self.as_worker('node-b:1'):
+            self.assertFalse(claim_region(self.account, 'us-east-1', self.started))
+            # Only the holder can release it
+            release_region(self.account, 'us-east-1')
+        self.assertEqual(self.lease().lease_owner, 'node-a:1')
+
+    @override_settings(SYNC_SHARD_LEASE_SECONDS=300)
+    def test_expired_lease_is_taken_over(self):
+        with self.as_worker('node-a:1'):
+            self.assertTrue(claim_region(self.account, 'us-east-1', self.started, now=self.started))
+        with self.as_worker('node-b:1'):
+            self.assertFalse(claim_region(self.account, 'us-east-1', self.started, now=self.started + timedelta(seconds=299)))
+            self.assertTrue(claim_region(self.account, 'us-east-1', self.started, now=self.started + timedelta(seconds=300)))
+        self.assertEqual(self.lease().lease_owner, 'node-b:1')
+
+    def test_region_scanned_since_the_sync_started_is_not_claimed_again(self):
+        with self.as_worker('node-a:1'):
+            self.assertTrue(claim_region(self.account, 'us-east-1', self.started))
+            release_region(self.account, 'us-east-1', count=3)
+        lease = self.lease()
+        self.assertEqual((lease.lease_owner, lease.instance_count), ('', 3))
+        with self.as_worker('node-b:1'):
+            self.assertFalse(claim_region(self.account, 'us-east-1', self.started))
+            # A sync that started after that scan reads it again
+            self.assertTrue(claim_region(self.account, 'us-east-1', timezone.now()))
+
+    def test_sync_skips_regions_leased_elsewhere_and_releases_its_own(self):
+        with self.as_worker('node-b:1'):
+            self.assertTrue(claim_region(self.account, 'eu-west-1', self.started))
+
+        synced = [region for _, region, _ in iter_account_sync([self.account], full=True)]
+
+        self.assertEqual(synced, ['us-east-1'])
+        self.assertEqual(self.lease('us-east-1').lease_owner, '')
+        self.assertGreaterEqual(self.lease('us-east-1').last_scanned_at, self.started)
+        self.assertEqual(self.lease('eu-west-1').lease_owner, 'node-b:1')
+
+    def test_stopping_early_releases_held_leases(self):
+        sync = iter_account_sync([self.account], full=True)
+        next(sync)
+        sync.close()
+        self.assertFalse(RegionActivity.objects.exclude(lease_owner='').exists())
+
+
+class TargetGroupTests(LocalAWSTestCase):
+    def prepare_aws(self):
+        self.arn = self.aws.create_target_group('web')
+        # Launched by the app, so its registration is the app's to manage even outside the group
+        self.launched = self.aws.add_instance('us-east-1', name='launched', tags={MANAGED_BY_TAG: MANAGED_BY_VALUE})
+
+    def setUp(self):
+        super().setUp()
+        self.group = TargetGroup.objects.create(name='web', arn=self.arn, region='us-east-1', owner=self.user)
+        self.members = list(EC2Instance.objects.exclude(aws_instance_id=self.launched).order_by('pk')[:3])
+        self.group.instances.set(self.members)
+
+    @property
+    def registered(self) -> set[str]:
+        return set(self.aws.target_groups[self.arn]['targets'])
+
+    def test_registers_serving_members_and_leaves_foreign_targets(self):
+        stopped = self.members[0]
+        self.ec2().stop_instances(InstanceIds=[stopped.aws_instance_id])
+        EC2Instance.objects.filter(pk=stopped.pk).update(status='stopped')
+        foreign = self.aws.add_instance('us-east-1', name='foreign')
+        unlisted = EC2Instance.objects.exclude(aws_instance_id=self.launched).exclude(pk__in=[m.pk for m in self.members]).first()
+        for instance_id in (stopped.aws_instance_id, foreign, unlisted.aws_instance_id, self.launched):
+            self.aws.target_groups[self.arn]['targets'][instance_id] = 80
+
+        counts = sync_target_groups()
+
+        self.assertEqual(counts['failed'], 0)
+        self.assertEqual(
+            self.registered,
+            {m.aws_instance_id for m in self.members[1:]} | {foreign, unlisted.aws_instance_id},
+        )
+        self.assertEqual(counts['deregistered'], 2)
+
+    def test_nothing_to_do_makes_no_writes(self):
+        sync_target_groups()
+        self.aws.calls.clear()
+        self.assertEqual(sync_target_groups()['registered'], 0)
+        self.assertEqual(self.aws.calls['elbv2', 'RegisterTargets'] + self.aws.calls['elbv2', 'DeregisterTargets'], 0)
+
+
+class InstanceTagTests(LocalAWSTestCase):
+    def test_archived_instance_keeps_its_tags(self):
+        instance = EC2Instance.objects.first()
+        set_instance_tags([instance.pk], {'env': 'prod'})
+        EC2Instance.objects.filter(pk=instance.pk).update(status='terminated', terminated_at=timezone.now() - timedelta(days=30))
+
+        self.assertEqual(archive_terminated(), 1)
+        self.assertFalse(EC2Instance.objects.filter(pk=instance.pk).exists())
+        self.assertEqual(load_tags([instance.pk]), {instance.pk: {'env': 'prod'}})
+
+    def test_admin_shows_tags(self):
+        instance = EC2Instance.objects.first()
+        set_instance_tags([instance.pk], {'env': 'prod'})
+        self.client.force_login(self.user)
+        response = self.client.get(f'/admin/resources/ec2instance/{instance.pk}/change/')
+        self.assertContains(response, 'env=prod')